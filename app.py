@@ -1,52 +1,55 @@
 import streamlit as st
-import firebase_admin
-from firebase_admin import credentials, firestore
-import bcrypt
 import json
-import openai
+import logging # Leveled logging instead of debug prints (MINDSPRING_LOG_LEVEL)
 import uuid
 import base64 # Import base64 for decoding
 import os # Import os for environment variables
-from pypdf import PdfReader # Import PdfReader for reading PDF files
-from gtts import gTTS # Import gTTS for Text-to-Speech
-import io # Import io for handling in-memory audio files
-import requests # Import requests for making HTTP calls
+import itertools # Import itertools for chaining streamed chunks
+import time # Import time for measuring response latency
+# firebase_admin, openai, requests, pypdf, gTTS and PIL are imported by the services that use them, on first use
+from mindspring import syllabus_cache # Shared on-disk cache of extracted syllabus text
+from mindspring import retrieval # Local BM25 index over syllabus chunks
+from mindspring import context_budget # Token budget and rolling window for chat requests
+from mindspring import clients # Pooled, retrying OpenAI and HTTP clients
+from mindspring import chat_store # Append-only chat message storage
+from mindspring import unit_of_work # Batched write-behind of user changes
+from mindspring import token_ledger # Transactional token balance and audit ledger
+from mindspring import response_cache # Shared replies to repeated questions
+from mindspring import speech # Cached, background text-to-speech
+from mindspring import image_jobs # Background queue for visual explanations
+from mindspring import image_store # Content-addressed storage for generated images
+from mindspring import chat_view # Paginated, pre-formatted chat display blocks
+from mindspring import prompts # Cache-friendly tutor system prompts
+from mindspring import subjects # Registry of the subjects in subject_context/
+from mindspring import prewarm # Startup extraction of all subject files
+from mindspring import accounts # Credential documents and cached user profiles
+from mindspring import passwords # bcrypt worker pool and login rate limiting
+from mindspring import tracing # Per-stage timings, JSON-lines / Prometheus export
+from mindspring import services # Firebase initialization, once per process
+from mindspring import turns # Firestore work of a chat turn, overlapped with the OpenAI request
+
+# --- Logging ---
+# Messages below MINDSPRING_LOG_LEVEL are dropped before they are formatted, so debug logging costs nothing when off
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("mindspring").setLevel(os.environ.get("MINDSPRING_LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger("mindspring.app")
 
 # --- Firebase Initialization ---
-# Check if Firebase app is already initialized to prevent re-initialization errors
-# Use firebase_admin._apps to check if any app is already initialized
-if not firebase_admin._apps:
-    try:
-        # Attempt to get the Base64 encoded Firebase service account key from environment variables
-        firebase_service_account_key_b64 = os.environ.get("FIREBASE_SERVICE_ACCOUNT_KEY_B64")
+# Firebase is initialized once per process, on the first run that needs it, not on every rerun
+@st.cache_resource(show_spinner=False)
+def get_db():
+    """Returns the process-wide Firestore client, or None if no service account key is configured."""
+    return services.firestore_client()
 
-        if firebase_service_account_key_b64:
-            # Decode the Base64 string back to JSON content
-            firebase_service_account_key_str = base64.b64decode(firebase_service_account_key_b64).decode('utf-8')
-            
-            # Initialize Firebase Admin SDK
-            cred = credentials.Certificate(json.loads(firebase_service_account_key_str))
-            firebase_admin.initialize_app(cred)
-            
-            st.session_state.firebase_initialized = True
-            st.success("Firebase initialized successfully!")
-            # No rerun needed here, as it's part of the initial load
-        else:
-            st.warning("Firebase service account key (FIREBASE_SERVICE_ACCOUNT_KEY_B64) not found in environment variables. Please set it securely.")
-            st.session_state.firebase_initialized = False
-    except Exception as e:
-        st.error(f"Error initializing Firebase from environment variable: {e}")
-        st.session_state.firebase_initialized = False
-else:
-    # If an app is already initialized, set the session state flag to True
-    st.session_state.firebase_initialized = True
-    # st.info("Firebase app already initialized.") # Optional: for debugging
-
-# Ensure db client is available if Firebase initialized
-if st.session_state.firebase_initialized:
-    db = firestore.client()
-else:
-    db = None # db will be None until Firebase is initialized
+try:
+    db = get_db()
+    if db is None:
+        st.warning("Firebase service account key (FIREBASE_SERVICE_ACCOUNT_KEY_B64) not found in environment variables. Please set it securely.")
+except Exception as e:
+    # Not cached, so the next run tries again
+    st.error(f"Error initializing Firebase from environment variable: {e}")
+    db = None
+st.session_state.firebase_initialized = db is not None
 
 # --- OpenAI API Key Setup ---
 try:
@@ -56,6 +59,72 @@ except KeyError:
     st.error("OpenAI API key not found in Streamlit secrets. Please add it.")
     st.session_state.openai_initialized = False
 
+# --- Shared API Clients ---
+# One pooled client of each kind per process, shared by every session, so requests
+# reuse keep-alive connections instead of opening a new TLS connection per call
+@st.cache_resource
+def get_openai_client(api_key):
+    """Returns the process-wide OpenAI client."""
+    return clients.build_openai_client(api_key)
+
+@st.cache_resource
+def get_http_session():
+    """Returns the process-wide HTTP session used for the Imagen API."""
+    return clients.build_http_session()
+
+@st.cache_resource
+def get_response_cache():
+    """Returns the process-wide cache of tutor replies, shared by all students."""
+    return response_cache.ResponseCache()
+
+@st.cache_resource
+def get_subject_registry():
+    """Returns the process-wide subject registry, scanned and validated once and then watched for changes."""
+    registry = subjects.SubjectRegistry()
+    registry.scan() # Logs a warning for each problem found
+    registry.start_watching()
+    return registry
+
+@st.cache_resource
+def get_prewarmer():
+    """Starts extracting and indexing every subject in the background (once per process)."""
+    prewarmer = prewarm.Prewarmer(get_subject_registry())
+    prewarmer.start()
+    return prewarmer
+
+# Longest a student waits for a subject that is still being prepared before it is loaded directly
+SUBJECT_PREPARE_WAIT_SECONDS = 60
+
+@st.cache_resource
+def get_account_store():
+    """Returns the process-wide account store, whose profile cache is shared by every session."""
+    return accounts.AccountStore(db)
+
+@st.cache_resource
+def get_password_hasher():
+    """Returns the process-wide bcrypt pool, so hashing never runs on the script thread."""
+    return passwords.PasswordHasher()
+
+@st.cache_resource
+def get_login_limiter():
+    """Returns the process-wide login rate limiter."""
+    return passwords.LoginRateLimiter()
+
+@st.cache_resource
+def get_image_store():
+    """Returns the process-wide store for generated images (local disk or a bucket)."""
+    return image_store.default_store()
+
+@st.cache_resource
+def get_turn_io():
+    """Returns the process-wide pool that runs a turn's Firestore work beside its OpenAI request."""
+    return turns.TurnIO()
+
+@st.cache_resource
+def get_speech_synthesizer():
+    """Returns the process-wide text-to-speech pool and audio cache."""
+    return speech.SpeechSynthesizer()
+
 # --- Session State Initialization ---
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -67,27 +136,57 @@ if 'user_data' not in st.session_state:
     st.session_state.user_data = None
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'chat_session_id' not in st.session_state:
+    st.session_state.chat_session_id = None # Firestore chat session the history is stored in
+if 'chat_next_seq' not in st.session_state:
+    st.session_state.chat_next_seq = 0 # Sequence number for the next stored message
+if 'pending_writes' not in st.session_state:
+    st.session_state.pending_writes = None # UnitOfWork for the logged-in user
+if 'chat_has_older' not in st.session_state:
+    st.session_state.chat_has_older = False # True if older messages exist beyond the loaded page
 if 'current_study_subject' not in st.session_state:
     st.session_state.current_study_subject = None
 if 'subject_context_loaded' not in st.session_state:
     st.session_state.subject_context_loaded = False
-if 'active_syllabus' not in st.session_state:
-    st.session_state.active_syllabus = ""
-if 'active_subject_context' not in st.session_state:
-    st.session_state.active_subject_context = ""
-if 'generating_image' not in st.session_state:
-    st.session_state.generating_image = False
+# The syllabus text and subject context stay in the process-wide caches; a session only
+# keeps the syllabus path (for retrieval) and its chat history
+if 'active_syllabus_path' not in st.session_state:
+    st.session_state.active_syllabus_path = None
+if 'image_jobs' not in st.session_state:
+    st.session_state.image_jobs = [] # Ids of this session's visuals that haven't been shown yet
+if 'chat_visible_messages' not in st.session_state:
+    st.session_state.chat_visible_messages = chat_view.VISIBLE_PAGE_SIZE # Messages shown in the chat display
+if 'expanded_images' not in st.session_state:
+    st.session_state.expanded_images = set() # Image messages shown at full size instead of as thumbnails
+if 'chat_resume_pending' not in st.session_state:
+    st.session_state.chat_resume_pending = False # The stored chat is loaded when the tutor page is first opened
+if 'reply_speech' not in st.session_state:
+    st.session_state.reply_speech = None # (message id, SpeechJob) for the latest tutor reply
+if 'context_window' not in st.session_state:
+    # Bounds each chat request: pinned system prompt, recent turns, summary of older turns
+    st.session_state.context_window = context_budget.ContextWindow()
 
 
 # --- Helper Functions ---
 
 def hash_password(password):
-    """Hashes a password using bcrypt."""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Hashes a password using bcrypt (on the shared worker pool, with the configured cost)."""
+    return get_password_hasher().hash(password)
 
 def check_password(password, hashed_password):
-    """Checks if a password matches a hashed password."""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    """Checks if a password matches a hashed password (on the shared worker pool)."""
+    return get_password_hasher().verify(password, hashed_password)
+
+def rehash_password_if_needed(username, password, hashed_password):
+    """Stores a new hash of a just-verified password if its cost differs from the configured one."""
+    if not get_password_hasher().needs_rehash(hashed_password):
+        return
+    try:
+        get_account_store().set_password_hash(username, hash_password(password))
+        logger.debug("Rehashed the password of %s with cost %s", username, passwords.BCRYPT_ROUNDS)
+    except Exception as e:
+        # The old hash still works, so the login goes ahead; it is retried next time
+        logger.error("Failed to rehash the password of %s: %s", username, e)
 
 def get_user_doc_ref(username):
     """Returns the Firestore document reference for a given username."""
@@ -98,154 +197,531 @@ def get_user_doc_ref(username):
         return None # Or raise an error, depending on desired behavior
 
 def load_user_data(username):
-    """Loads user data from Firestore."""
-    doc_ref = get_user_doc_ref(username)
-    if doc_ref: # Check if doc_ref is valid
-        user_doc = doc_ref.get()
-        if user_doc.exists:
-            st.session_state.user_data = user_doc.to_dict()
-            st.session_state.chat_history = st.session_state.user_data.get('chat_history', [])
-            return True
+    """Loads the user's profile (not their chat history) into session state."""
+    if not db:
+        return False
+    # Only the profile fields are read, and recently read profiles come from the process cache
+    with tracing.span("firestore.profile", user=username):
+        profile = get_account_store().profile(username)
+    if profile is None:
+        return False
+    # The authoritative balance lives in the token ledger
+    with tracing.span("firestore.token_balance", user=username):
+        profile['tokens'] = token_ledger.TokenLedger(db).balance(username)
+    st.session_state.user_data = profile
+    st.session_state.chat_resume_pending = True # Loaded once the tutor page needs it
+    return True
+
+def get_pending_writes():
+    """Returns the logged-in user's UnitOfWork, which batches Firestore writes until the end of the run."""
+    if not (st.session_state.username and db): # Ensure db is initialized
+        return None
+    pending = st.session_state.pending_writes
+    if pending is None or pending.username != st.session_state.username:
+        pending = unit_of_work.UnitOfWork(db, st.session_state.username)
+        st.session_state.pending_writes = pending
+    return pending
+
+def flush_pending_writes():
+    """Commits the queued Firestore writes as one batch; on failure they stay queued for the next run."""
+    pending = st.session_state.get('pending_writes')
+    if pending is None:
+        return
+    profile_changed = pending.has_field_changes()
+    try:
+        with tracing.span("firestore.flush"):
+            pending.flush()
+    except Exception as e:
+        logger.error("Failed to save changes to Firestore, will retry: %s", e)
+        return
+    if profile_changed:
+        get_account_store().invalidate(pending.username) # Other sessions re-read the saved profile
+
+def update_user_data(fields):
+    """Updates the given user fields in session state and queues them for Firestore."""
+    pending = get_pending_writes()
+    if st.session_state.user_data and pending:
+        st.session_state.user_data.update(fields) # Update session state immediately
+        pending.set_fields(fields) # Only the changed fields are written, at the end of the run
+        return True
     return False
 
-def update_user_data(data):
-    """Updates user data in Firestore."""
-    if st.session_state.username and st.session_state.user_data and db: # Ensure db is initialized
-        doc_ref = get_user_doc_ref(st.session_state.username)
-        if doc_ref: # Check if doc_ref is valid
-            doc_ref.set(data, merge=True) # Use merge=True to update specific fields
-            st.session_state.user_data = data # Update session state immediately
-            return True
-    return False
+def charge_tokens(amount, request_key, reason):
+    """Debits tokens in a Firestore transaction and updates the displayed balance.
 
-def save_chat_history():
-    """Saves the current chat history to Firestore."""
-    if st.session_state.username and st.session_state.user_data and db: # Ensure db is initialized
-        doc_ref = get_user_doc_ref(st.session_state.username)
-        if doc_ref: # Check if doc_ref is valid
-            doc_ref.update({'chat_history': st.session_state.chat_history})
+    Raises token_ledger.InsufficientTokens if the server-side balance is too low. Retrying
+    with the same request_key never charges twice.
+    """
+    with tracing.span("firestore.token_debit", reason=reason):
+        balance = token_ledger.TokenLedger(db).debit(st.session_state.username, amount, request_key, reason)
+    st.session_state.user_data['tokens'] = balance
+
+def refund_tokens(request_key):
+    """Refunds the charge made under request_key (at most once) and updates the displayed balance."""
+    try:
+        balance = token_ledger.TokenLedger(db).refund(st.session_state.username, request_key)
+    except Exception as e:
+        logger.error("Failed to refund tokens for %s: %s", request_key, e)
+        return
+    if balance is not None:
+        st.session_state.user_data['tokens'] = balance
+
+def add_chat_message(role, content):
+    """Appends a message to the chat history in session state (without storing it). Returns the message."""
+    message = chat_store.new_message(role, content, st.session_state.chat_next_seq)
+    st.session_state.chat_next_seq += 1
+    st.session_state.chat_history.append(message)
+    return message
+
+def queue_chat_message(message):
+    """Queues a message of the chat history for Firestore."""
+    pending = get_pending_writes()
+    if st.session_state.chat_session_id and pending:
+        # Queued: written together with the turn's other changes at the end of the run
+        pending.put_document(
+            chat_store.ChatStore(db).message_ref(st.session_state.username, st.session_state.chat_session_id, message.id),
+            chat_store.ChatStore.message_document(message),
+        )
+
+def save_chat_message(role, content):
+    """Appends a message to the chat history and stores just that message in Firestore."""
+    message = add_chat_message(role, content)
+    queue_chat_message(message)
+    return message
+
+def start_turn_charge(message, request_key):
+    """Starts debiting a chat turn and storing the student's message with it, on the turn I/O pool.
+
+    Returns the future; pass it to settle_turn_charge() once the reply has arrived.
+    """
+    # Session state is only available on the script thread, so its values are passed in
+    return get_turn_io().submit(
+        turns.charge_and_store, token_ledger.TokenLedger(db), chat_store.ChatStore(db),
+        st.session_state.username, st.session_state.chat_session_id, message, 1, request_key, "chat turn",
+    )
+
+def cancel_turn_charge(charge, request_key):
+    """Refunds a turn whose reply didn't complete, after waiting for its debit so the refund can't overtake it."""
+    try:
+        charge.result(timeout=turns.CHARGE_TIMEOUT_SECONDS)
+    except token_ledger.InsufficientTokens:
+        return # Nothing was charged
+    except Exception as e:
+        # Refunding a debit that never committed changes nothing, so the refund is still tried
+        logger.warning("Charge for %s did not complete: %s", request_key, e)
+    refund_tokens(request_key)
+
+def settle_turn_charge(charge):
+    """Waits for a turn's charge and updates the displayed balance.
+
+    Raises token_ledger.InsufficientTokens if the turn couldn't be paid for.
+    """
+    st.session_state.user_data['tokens'] = charge.result(timeout=turns.CHARGE_TIMEOUT_SECONDS)
+
+def reset_chat_session():
+    """Clears the chat held in session state (the stored session is kept)."""
+    st.session_state.chat_history = []
+    st.session_state.chat_session_id = None
+    st.session_state.chat_next_seq = 0
+    st.session_state.chat_has_older = False
+    st.session_state.chat_visible_messages = chat_view.VISIBLE_PAGE_SIZE
+    st.session_state.reply_speech = None
+    st.session_state.context_window.reset()
+
+def resume_chat_session():
+    """Loads the newest page of the user's active chat session, if any, into session state."""
+    user_data = st.session_state.user_data
+    session_id = user_data.get('active_chat_session') if user_data else None
+    if not session_id or not db:
+        return False
+    with tracing.span("firestore.chat_load"):
+        loaded = chat_store.ChatStore(db).load_session(st.session_state.username, session_id)
+    if loaded is None:
+        return False
+    session_data, system_prompt, messages, has_older = loaded
+    if not load_study_subject(session_data['subject']):
+        return False
+
+    reset_chat_session()
+    st.session_state.chat_session_id = session_id
+    st.session_state.chat_history = [chat_store.system_message(system_prompt)] + hold_images_by_reference(messages)
+    st.session_state.chat_next_seq = messages[-1].seq + 1 if messages else 0
+    st.session_state.chat_has_older = has_older
+    # Pick up visuals still being generated from an earlier visit (refunds any that were lost)
+    st.session_state.image_jobs = get_image_jobs().recover(st.session_state.username)
+    return True
+
+def hold_images_by_reference(messages):
+    """Moves images of loaded messages that still hold a data URL (saved before the image store) into the store.
+
+    Only the session's copy is changed to the image reference; the stored message keeps its data URL.
+    Returns messages.
+    """
+    for msg in messages:
+        if msg.role == "image" and not image_store.is_image_ref(msg.content):
+            try:
+                msg.content = get_image_store().put(image_store.decode_data_url(msg.content))
+            except Exception as e:
+                logger.warning("Kept the data URL of image message %s: %s", msg.id, e)
+    return messages
+
+def load_older_chat_messages():
+    """Prepends the previous page of stored messages to the chat history."""
+    stored = [msg for msg in st.session_state.chat_history if msg.seq is not None]
+    if not stored or not st.session_state.chat_session_id or not db:
+        st.session_state.chat_has_older = False
+        return
+    older, has_older = chat_store.ChatStore(db).load_older(
+        st.session_state.username, st.session_state.chat_session_id, stored[0].seq
+    )
+    # The system prompt stays first
+    st.session_state.chat_history[1:1] = hold_images_by_reference(older)
+    st.session_state.chat_has_older = has_older
 
 # Function to read text from a PDF file
 def read_pdf_text(file_path):
-    """Reads text content from a PDF file."""
+    """Reads text content from a PDF file, using the shared extraction cache."""
     text_content = ""
-    print(f"DEBUG: Attempting to read PDF: {file_path}") # Debug print
+    logger.debug("Attempting to read PDF: %s", file_path)
     try:
-        reader = PdfReader(file_path)
-        for page in reader.pages:
-            text_content += page.extract_text() + "\n"
-        print(f"DEBUG: Successfully read PDF: {file_path}, content length: {len(text_content)}") # Debug print
+        # Extraction only happens when the PDF is new or changed; otherwise the cached text is reused
+        with tracing.span("syllabus.load", path=file_path):
+            syllabus = syllabus_cache.get_syllabus(file_path)
+            text_content = syllabus.text
+        logger.debug("Successfully read PDF: %s, content length: %s", file_path, len(text_content))
+        # Headers, page numbers and boilerplate are stripped at extraction time; log how much that saved
+        sizes = syllabus.meta.get("normalization")
+        if sizes:
+            logger.debug("Normalized %s: %s -> %s chars, %s -> %s tokens", file_path,
+                         sizes['raw_chars'], sizes['chars'], sizes['raw_tokens'], sizes['tokens'])
+        # Pages that couldn't be extracted are left empty rather than failing the whole file
+        for failed in syllabus.meta.get("failed_pages") or ():
+            logger.warning("Page %s of %s could not be read: %s", failed['page'], file_path, failed['error'])
     except FileNotFoundError:
-        print(f"ERROR: PDF file not found: {file_path}") # Debug print
+        logger.error("PDF file not found: %s", file_path)
         st.error(f"PDF file not found: {file_path}")
         return None
     except Exception as e:
-        print(f"ERROR: Error reading PDF file {file_path}: {e}") # Debug print
+        logger.error("Error reading PDF file %s: %s", file_path, e)
         st.error(f"Error reading PDF file {file_path}: {e}")
         return None
     return text_content
 
-# Function to read text from a plain text file
-def read_text_file(file_path):
-    """Reads text content from a plain text file."""
-    text_content = ""
-    print(f"DEBUG: Attempting to read TXT: {file_path}") # Debug print
+# Number of syllabus chunks sent with each question instead of the whole syllabus
+SYLLABUS_EXCERPTS_PER_TURN = 4
+
+def build_tutor_messages(chat_history, syllabus_path, question):
+    """Returns the messages for an OpenAI call, adding the syllabus excerpts relevant to the question."""
+    # Only roles the chat API understands; generated images stay in the local history
+    messages = [
+        {"role": msg.role, "content": msg.content}
+        for msg in chat_history if msg.role in ("system", "user", "assistant")
+    ]
+    if not syllabus_path or not messages or messages[0]["role"] != "system":
+        return messages
+
+    # Include the previous question so follow-ups like "explain that again" still retrieve the topic
+    previous_questions = [msg["content"] for msg in messages[1:] if msg["role"] == "user"][-2:]
+    query = " ".join(previous_questions + [question])
+    excerpts = retrieval.retrieve(syllabus_path, query, k=SYLLABUS_EXCERPTS_PER_TURN)
+    if excerpts:
+        # Sent last (just before the question) so the system prompt and earlier turns stay an
+        # unchanged prefix from turn to turn, which OpenAI can serve from its prompt cache
+        messages.append({
+            "role": "system",
+            "content": "Relevant syllabus excerpts for the student's question:\n" + retrieval.format_excerpts(excerpts),
+        })
+    return messages
+
+# Stream tutor replies token-by-token (set MINDSPRING_STREAM_RESPONSES=0 to wait for the full reply)
+STREAM_TUTOR_RESPONSES = os.environ.get("MINDSPRING_STREAM_RESPONSES", "1") != "0"
+
+def request_tutor_reply(client, messages, placeholder, on_text=None):
+    """Requests a tutor reply, rendering it into the placeholder as it arrives. Returns the full text.
+
+    on_text, if given, is called with the reply so far each time more of it arrives.
+    """
+    request_args = dict(
+        model="gpt-4.1-nano", # Changed model to gpt-4.1-nano for larger context window
+        messages=messages,
+        max_tokens=200,
+        temperature=0.7,
+    )
+    started = time.perf_counter()
+    if not STREAM_TUTOR_RESPONSES:
+        with st.spinner("Tutor is thinking..."):
+            response = client.chat.completions.create(**request_args)
+        total_seconds = time.perf_counter() - started
+        cached_tokens = prompts.record_usage(response.usage, total_seconds)
+        tracing.record("openai.ttft", total_seconds, streamed=False)
+        tracing.record("openai.total", total_seconds, streamed=False, cached_tokens=cached_tokens)
+        logger.debug("Prompt tokens served from OpenAI's cache: %s", cached_tokens)
+        tutor_response = response.choices[0].message.content
+        placeholder.markdown(f"**Tutor:** {tutor_response}")
+        return tutor_response
+
+    stream = None
+    parts = []
+    usage = None
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            text_content = f.read()
-        print(f"DEBUG: Successfully read TXT: {file_path}, content length: {len(text_content)}") # Debug print
-    except FileNotFoundError:
-        print(f"ERROR: Text file not found: {file_path}") # Debug print
-        st.error(f"Text file not found: {file_path}")
-        return None
-    except Exception as e:
-        print(f"ERROR: Error reading text file {file_path}: {e}") # Debug print
-        st.error(f"Error reading text file {file_path}: {e}")
+        with st.spinner("Tutor is thinking..."): # Only shown until the first token arrives
+            # include_usage adds a final chunk with token counts, including cached prompt tokens
+            stream = client.chat.completions.create(**request_args, stream=True, stream_options={"include_usage": True})
+            chunks = iter(stream)
+            first_chunk = next(chunks, None)
+        first_token_seconds = time.perf_counter() - started
+        for chunk in itertools.chain([first_chunk] if first_chunk else [], chunks):
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                partial_response = ''.join(parts)
+                placeholder.markdown(f"**Tutor:** {partial_response}▌")
+                if on_text is not None:
+                    on_text(partial_response)
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+    finally:
+        # Closes the connection if the run is cancelled or fails mid-stream
+        if stream is not None:
+            stream.close()
+    cached_tokens = prompts.record_usage(usage, first_token_seconds)
+    tracing.record("openai.ttft", first_token_seconds, streamed=True)
+    tracing.record("openai.total", time.perf_counter() - started, streamed=True, cached_tokens=cached_tokens,
+                   completion_tokens=getattr(usage, "completion_tokens", None))
+    logger.debug("Prompt tokens served from OpenAI's cache: %s", cached_tokens)
+    tutor_response = "".join(parts)
+    placeholder.markdown(f"**Tutor:** {tutor_response}")
+    return tutor_response
+
+def load_study_subject(subject):
+    """Prepares a subject's syllabus and makes it the session's subject.
+
+    Returns the subject's registry entry, or None (after showing an error) on failure.
+    """
+    # Paths and context come from the subject registry, which already checked the files exist
+    subject_entry = get_subject_registry().get(subject)
+    if subject_entry is None:
+        logger.error("Subject not available: %s", subject)
+        st.error(f"{subject} is not available right now. Please choose another subject.")
         return None
-    return text_content
+
+    # Load syllabus file (PDF); some subjects only have context
+    prewarmer = get_prewarmer()
+    if not prewarmer.is_ready(subject):
+        # Another process is already extracting it; waiting avoids doing the same work twice
+        with st.spinner(f"Preparing {subject}... this only happens once after a restart."):
+            with tracing.span("subject.prewarm_wait", subject=subject):
+                prewarmer.wait(subject, timeout=SUBJECT_PREPARE_WAIT_SECONDS)
+    if subject_entry.syllabus_path:
+        # The text stays in the syllabus cache: questions are answered from retrieved excerpts
+        if read_pdf_text(subject_entry.syllabus_path) is None: # read_pdf_text returns None on error
+            logger.debug("Syllabus content is None. Stopping.")
+            return None
+        with tracing.span("retrieval.index", subject=subject):
+            retrieval.get_index(subject_entry.syllabus_path) # Build (or load) the retrieval index up front
+
+    st.session_state.current_study_subject = subject
+    st.session_state.active_syllabus_path = subject_entry.syllabus_path
+    st.session_state.subject_context_loaded = True
+    return subject_entry
 
 # Function for Text-to-Speech
-def text_to_speech(text):
-    """Converts text to speech and returns audio bytes."""
+# Seconds between checks for reply audio that is still being synthesized
+SPEECH_POLL_SECONDS = 1.0
+
+def start_reply_speech(message):
+    """Starts converting a tutor reply to speech in the background."""
     try:
-        tts = gTTS(text=text, lang='en', slow=False)
-        fp = io.BytesIO()
-        tts.save(fp)
-        fp.seek(0)
-        return fp.read()
+        st.session_state.reply_speech = (message.id, get_speech_synthesizer().submit(message.content))
     except Exception as e:
-        st.error(f"Error converting text to speech: {e}")
-        return None
-
-# Function to generate image using Imagen API (now synchronous)
-def generate_image(prompt):
-    """Generates an image using the Imagen API."""
-    st.session_state.generating_image = True
-    print(f"DEBUG: Starting image generation for prompt: {prompt}")
+        logger.error("Could not start text to speech: %s", e)
+        st.session_state.reply_speech = None
+
+def render_reply_audio():
+    """Shows the latest reply's audio: the first sentence as soon as it is ready, then the rest."""
+    _, job = st.session_state.reply_speech
+    first_audio = job.first_chunk()
+    if first_audio is not None:
+        st.audio(first_audio, format='audio/mp3', start_time=0)
+    remaining_audio = job.remainder()
+    if first_audio is not None and remaining_audio:
+        st.audio(remaining_audio, format='audio/mp3', start_time=0)
+    if job.failed():
+        st.caption("Audio is not available for this reply.")
+    elif not job.done():
+        st.caption("Preparing audio...")
+
+@st.fragment(run_every=SPEECH_POLL_SECONDS)
+def poll_reply_audio():
+    """Re-renders the reply audio until synthesis finishes, without rerunning the whole page."""
+    if st.session_state.reply_speech is None:
+        return
+    render_reply_audio()
+    if st.session_state.reply_speech[1].done():
+        st.rerun() # One full rerun shows the finished audio and stops the polling
+
+# Function to generate image using Imagen API (runs on the image job workers, not the script thread)
+def generate_image(http_session, prompt):
+    """Generates an image using the Imagen API. Returns the PNG bytes; raises RuntimeError on failure."""
+    logger.debug("Starting image generation for prompt: %s", prompt)
+
+    # Placeholder for API key, Canvas will inject it at runtime if empty
+    apiKey = "" 
+    apiUrl = clients.IMAGEN_API_URL + "?key=" + apiKey
+
+    payload = {
+        "instances": {"prompt": prompt},
+        "parameters": {"sampleCount": 1}
+    }
+    
+    headers = {'Content-Type': 'application/json'}
+    
+    logger.debug("Making POST request to: %s", apiUrl)
+    if logger.isEnabledFor(logging.DEBUG): # Skip serializing the payload unless it is logged
+        logger.debug("Request payload: %s", json.dumps(payload))
     
-    # Create a placeholder for status messages during image generation
-    status_placeholder = st.empty()
-    status_placeholder.info("Starting image generation...")
-
     try:
-        # Placeholder for API key, Canvas will inject it at runtime if empty
-        apiKey = "" 
-        apiUrl = "https://generativelanguage.googleapis.com/v1beta/models/imagen-3.0-generate-002:predict?key=" + apiKey
-
-        payload = {
-            "instances": {"prompt": prompt},
-            "parameters": {"sampleCount": 1}
-        }
-        
-        headers = {'Content-Type': 'application/json'}
-        
-        print(f"DEBUG: Making POST request to: {apiUrl}")
-        print(f"DEBUG: Request payload: {json.dumps(payload)}")
-        
-        status_placeholder.info("Sending request to image generation API...")
-        response = requests.post(apiUrl, headers=headers, data=json.dumps(payload))
-        
-        print(f"DEBUG: Imagen API response status code: {response.status_code}")
-        
-        # Try to parse JSON response, but handle cases where it's not JSON
-        try:
-            result = response.json()
-            print(f"DEBUG: Imagen API response JSON: {json.dumps(result, indent=2)}")
-        except json.JSONDecodeError:
-            result = {"error": "JSONDecodeError", "raw_response": response.text}
-            print(f"ERROR: Imagen API response is not valid JSON. Raw response: {response.text}")
-            status_placeholder.error(f"Image generation API returned non-JSON response. Status: {response.status_code}. Check logs for details.")
-            return None
-
-        # Check for HTTP errors
-        if not response.ok: # response.ok is True for 2xx status codes
-            error_message = f"Image generation API returned an error. Status: {response.status_code}. Details: {result.get('error', {}).get('message', 'No specific error message.')}"
-            print(f"ERROR: {error_message}")
-            status_placeholder.error(error_message)
-            return None
-
-        if result.get("predictions") and len(result["predictions"]) > 0 and result["predictions"][0].get("bytesBase64Encoded"):
-            image_url = f"data:image/png;base64,{result['predictions'][0]['bytesBase64Encoded']}"
-            print(f"DEBUG: Successfully generated image. Image URL length: {len(image_url)}")
-            status_placeholder.success("Image generated successfully!")
-            return image_url
+        # Pooled session: keep-alive connections, timeouts and backoff on 429/5xx
+        response = http_session.post(apiUrl, headers=headers, data=json.dumps(payload))
+    except clients.request_errors() as req_err:
+        logger.error("Error calling Imagen API: %s", req_err)
+        raise RuntimeError(f"Error calling Imagen API: {req_err}") from req_err
+    
+    logger.debug("Imagen API response status code: %s", response.status_code)
+    
+    # Try to parse JSON response, but handle cases where it's not JSON
+    try:
+        result = response.json()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Imagen API response JSON: %s", json.dumps(result, indent=2)[:1000])
+    except json.JSONDecodeError:
+        logger.error("Imagen API response is not valid JSON. Raw response: %s", response.text)
+        raise RuntimeError(f"Image generation API returned non-JSON response. Status: {response.status_code}.")
+
+    # Check for HTTP errors
+    if not response.ok: # response.ok is True for 2xx status codes
+        error_message = f"Image generation API returned an error. Status: {response.status_code}. Details: {result.get('error', {}).get('message', 'No specific error message.')}"
+        logger.error(error_message)
+        raise RuntimeError(error_message)
+
+    if result.get("predictions") and len(result["predictions"]) > 0 and result["predictions"][0].get("bytesBase64Encoded"):
+        image_bytes = base64.b64decode(result['predictions'][0]['bytesBase64Encoded'])
+        logger.debug("Successfully generated image. Image size: %s bytes", len(image_bytes))
+        return image_bytes
+    logger.error("Image generation failed: No image data or bytesBase64Encoded found in response.")
+    raise RuntimeError("Image generation failed: No image data returned.")
+
+def create_visual(client, http_session, store, tutor_message):
+    """Writes an image prompt for a tutor message, generates the image and stores it. Returns (prompt, image_ref)."""
+    # Use OpenAI to generate a concise image prompt from the tutor's last response
+    image_prompt_generation_messages = [
+        {"role": "system", "content": "You are an assistant that generates concise, descriptive image prompts based on provided text, suitable for a visual learner. Focus on key concepts. Max 50 words."},
+        {"role": "user", "content": f"Generate an image prompt based on this: {tutor_message}"}
+    ]
+    with tracing.span("openai.image_prompt"):
+        prompt_response = client.chat.completions.create(
+            model="gpt-4.1-nano", # Using gpt-4.1-nano for prompt generation as well
+            messages=image_prompt_generation_messages,
+            max_tokens=50,
+            temperature=0.7
+        )
+    image_gen_prompt = prompt_response.choices[0].message.content
+    if not image_gen_prompt:
+        raise RuntimeError("Could not generate a suitable image prompt.")
+    # Only a short reference goes into the chat history; the bytes live in the image store
+    with tracing.span("imagen.generate"):
+        image_bytes = generate_image(http_session, image_gen_prompt)
+    with tracing.span("imagen.store", bytes=len(image_bytes)):
+        return image_gen_prompt, store.put(image_bytes)
+
+@st.cache_resource
+def get_image_jobs():
+    """Returns the process-wide queue that generates visuals in the background."""
+    client = get_openai_client(openai_api_key)
+    http_session = get_http_session()
+    store = get_image_store()
+    return image_jobs.ImageJobQueue(db, lambda tutor_message: create_visual(client, http_session, store, tutor_message))
+
+# Seconds between checks on visuals that are still being generated
+IMAGE_POLL_SECONDS = 2.0
+
+def collect_image_jobs():
+    """Adds finished visuals to the chat (or reports their failure) and stops tracking them."""
+    queue = get_image_jobs()
+    for job_id in list(st.session_state.image_jobs):
+        job = queue.get(job_id)
+        if job is not None and not job.finished:
+            continue
+        st.session_state.image_jobs.remove(job_id)
+        if job is None:
+            continue # Already recovered and refunded
+        if job.status == image_jobs.SUCCEEDED:
+            save_chat_message("assistant", f"Here is a visual for: '{job.prompt}'")
+            save_chat_message("image", job.image_ref)
         else:
-            print(f"ERROR: Image generation failed: No image data or bytesBase64Encoded found in response.")
-            status_placeholder.error("Image generation failed: No image data returned. Check logs for details.")
-            return None
-    except requests.exceptions.RequestException as req_err:
-        print(f"ERROR: Error calling Imagen API: {req_err}")
-        status_placeholder.error(f"Error calling Imagen API: {req_err}. Check logs for details.")
-        return None
-    except Exception as e:
-        print(f"ERROR: An unexpected error occurred during image generation: {e}")
-        status_placeholder.error(f"An unexpected error occurred during image generation: {e}. Check logs for details.")
-        return None
-    finally:
-        st.session_state.generating_image = False
-        print("DEBUG: Finished image generation attempt.")
-        # Clear the status message after a short delay or on next interaction
-        # For simplicity, we'll let it stay until the next rerun or user interaction.
+            refund_tokens(job.request_key) # Already refunded by the worker; this refreshes the balance
+            st.error(f"Failed to generate visual explanation: {job.error}. Your tokens have been refunded.")
+        queue.mark_delivered(job_id)
+
+def render_chat_image(container, chat_message):
+    """Shows an image message as a thumbnail; the full-size image is only loaded when asked for."""
+    content = chat_message.content
+    if not image_store.is_image_ref(content):
+        container.image(content, caption="AI Generated Visual") # Older messages hold a data URL
+        return
+    try:
+        if content in st.session_state.expanded_images:
+            container.image(get_image_store().get(content), caption="AI Generated Visual")
+        else:
+            container.image(get_image_store().thumbnail(content), caption="AI Generated Visual")
+    except FileNotFoundError:
+        container.caption("This visual is no longer available.")
+        return
+    # Callbacks update the state before the rerun, so only the chat fragment needs to redraw
+    if content in st.session_state.expanded_images:
+        container.button("Show smaller", key=f"shrink-{chat_message.id or content}",
+                         on_click=st.session_state.expanded_images.discard, args=(content,))
+    else:
+        container.button("View full size", key=f"expand-{chat_message.id or content}",
+                         on_click=st.session_state.expanded_images.add, args=(content,))
+
+def show_earlier_messages(hidden_loaded):
+    """Button callback: reveals the previous page, fetching it from Firestore if it isn't loaded yet."""
+    if not hidden_loaded:
+        load_older_chat_messages()
+    st.session_state.chat_visible_messages += chat_view.VISIBLE_PAGE_SIZE
+
+@st.fragment
+def render_chat_history():
+    """Draws the newest page of the chat. Paging and image toggles only rerun this fragment."""
+    with tracing.span("render.chat_history"):
+        _render_chat_history()
+
+def _render_chat_history():
+    chat_display_area = st.container(height=400, border=True)
+    visible, hidden_loaded = chat_view.visible_messages(
+        st.session_state.chat_history, st.session_state.chat_visible_messages
+    )
+
+    # Earlier messages are shown a page at a time, fetching them from Firestore once the loaded ones run out
+    if hidden_loaded or st.session_state.chat_has_older:
+        chat_display_area.button("Show earlier messages", on_click=show_earlier_messages, args=(hidden_loaded,))
+
+    # Runs of text messages are pre-formatted into a few markdown blocks
+    for block in chat_view.build_blocks(visible):
+        if block.kind == "text":
+            chat_display_area.markdown(block.text)
+        else:
+            render_chat_image(chat_display_area, block.message)
+
+@st.fragment(run_every=IMAGE_POLL_SECONDS)
+def poll_image_jobs():
+    """Shows progress of pending visuals and reruns the page once one has finished."""
+    queue = get_image_jobs()
+    jobs = [queue.get(job_id) for job_id in st.session_state.image_jobs]
+    if any(job is None or job.finished for job in jobs):
+        st.rerun() # The full run adds the finished visual to the chat
+    for job in jobs:
+        st.info("Crafting image prompt..." if job.status == image_jobs.QUEUED else "Generating your visual...")
 
 
 # --- Pages ---
@@ -270,25 +746,42 @@ def login_page():
                 st.error("Firebase is not initialized. Cannot log in.")
                 return
 
-            user_doc_ref = get_user_doc_ref(username)
-            if user_doc_ref is None:
+            if db is None:
                 st.error("Firebase is not properly configured. Cannot access user data.")
                 return
 
-            user_doc = user_doc_ref.get()
-
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                if check_password(password, user_data['password_hash']):
-                    st.session_state.logged_in = True
-                    st.session_state.username = username
-                    st.session_state.user_data = user_data
-                    st.session_state.chat_history = user_data.get('chat_history', [])
-                    st.session_state.current_page = 'tutor' # Redirect to tutor page after login
-                    st.rerun()
+            # Repeated failures are turned away before any Firestore read or bcrypt work
+            login_limiter = get_login_limiter()
+            client_address = passwords.client_address(st.context.ip_address, st.context.headers.get("X-Forwarded-For"))
+            try:
+                login_limiter.check(username, client_address)
+            except passwords.LoginRateLimited as e:
+                st.error(f"{e} (retry in about {e.retry_after} seconds)")
+                return
+
+            # Only the small credential document is read to check the password
+            with tracing.span("firestore.credentials", user=username):
+                password_hash = get_account_store().password_hash(username)
+
+            if password_hash:
+                with tracing.span("auth.bcrypt", user=username):
+                    password_ok = check_password(password, password_hash)
+                if password_ok:
+                    login_limiter.record_success(username)
+                    rehash_password_if_needed(username, password, password_hash)
+                    # The profile is a projection of the user document; the chat loads on the tutor page
+                    if load_user_data(username):
+                        st.session_state.logged_in = True
+                        st.session_state.username = username
+                        st.session_state.current_page = 'tutor' # Redirect to tutor page after login
+                        st.rerun()
+                    else:
+                        st.error("Username not found.")
                 else:
+                    login_limiter.record_failure(username, client_address)
                     st.error("Incorrect password.")
             else:
+                login_limiter.record_failure(username, client_address)
                 st.error("Username not found.")
 
     st.markdown("---")
@@ -329,8 +822,7 @@ def register_page():
                 st.error("Firebase is not initialized. Cannot register.")
                 return
 
-            user_doc_ref = get_user_doc_ref(username)
-            if user_doc_ref is None:
+            if db is None:
                 st.error("Firebase is not properly configured. Cannot register user.")
                 return
 
@@ -339,30 +831,30 @@ def register_page():
             elif not username or not password or not first_name or not last_name or not email:
                 st.error("All fields are required.")
             else:
-                if user_doc_ref.get().exists:
+                if get_account_store().exists(username):
                     st.error("Username already exists. Please choose a different one.")
                 else:
                     hashed_pass = hash_password(password)
                     initial_tokens = 1000
+                    # The password hash is kept apart from the profile, in its own credential document
                     user_data = {
                         'first_name': first_name,
                         'last_name': last_name,
                         'email': email,
                         'username': username,
-                        'password_hash': hashed_pass,
-                        'tokens': initial_tokens,
                         'learning_preferences': {
                             'style': 'interactive',
                             'pace': 'moderate',
                             'difficulty': 'beginner'
                         },
-                        'subjects': [],
-                        'chat_history': []
+                        'subjects': []
                     }
-                    user_doc_ref.set(user_data)
-                    st.success("Registration successful! You can now log in.")
-                    st.session_state.current_page = 'login'
-                    st.rerun()
+                    if get_account_store().create(username, hashed_pass, user_data, tokens=initial_tokens):
+                        st.success("Registration successful! You can now log in.")
+                        st.session_state.current_page = 'login'
+                        st.rerun()
+                    else:
+                        st.error("Username already exists. Please choose a different one.")
 
     st.markdown("---")
     st.write("Already have an account?")
@@ -443,23 +935,19 @@ def profile_page():
         update_pref_button = st.form_submit_button("Update Preferences")
 
         if update_pref_button:
-            user_data['learning_preferences'] = {
+            learning_preferences = {
                 'style': learning_style,
                 'pace': learning_pace,
                 'difficulty': difficulty_level
             }
-            if update_user_data(user_data):
+            if update_user_data({'learning_preferences': learning_preferences}):
                 st.success("Learning preferences updated successfully!")
             else:
                 st.error("Failed to update learning preferences.")
 
     st.header("Subjects")
-    # Updated list of available subjects for general profile (multi-select)
-    available_subjects = [
-        "English A", "Mathematics", "Biology", "Integrated Science",
-        "Agricultural Science", "Chemistry", "Human and Social Biology",
-        "Physics", "Social Studies", "Principles of Business", "Geography"
-    ]
+    # Subjects for the general profile (multi-select), from the subject registry
+    available_subjects = get_subject_registry().names()
     current_subjects = user_data.get('subjects', [])
 
     with st.form("subjects_form"):
@@ -483,8 +971,7 @@ def profile_page():
             if len(selected_subjects) > 5:
                 st.error("You can select a maximum of 5 subjects.")
             else:
-                user_data['subjects'] = selected_subjects
-                if update_user_data(user_data):
+                if update_user_data({'subjects': selected_subjects}):
                     st.success("Subjects updated successfully!")
                 else:
                     st.error("Failed to update subjects.")
@@ -512,6 +999,11 @@ def tutor_page():
         st.error("Firebase is not initialized. Please ensure FIREBASE_SERVICE_ACCOUNT_KEY_B64 is set in Streamlit Cloud environment variables.")
         return
 
+    # The stored chat is only read once the student actually opens the tutor
+    if st.session_state.chat_resume_pending:
+        st.session_state.chat_resume_pending = False
+        resume_chat_session()
+
     user_data = st.session_state.user_data
     current_tokens = user_data.get('tokens', 0)
     st.sidebar.metric("Tokens Remaining", current_tokens)
@@ -521,17 +1013,32 @@ def tutor_page():
     st.sidebar.write(f"**Learning Style:** {user_data.get('learning_preferences', {}).get('style', 'N/A')}")
     st.sidebar.write(f"**Subjects (Profile):** {', '.join(user_data.get('subjects', ['N/A']))}")
     st.sidebar.write(f"**Current Study Subject:** {st.session_state.current_study_subject if st.session_state.current_study_subject else 'Not selected'}")
+    prompt_report = st.session_state.context_window.last_report
+    if prompt_report:
+        st.sidebar.caption(
+            f"Last request: {prompt_report['sent_tokens']} prompt tokens "
+            f"({prompt_report['full_tokens']} with the full history)"
+        )
+    prompt_cache = prompts.prompt_cache_stats()
+    if prompt_cache['requests']:
+        st.sidebar.caption(f"Prompt cache: {prompt_cache['cached_ratio']:.0%} of prompt tokens served from cache")
 
     # Moved student_grade definition to the top of tutor_page
     student_grade = st.sidebar.selectbox("Your Grade Level:", ["Elementary", "Middle School", "High School", "College"], index=2) # Default to High School
 
 
-    # Define the full list of available subjects for study
-    available_study_subjects = [
-        "English A", "Mathematics", "Biology", "Integrated Science",
-        "Agricultural Science", "Chemistry", "Human and Social Biology",
-        "Physics", "Social Studies", "Principles of Business", "Geography"
-    ]
+    # Subjects available for study, from the subject registry
+    subject_registry = get_subject_registry()
+    available_study_subjects = subject_registry.names()
+    # Subjects without a syllabus PDF are tutored from their context alone
+    subject_labels = {
+        name: name if subject_registry.get(name).syllabus_path else f"{name} (no syllabus)"
+        for name in available_study_subjects
+    }
+    prewarmer = get_prewarmer()
+    for name in available_study_subjects:
+        if not prewarmer.is_ready(name):
+            subject_labels[name] += " (preparing...)"
 
     # --- Subject Selection for Today's Study Session ---
     # Only show this block if a subject hasn't been selected or context not loaded
@@ -541,96 +1048,77 @@ def tutor_page():
             selected_subject_for_session = st.selectbox(
                 "Select a subject:",
                 ["-- Select a Subject --"] + available_study_subjects,
+                format_func=lambda name: subject_labels.get(name, name),
                 key="study_subject_selector"
             )
             start_session_button = st.form_submit_button("Start Study Session")
 
             if start_session_button: # Check if button is clicked
-                print(f"DEBUG: 'Start Study Session' button clicked.") # Debug print
+                logger.debug("'Start Study Session' button clicked.")
                 if selected_subject_for_session == "-- Select a Subject --":
                     st.warning("Please select a valid subject to start your study session.")
-                    print("DEBUG: Invalid subject selected.") # Debug print
+                    logger.debug("Invalid subject selected.")
                     st.stop() # Stop execution to show warning
                 
-                print(f"DEBUG: Selected subject: {selected_subject_for_session}") # Debug print
+                logger.debug("Selected subject: %s", selected_subject_for_session)
                 st.session_state.current_study_subject = selected_subject_for_session
                 
-                # Construct file paths for PDF syllabus and TXT context files
-                # Replace spaces and slashes for safe file names
-                subject_file_name = selected_subject_for_session.replace(" ", "_").replace("/", "-") 
-                syllabus_file_path = os.path.join("subject_context", f"syl_{subject_file_name}.pdf")
-                context_file_path = os.path.join("subject_context", f"con_{subject_file_name}.txt") # Changed to .txt
-
-                syllabus_content = ""
-                context_content = ""
-
-                # Load syllabus file (PDF)
-                syllabus_content = read_pdf_text(syllabus_file_path)
-                if syllabus_content is None: # read_pdf_text returns None on error
-                    print(f"DEBUG: Syllabus content is None. Stopping.") # Debug print
+                subject_entry = load_study_subject(selected_subject_for_session)
+                if subject_entry is None:
                     st.stop() # Stop execution to show error
-                    
-                # Load context file (TXT)
-                context_content = read_text_file(context_file_path) # Changed to read_text_file
-                if context_content is None: # read_text_file returns None on error
-                    print(f"DEBUG: Context content is None. Stopping.") # Debug print
-                    st.stop() # Stop execution to show error
-
-                st.session_state.active_syllabus = syllabus_content
-                st.session_state.active_subject_context = context_content
-                st.session_state.subject_context_loaded = True
-                print(f"DEBUG: Subject context loaded successfully. current_study_subject: {st.session_state.current_study_subject}, subject_context_loaded: {st.session_state.subject_context_loaded}") # Debug print
+                logger.debug("Subject context loaded successfully. current_study_subject: %s, subject_context_loaded: %s", st.session_state.current_study_subject, st.session_state.subject_context_loaded)
                 
                 # Clear chat history for new subject session
-                st.session_state.chat_history = []
+                reset_chat_session()
                 
-                # Construct the initial system prompt with all context
-                preferences_str = ", ".join([f"{k}: {v}" for k, v in user_data.get('learning_preferences', {}).items()])
-                
-                initial_system_prompt = f"""
-                You are an AI tutor specializing in {st.session_state.current_study_subject}.
-                Your responses should be tailored to the student's preferences and selected subject.
-                Student's Grade Level: {student_grade}
-                """
-                if preferences_str:
-                    initial_system_prompt += f"\nStudent's Learning Preferences: {preferences_str}"
-
-                initial_system_prompt += f"""
-                ---
-                Syllabus for {st.session_state.current_study_subject}:
-                {st.session_state.active_syllabus}
-                ---
-                Additional Context for {st.session_state.current_study_subject}:
-                {st.session_state.active_subject_context}
-                ---
-                Be helpful, patient, and provide clear explanations. Ensure your answers are strictly within the scope of the provided syllabus and context.
-                """
-
-                # Add the system prompt as the very first message
-                st.session_state.chat_history.append({"role": "system", "content": initial_system_prompt})
+                # Construct the initial system prompt: the subject's instructions and context come first and
+                # are identical for every student (so OpenAI can cache them), then this student's parameters.
+                # The syllabus itself is not pasted here: the sections relevant to each
+                # question are retrieved and attached when the request is sent
+                initial_system_prompt = prompts.build_system_prompt(
+                    st.session_state.current_study_subject,
+                    subject_entry.context_text,
+                    student_grade,
+                    user_data.get('learning_preferences', {}),
+                )
+
+                # The system prompt is stored once in Firestore and referenced by the session
+                # (subject + preference hash), not copied per message
+                st.session_state.chat_session_id = chat_store.ChatStore(db).start_session(
+                    st.session_state.username,
+                    st.session_state.current_study_subject,
+                    chat_store.preferences_hash(student_grade, user_data.get('learning_preferences', {})),
+                    initial_system_prompt,
+                )
+                # Add it as the very first message, sharing the process-wide copy cached by start_session
+                st.session_state.chat_history.append(chat_store.system_message(initial_system_prompt))
+                user_data['active_chat_session'] = st.session_state.chat_session_id
+                get_account_store().invalidate(st.session_state.username) # start_session wrote the user document
 
                 # Add an initial message from the tutor to start the conversation
                 initial_tutor_message = f"Hello! Welcome to your {st.session_state.current_study_subject} study session. I'm ready to help you with any questions you have based on the syllabus and context provided. How can I assist you today?"
-                st.session_state.chat_history.append({"role": "assistant", "content": initial_tutor_message})
-                save_chat_history() # Save initial messages to Firestore
-                print(f"DEBUG: Initial chat history and system prompt set. Rerunning.") # Debug print
+                save_chat_message("assistant", initial_tutor_message) # Save initial message to Firestore
+                logger.debug("Initial chat history and system prompt set. Rerunning.")
                 st.rerun() # Rerun to display chat interface
             # No else for start_session_button here, as the outer 'if' handles the display flow
     else: # Subject is selected and context loaded, so show the chat interface
-        print(f"DEBUG: Subject already selected ({st.session_state.current_study_subject}). Displaying chat interface.") # Debug print
+        logger.debug("Subject already selected (%s). Displaying chat interface.", st.session_state.current_study_subject)
         # --- Display Current Study Subject and Option to Change ---
         st.info(f"You are currently studying: **{st.session_state.current_study_subject}**")
         if st.button("Change Study Subject"):
-            print("DEBUG: Change Study Subject button clicked. Resetting state.") # Debug print
+            logger.debug("Change Study Subject button clicked. Resetting state.")
             st.session_state.current_study_subject = None # Reset to prompt for new selection
             st.session_state.subject_context_loaded = False
-            st.session_state.chat_history = [] # Clear history when changing subject
+            reset_chat_session() # Clear history when changing subject
             st.rerun()
             return # Return here to immediately show the subject selection form
 
         # The student_grade selectbox is now defined at the top of tutor_page
         # so it's always available.
 
+        # Visuals finished since the last run are added to the chat before it is drawn
+        collect_image_jobs()
+
         # --- Chat Interface ---
         col1, col2 = st.columns([1, 2]) # Input on left, output/history on right
 
@@ -640,21 +1128,23 @@ def tutor_page():
             send_button = st.button("Send to Tutor")
             
             # New: Generate Visual Explanation button
-            generate_visual_button = st.button("Generate Visual Explanation", disabled=st.session_state.generating_image) # Disable while generating
+            generate_visual_button = st.button("Generate Visual Explanation", disabled=bool(st.session_state.image_jobs)) # Disable while generating
+            if st.session_state.image_jobs:
+                poll_image_jobs() # Refreshes on its own until the visual is ready
 
         with col2:
             st.subheader("Chat History")
-            chat_display_area = st.container(height=400, border=True)
-
-            # Iterate through chat history, skipping the initial system message for display
-            for chat_message in st.session_state.chat_history:
-                if chat_message["role"] == "user":
-                    chat_display_area.markdown(f"**You:** {chat_message['content']}")
-                elif chat_message["role"] == "assistant": # Only display assistant messages
-                    chat_display_area.markdown(f"**Tutor:** {chat_message['content']}")
-                elif chat_message["role"] == "image": # Display generated images
-                    chat_display_area.image(chat_message['content'], caption="AI Generated Visual")
+            render_chat_history()
+            # The reply being generated is streamed here, below the history
+            reply_area = st.container()
             
+            # Audio for the latest reply is synthesized in the background and attached when ready
+            if st.session_state.reply_speech is not None:
+                if st.session_state.reply_speech[1].done():
+                    render_reply_audio()
+                else:
+                    poll_reply_audio()
+
             # Scroll to bottom
             st.markdown("<script>window.scrollTo(0, document.body.scrollHeight);</script>", unsafe_allow_html=True)
 
@@ -663,51 +1153,78 @@ def tutor_page():
                 st.error("You have no tokens left! Please contact support for more.")
                 return
 
-            # Decrement tokens for text interaction
-            user_data['tokens'] -= 1
-            update_user_data(user_data) # Save updated tokens to Firestore
-
-            # Add user message to history
-            st.session_state.chat_history.append({"role": "user", "content": user_input})
-            save_chat_history() # Save history to Firestore
-
-            # Construct AI prompt context for this turn (re-using the system message already in history)
-            messages = st.session_state.chat_history
+            # The question goes into the history (and the prompt) straight away, while the token is
+            # debited (transactional, safe across tabs) and the question stored on the turn I/O pool
+            turn_key = token_ledger.new_request_key("turn")
+            user_message = add_chat_message("user", user_input)
+            charge = start_turn_charge(user_message, turn_key)
+
+            # Students with the same subject, grade and preferences share answers to repeated questions
+            cache_scope = (
+                st.session_state.current_study_subject,
+                student_grade,
+                chat_store.preferences_hash(student_grade, user_data.get('learning_preferences', {})),
+            )
+            cached_response = get_response_cache().lookup(cache_scope, user_input)
 
+            # The token is refunded unless a complete reply is received; this also covers
+            # errors part-way through a stream and runs cancelled by a rerun/stop
+            reply_completed = False
+            charge_declined = False
+            reply_placeholder = reply_area.empty()
             try:
-                # Call OpenAI API
-                with st.spinner("Tutor is thinking..."):
-                    client = openai.OpenAI(api_key=openai_api_key)
-                    # Changed model to gpt-4.1-nano for larger context window
-                    response = client.chat.completions.create(
-                        model="gpt-4.1-nano", 
-                        messages=messages,
-                        max_tokens=200,
-                        temperature=0.7,
-                    )
-                    tutor_response = response.choices[0].message.content
-                
-                # Add tutor response to history
-                st.session_state.chat_history.append({"role": "assistant", "content": tutor_response})
+                if cached_response is not None:
+                    # Answered without calling OpenAI; the token is still charged as usual
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Response cache hit. Stats: %s", get_response_cache().stats())
+                    tutor_response = cached_response
+                    reply_placeholder.markdown(f"**Tutor:** {tutor_response}")
+                else:
+                    # Construct AI prompt context for this turn: the system message already in history
+                    # plus only the syllabus excerpts that match the question
+                    with tracing.span("prompt.build") as prompt_span:
+                        messages = build_tutor_messages(
+                            st.session_state.chat_history[:-1], st.session_state.active_syllabus_path, user_input
+                        ) + [{"role": "user", "content": user_input}]
+                        # Keep the request within the token budget: older turns are folded into a summary
+                        messages, prompt_report = st.session_state.context_window.build(messages)
+                        prompt_span["prompt_tokens"] = prompt_report['sent_tokens']
+                    logger.debug("Sending %s prompt tokens (%s with full history)", prompt_report['sent_tokens'], prompt_report['full_tokens'])
+
+                    client = get_openai_client(openai_api_key)
+                    # Partial output is rendered below the chat history as it arrives, and the
+                    # first sentence is read aloud as soon as it is complete
+                    streaming_speech = speech.StreamingSpeech(get_speech_synthesizer())
+                    tutor_response = request_tutor_reply(client, messages, reply_placeholder, on_text=streaming_speech.feed)
+                    get_response_cache().store(cache_scope, user_input, tutor_response)
+                # The reply is only kept once the turn has been paid for
+                settle_turn_charge(charge)
+                reply_completed = True
+
+                # Add tutor response to history and Firestore (only once the full reply has arrived)
+                tutor_message = save_chat_message("assistant", tutor_response)
                 
-                # New: Play AI response as speech
-                audio_bytes = text_to_speech(tutor_response)
-                if audio_bytes:
-                    st.audio(audio_bytes, format='audio/mp3', start_time=0)
+                # New: Play AI response as speech (synthesized in the background, shown after the rerun)
+                start_reply_speech(tutor_message)
 
-                save_chat_history() # Save updated history to Firestore
                 st.rerun() # Rerun to update chat display and token count
 
-            except openai.APIError as e:
+            except token_ledger.InsufficientTokens as e:
+                # Nothing was charged or stored, so the question and its reply are dropped
+                charge_declined = True
+                st.session_state.user_data['tokens'] = e.balance
+                st.session_state.chat_history.remove(user_message)
+                st.session_state.chat_next_seq = user_message.seq
+                reply_placeholder.empty()
+                st.error("You have no tokens left! Please contact support for more.")
+            except clients.openai_errors() as e:
                 st.error(f"OpenAI API error: {e}")
-                # Revert token decrement if API call fails
-                user_data['tokens'] += 1
-                update_user_data(user_data)
             except Exception as e:
                 st.error(f"An unexpected error occurred: {e}")
-                # Revert token decrement if API call fails
-                user_data['tokens'] += 1
-                update_user_data(user_data)
+            finally:
+                if not reply_completed and not charge_declined:
+                    # Revert token decrement if API call fails or is interrupted
+                    cancel_turn_charge(charge, turn_key)
 
         elif generate_visual_button:
             # Cost for image generation (e.g., 50 tokens per image)
@@ -716,66 +1233,40 @@ def tutor_page():
                 st.error(f"You need at least {IMAGE_GENERATION_COST} tokens to generate a visual. You have {current_tokens} tokens.")
                 return
 
-            # Decrement tokens for image generation
-            user_data['tokens'] -= IMAGE_GENERATION_COST
-            update_user_data(user_data) # Save updated tokens to Firestore
-
             # Get the last assistant message as context for image generation
             last_tutor_message = ""
             for msg in reversed(st.session_state.chat_history):
-                if msg["role"] == "assistant":
-                    last_tutor_message = msg["content"]
+                if msg.role == "assistant":
+                    last_tutor_message = msg.content
                     break
             
             if not last_tutor_message:
                 st.warning("No recent tutor message to generate a visual from. Please ask a question first.")
                 return
 
-            # Use OpenAI to generate a concise image prompt from the tutor's last response
-            image_prompt_generation_messages = [
-                {"role": "system", "content": "You are an assistant that generates concise, descriptive image prompts based on provided text, suitable for a visual learner. Focus on key concepts. Max 50 words."},
-                {"role": "user", "content": f"Generate an image prompt based on this: {last_tutor_message}"}
-            ]
-            
-            image_gen_prompt = ""
+            # Decrement tokens for image generation
+            image_key = token_ledger.new_request_key("image")
             try:
-                with st.spinner("Crafting image prompt..."):
-                    client = openai.OpenAI(api_key=openai_api_key)
-                    prompt_response = client.chat.completions.create(
-                        model="gpt-4.1-nano", # Using gpt-4.1-nano for prompt generation as well
-                        messages=image_prompt_generation_messages,
-                        max_tokens=50,
-                        temperature=0.7
-                    )
-                    image_gen_prompt = prompt_response.choices[0].message.content
-            except openai.APIError as e:
-                st.error(f"Error generating image prompt: {e}")
-                user_data['tokens'] += IMAGE_GENERATION_COST # Revert tokens
-                update_user_data(user_data)
+                charge_tokens(IMAGE_GENERATION_COST, image_key, "visual explanation")
+            except token_ledger.InsufficientTokens as e:
+                st.error(f"You need at least {IMAGE_GENERATION_COST} tokens to generate a visual. You have {e.balance} tokens.")
+                return
+
+            # The prompt and image are generated in the background; the worker refunds the
+            # tokens if generation fails, even if this session is gone by then
+            try:
+                job_id = get_image_jobs().submit(st.session_state.username, last_tutor_message, image_key)
+            except image_jobs.ImageJobRejected as e:
+                refund_tokens(image_key) # Revert tokens
+                st.warning(str(e))
                 return
             except Exception as e:
-                st.error(f"An unexpected error occurred while crafting image prompt: {e}")
-                user_data['tokens'] += IMAGE_GENERATION_COST # Revert tokens
-                update_user_data(user_data)
+                refund_tokens(image_key) # Revert tokens
+                st.error(f"An unexpected error occurred while starting image generation: {e}")
                 return
-
-            if image_gen_prompt:
-                # Add a temporary message to the chat history indicating image generation is starting
-                st.session_state.chat_history.append({"role": "assistant", "content": f"Generating a visual for: '{image_gen_prompt}'"})
-                save_chat_history()
-                st.rerun() # Rerun to show the "Generating visual" message
-
-                # Call the Imagen API (now synchronous)
-                generated_image_url = generate_image(image_gen_prompt) 
-
-                if generated_image_url:
-                    st.session_state.chat_history.append({"role": "image", "content": generated_image_url})
-                    save_chat_history()
-                    st.rerun() # Rerun to display the image
-                else:
-                    st.error("Failed to generate visual explanation.")
-            else:
-                st.warning("Could not generate a suitable image prompt.")
+            logger.debug("Queued image job %s", job_id)
+            st.session_state.image_jobs.append(job_id)
+            st.rerun() # Rerun to show the progress of the visual
             
         st.markdown("---")
         if st.button("Back to Profile"):
@@ -783,8 +1274,90 @@ def tutor_page():
             st.rerun()
 
 # --- Main App Logic ---
+# Usernames allowed to see the admin panel (comma-separated)
+ADMIN_USERS = {name.strip() for name in os.environ.get("MINDSPRING_ADMIN_USERS", "").split(",") if name.strip()}
+
+def is_admin():
+    return st.session_state.logged_in and st.session_state.username in ADMIN_USERS
+
+def admin_page():
+    """Displays p50/p95 latency per stage, per external endpoint and syllabus pre-warm timings (admins only)."""
+    st.title("Latency by Stage")
+
+    if not is_admin():
+        st.warning("This page is only available to administrators.")
+        st.session_state.current_page = 'tutor' if st.session_state.logged_in else 'login'
+        st.rerun()
+        return
+
+    subject_filter = st.selectbox("Subject:", ["All subjects"] + tracing.subjects())
+    rows = tracing.summary(None if subject_filter == "All subjects" else subject_filter)
+    if not rows:
+        st.info("No timings recorded yet.")
+    else:
+        st.dataframe(
+            [{
+                "Stage": row["stage"],
+                "Count": row["count"],
+                "p50 (ms)": round(row["p50"] * 1000, 1),
+                "p95 (ms)": round(row["p95"] * 1000, 1),
+                "Mean (ms)": round(row["mean"] * 1000, 1),
+            } for row in rows],
+            hide_index=True,
+        )
+        st.caption(
+            f"Latest {tracing.SAMPLES_PER_STAGE} timings per stage in this process. "
+            "Set MINDSPRING_TRACE_FILE for a JSON-lines log of every span, or MINDSPRING_METRICS_PORT "
+            "to serve them at /metrics."
+        )
+
+    st.subheader("External Endpoints")
+    endpoints = clients.endpoint_stats()
+    if not endpoints:
+        st.info("No OpenAI or Imagen requests made yet.")
+    else:
+        st.dataframe(
+            [{
+                "Endpoint": endpoint,
+                "Requests": stats["requests"],
+                "Errors": stats["errors"],
+                "Mean (ms)": round(stats["avg_seconds"] * 1000, 1),
+                "Max (ms)": round(stats["max_seconds"] * 1000, 1),
+            } for endpoint, stats in sorted(endpoints.items())],
+            hide_index=True,
+        )
+        st.caption("OpenAI and Imagen requests since this process started.")
+
+    st.subheader("Syllabus Pre-warming")
+    prewarmer = get_prewarmer()
+    timings = prewarmer.timings()
+    if not timings:
+        st.info("No syllabus has been pre-warmed yet.")
+    else:
+        st.dataframe(
+            [{
+                "Syllabus": os.path.basename(path),
+                "Source": timing.get("source"),
+                "Pages": timing.get("pages"),
+                "Failed pages": timing.get("failed_pages"),
+                "Tokens": timing.get("tokens"),
+                "Extract (s)": timing.get("extract_seconds"),
+                "Index (s)": timing.get("index_seconds"),
+                "Load (s)": timing.get("load_seconds"),
+            } for path, timing in sorted(timings.items())],
+            hide_index=True,
+        )
+    if prewarmer.total_seconds is None:
+        st.caption("Pre-warming is still running.")
+    else:
+        st.caption(f"All subjects pre-warmed in {prewarmer.total_seconds}s.")
+
 def main():
     """Controls the flow of the Streamlit application."""
+    get_prewarmer() # The first run starts preparing every subject while the login page is shown
+    tracing.start_metrics_server() # Only if MINDSPRING_METRICS_PORT is set
+    # Every stage timed during this run is tagged with the student and subject
+    tracing.set_context(user=st.session_state.username, subject=st.session_state.current_study_subject)
     st.sidebar.title("Navigation")
     if st.session_state.logged_in:
         if st.sidebar.button("Profile"):
@@ -793,11 +1366,18 @@ def main():
         if st.sidebar.button("Tutor"):
             st.session_state.current_page = 'tutor'
             st.rerun()
+        if is_admin() and st.sidebar.button("Admin"):
+            st.session_state.current_page = 'admin'
+            st.rerun()
         if st.sidebar.button("Logout"):
+            flush_pending_writes() # Nothing queued is lost on logout
+            st.session_state.pending_writes = None
             st.session_state.logged_in = False
             st.session_state.username = None
             st.session_state.user_data = None
-            st.session_state.chat_history = []
+            st.session_state.chat_resume_pending = False
+            reset_chat_session()
+            st.session_state.image_jobs = [] # Their outcome is picked up again on the next login
             st.session_state.current_page = 'login'
             st.rerun()
     else:
@@ -808,14 +1388,21 @@ def main():
             st.session_state.current_page = 'register'
             st.rerun()
 
-    if st.session_state.current_page == 'login':
-        login_page()
-    elif st.session_state.current_page == 'register':
-        register_page()
-    elif st.session_state.current_page == 'profile':
-        profile_page()
-    elif st.session_state.current_page == 'tutor':
-        tutor_page()
+    try:
+        with tracing.span("rerun.page", page=st.session_state.current_page):
+            if st.session_state.current_page == 'login':
+                login_page()
+            elif st.session_state.current_page == 'register':
+                register_page()
+            elif st.session_state.current_page == 'profile':
+                profile_page()
+            elif st.session_state.current_page == 'tutor':
+                tutor_page()
+            elif st.session_state.current_page == 'admin':
+                admin_page()
+    finally:
+        # Also runs when a page calls st.rerun()/st.stop(): one batched write per run
+        flush_pending_writes()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,93 @@
+"""Cold start of app.py: time to the first login page, and what it imported.
+
+Each sample is a fresh interpreter (as after a scale-to-zero host wakes up) that runs
+app.py once with Streamlit's AppTest, Firestore being mindspring.fakes.FakeFirestore,
+then reruns it once more. Reports the median first-run and rerun times, which of the
+heavy client libraries were imported by the time the login page was drawn, and each
+library's own import time (also in a fresh interpreter).
+
+    python benchmarks/cold_start.py [--samples 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries the app may need, with the module whose presence shows it was imported
+HEAVY_MODULES = {
+    "firestore": "google.cloud.firestore",
+    "openai": "openai",
+    "requests": "requests",
+    "pypdf": "pypdf",
+    "gtts": "gtts",
+    "PIL": "PIL.Image",
+    "bcrypt": "bcrypt",
+    "tiktoken": "tiktoken",
+}
+
+_FIRST_RUN = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+os.chdir({root!r})
+from streamlit.testing.v1 import AppTest # Streamlit itself is loaded before the app in any case
+started = time.perf_counter()
+from unittest import mock
+import firebase_admin
+from mindspring import fakes
+mock.patch.object(firebase_admin, "_apps", {{"[DEFAULT]": None}}).start()
+mock.patch("firebase_admin.firestore.client", lambda *args, **kwargs: fakes.FakeFirestore()).start()
+at = AppTest.from_file("app.py", default_timeout=120)
+at.secrets["OPENAI_API_KEY"] = "sk-cold-start"
+at.run()
+first = time.perf_counter() - started
+loaded = sorted(name for name, module in {modules!r}.items() if module in sys.modules)
+started = time.perf_counter()
+at.run()
+rerun = time.perf_counter() - started
+errors = [str(e.value) for e in at.exception]
+print(json.dumps({{"first": first, "rerun": rerun, "loaded": loaded, "errors": errors}}))
+"""
+
+_IMPORT = """
+import sys, time
+import streamlit # Shares dependencies with some libraries; always loaded first
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+"""
+
+
+def _run_python(code):
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT,
+                               env={**os.environ, "MINDSPRING_LOG_LEVEL": "ERROR"})
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    return completed.stdout.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [json.loads(_run_python(_FIRST_RUN.format(root=ROOT, modules=HEAVY_MODULES)))
+            for _ in range(args.samples)]
+    first = statistics.median(run["first"] for run in runs)
+    rerun = statistics.median(run["rerun"] for run in runs)
+    print(f"login page, first run: {first * 1000:.0f} ms (median of {args.samples})")
+    print(f"login page, rerun:     {rerun * 1000:.0f} ms")
+    if runs[0]["errors"]:
+        print(f"errors: {runs[0]['errors']}")
+
+    print(f"\n{'library':<10} {'import ms':>9}  loaded by the login page")
+    for name, module in HEAVY_MODULES.items():
+        seconds = statistics.median(float(_run_python(_IMPORT.format(module=module))) for _ in range(3))
+        print(f"{name:<10} {seconds * 1000:>9.0f}  {'yes' if name in runs[0]['loaded'] else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
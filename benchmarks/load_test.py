@@ -0,0 +1,340 @@
+"""Offline load test of app.py: simulated students against in-memory fakes.
+
+Each simulated student drives the app headlessly with Streamlit's AppTest through
+register_page, login_page, tutor_page (starting a session and asking --turns
+questions, then optionally requesting a visual) and profile_page (updating their
+preferences). Nothing leaves the machine:
+
+- Firestore is mindspring.fakes.FakeFirestore (--firestore-latency per call)
+- OpenAI chat completions and Imagen are mindspring.mock_server (--api-latency per request)
+- gTTS is replaced by FakeTTS (--tts-latency per synthesized chunk)
+
+AppTest runs one script at a time per process (it swaps Streamlit's global runtime
+for every run), so each student is a separate process with its own fakes and
+process-wide caches; they share the one mock API server and append their tracing spans
+to one trace file. The report gives reruns per second over all students, latency
+percentiles per stage (from those spans) and per action, and Firestore reads,
+document writes and commits per chat turn.
+
+Results are compared with a saved baseline, and the run fails (exit status 1) if
+reruns/s fell or a frequently timed stage's p95 rose by more than --tolerance, or if a
+turn makes more Firestore commits (round trips that write) than in the baseline. Baselines depend on the machine;
+record one with --save-baseline before comparing.
+
+    python benchmarks/load_test.py [--students 4] [--turns 5] [--save-baseline]
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mindspring import mock_server  # noqa: E402
+from mindspring import syllabus_cache  # noqa: E402
+from mindspring import tracing  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baselines", "load_test.json")
+# Stage p95 changes smaller than this are noise, whatever the relative change
+MIN_P95_CHANGE_SECONDS = 0.005
+# Stages timed fewer times than this have too noisy a p95 to compare
+MIN_SAMPLES_TO_COMPARE = 20
+# Longest an action waits for background work (a visual) before it counts as failed
+WAIT_TIMEOUT_SECONDS = 60
+
+QUESTIONS = [
+    "What is osmosis and why does it matter in cells?",
+    "Explain the difference between mitosis and meiosis.",
+    "How do enzymes speed up reactions?",
+    "What does the syllabus say about photosynthesis?",
+    "Give me an example exam question on respiration.",
+    "Why is the cell membrane called partially permeable?",
+    "What are the stages of the nitrogen cycle?",
+    "How should I revise for the practical paper?",
+]
+
+
+class FakeTTS:
+    """Stand-in for gtts.gTTS: writes a few bytes after a fixed delay."""
+
+    latency = 0.0
+
+    def __init__(self, text, lang="en", slow=False):
+        self.text = text
+
+    def write_to_fp(self, fp):
+        if self.latency:
+            time.sleep(self.latency)
+        fp.write(b"ID3" + self.text[:16].encode("utf-8"))
+
+
+# --- Student process ---
+
+def run_student(index, config):
+    """Runs one student's session in this process. Returns its timings and Firestore counts."""
+    os.chdir(ROOT)
+    from unittest import mock
+
+    import firebase_admin
+    from streamlit.testing.v1 import AppTest
+
+    from mindspring import fakes
+
+    db = fakes.FakeFirestore(latency=config["firestore_latency"])
+    FakeTTS.latency = config["tts_latency"]
+    patches = [
+        mock.patch.object(firebase_admin, "_apps", {"[DEFAULT]": None}),
+        mock.patch("firebase_admin.firestore.client", lambda *args, **kwargs: db),
+        mock.patch("gtts.gTTS", FakeTTS), # speech imports it from gtts on first use
+    ]
+    for patch in patches:
+        patch.start()
+    try:
+        return _Student(index, config, db, AppTest).run()
+    finally:
+        for patch in patches:
+            patch.stop()
+
+
+class _Student:
+    """One scripted session: register, log in, study, update the profile, log out."""
+
+    def __init__(self, index, config, db, app_test):
+        self.config = config
+        self.db = db
+        self.username = f"student{index}"
+        self.password = f"pass-{index}-word"
+        self.at = app_test.from_file(os.path.join(ROOT, "app.py"), default_timeout=WAIT_TIMEOUT_SECONDS)
+        self.at.secrets["OPENAI_API_KEY"] = "sk-load-test"
+        self.actions = [] # (action, seconds)
+        self.turns = [] # (reads, writes, commits) per chat turn
+        self.errors = []
+
+    def run(self):
+        started = time.time()
+        self._step("open", lambda: None)
+        self._step("register_page", lambda: self._button("Register", sidebar=True).click())
+        self._step("register", self._fill_registration)
+        self._step("login", self._fill_login)
+        self._step("start_session", self._start_session)
+        for turn in range(self.config["turns"]):
+            question = QUESTIONS[turn % len(QUESTIONS)] + f" ({self.username}, turn {turn})"
+            reads, writes, commits = self.db.reads, self.db.writes, self.db.commits
+            self._step("turn", lambda: self._ask(question))
+            self.turns.append((self.db.reads - reads, self.db.writes - writes, self.db.commits - commits))
+        if self.config["images"]:
+            self._step("visual", lambda: self._button("Generate Visual Explanation").click())
+            self._wait("visual_ready", lambda: not self.at.session_state["image_jobs"])
+        self._step("profile_page", lambda: self._button("Profile", sidebar=True).click())
+        self._step("update_preferences", self._update_preferences)
+        self._step("logout", lambda: self._button("Logout", sidebar=True).click())
+        return {
+            "started": started,
+            "finished": time.time(),
+            "actions": self.actions,
+            "turns": self.turns,
+            "errors": self.errors,
+        }
+
+    def _step(self, action, interact):
+        interact()
+        started = time.perf_counter()
+        self.at.run()
+        self.actions.append((action, time.perf_counter() - started))
+        problems = [str(e.value) for e in self.at.exception] + [e.value for e in self.at.error]
+        if problems:
+            self.errors.append(f"{action}: {problems[0]}")
+
+    def _wait(self, action, done):
+        deadline = time.monotonic() + WAIT_TIMEOUT_SECONDS
+        while not done():
+            if time.monotonic() > deadline:
+                self.errors.append(f"{action}: timed out")
+                return
+            time.sleep(0.1)
+            self._step(action, lambda: None)
+
+    def _button(self, label, sidebar=False):
+        buttons = self.at.sidebar.button if sidebar else self.at.main.button
+        return next(button for button in buttons if button.label == label)
+
+    def _fill_registration(self):
+        inputs = self.at.main.text_input
+        for widget, value in zip(inputs, ["Load", "Test", self.username, f"{self.username}@example.com",
+                                          self.password, self.password]):
+            widget.input(value)
+        self._button("Register").click()
+
+    def _fill_login(self):
+        self.at.main.text_input[0].input(self.username)
+        self.at.main.text_input[1].input(self.password)
+        self._button("Login").click()
+
+    def _start_session(self):
+        self.at.selectbox(key="study_subject_selector").select(self.config["subject"])
+        self._button("Start Study Session").click()
+
+    def _ask(self, question):
+        self.at.text_area(key="user_input_area").input(question)
+        self._button("Send to Tutor").click()
+
+    def _update_preferences(self):
+        self.at.main.selectbox[0].select("Visual")
+        self._button("Update Preferences").click()
+
+
+# --- Report ---
+
+def summarize(results, trace_file, config):
+    started = min(result["started"] for result in results)
+    finished = max(result["finished"] for result in results)
+    # Every process's spans, merged into one tracer for the percentiles
+    tracer = tracing.Tracer(trace_file=None, samples=10 ** 7)
+    reruns = 0
+    with open(trace_file, encoding="utf-8") as f:
+        for line in f:
+            span = json.loads(line)
+            tracer.record(span["stage"], span["seconds"])
+            reruns += span["stage"] == "rerun.page"
+
+    actions = {}
+    for result in results:
+        for action, seconds in result["actions"]:
+            actions.setdefault(action, []).append(seconds)
+    turns = [turn for result in results for turn in result["turns"]]
+    return {
+        "config": {key: config[key] for key in _COMPARED_CONFIG},
+        "seconds": round(finished - started, 3),
+        "reruns": reruns,
+        "reruns_per_second": round(reruns / (finished - started), 2),
+        "stages": {row["stage"]: {"count": row["count"], "p50": round(row["p50"], 6), "p95": round(row["p95"], 6)}
+                   for row in tracer.summary()},
+        "actions": {action: {"count": len(values), "p50": round(_quantile(values, 0.5), 6),
+                             "p95": round(_quantile(values, 0.95), 6)}
+                    for action, values in actions.items()},
+        "reads_per_turn": round(statistics.mean(reads for reads, _, _ in turns), 2) if turns else 0,
+        "writes_per_turn": round(statistics.mean(writes for _, writes, _ in turns), 2) if turns else 0,
+        "commits_per_turn": round(statistics.mean(commits for _, _, commits in turns), 2) if turns else 0,
+        "errors": [error for result in results for error in result["errors"]],
+    }
+
+
+# Settings that must match for a baseline to be comparable
+_COMPARED_CONFIG = ("students", "turns", "images", "subject", "firestore_latency", "api_latency",
+                    "tts_latency", "bcrypt_rounds")
+
+
+def _quantile(values, quantile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(quantile * len(values)))] if values else 0.0
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"{config['students']} students x {config['turns']} turns in {report['seconds']:.1f}s: "
+          f"{report['reruns']} reruns, {report['reruns_per_second']:.1f} reruns/s")
+    print(f"Firestore per turn: {report['reads_per_turn']:.1f} reads, {report['writes_per_turn']:.1f} writes, "
+          f"{report['commits_per_turn']:.1f} commits")
+    for title, rows in (("stage", report["stages"]), ("action", report["actions"])):
+        print(f"\n{title:<26} {'count':>6} {'p50 ms':>9} {'p95 ms':>9}")
+        for name, row in sorted(rows.items()):
+            print(f"{name:<26} {row['count']:>6} {row['p50'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f}")
+    if report["errors"]:
+        print(f"\n{len(report['errors'])} errors, first: {report['errors'][0]}")
+
+
+def compare(report, baseline, tolerance):
+    """Returns a list of regressions of the report against the baseline."""
+    regressions = []
+    if report["reruns_per_second"] < baseline["reruns_per_second"] * (1 - tolerance):
+        regressions.append(f"reruns/s {report['reruns_per_second']} < baseline {baseline['reruns_per_second']}")
+    if report["commits_per_turn"] > baseline["commits_per_turn"]: # Deterministic, so any increase counts
+        regressions.append(f"commits/turn {report['commits_per_turn']} > baseline {baseline['commits_per_turn']}")
+    for stage, row in report["stages"].items():
+        before = baseline["stages"].get(stage)
+        if not before or min(row["count"], before["count"]) < MIN_SAMPLES_TO_COMPARE:
+            continue
+        if row["p95"] > before["p95"] * (1 + tolerance) and row["p95"] - before["p95"] > MIN_P95_CHANGE_SECONDS:
+            regressions.append(f"{stage} p95 {row['p95'] * 1000:.1f}ms > baseline {before['p95'] * 1000:.1f}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=4, help="concurrent simulated students")
+    parser.add_argument("--turns", type=int, default=5, help="questions each student asks")
+    parser.add_argument("--no-images", dest="images", action="store_false", help="skip the visual explanation")
+    parser.add_argument("--subject", default="Biology")
+    parser.add_argument("--firestore-latency", type=float, default=0.01, help="seconds per Firestore call")
+    parser.add_argument("--api-latency", type=float, default=0.3, help="seconds per OpenAI/Imagen request")
+    parser.add_argument("--tts-latency", type=float, default=0.2, help="seconds per gTTS chunk")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10,
+                        help="password hash cost (below production, so logins don't dominate)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative change before failing")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    # Extract the syllabi up front so the first student doesn't time it
+    syllabus_cache.warm_all("subject_context", progress=None)
+    server = mock_server.start_in_background(latency=args.api_latency)
+    work_dir = tempfile.mkdtemp(prefix="mindspring-load-")
+    trace_file = os.path.join(work_dir, "trace.jsonl")
+    # Inherited by the student processes, where the mindspring modules read them on import
+    os.environ.update({
+        "OPENAI_BASE_URL": server.base_url + "/v1",
+        "IMAGEN_API_URL": server.base_url + "/v1beta/models/imagen:predict",
+        "MINDSPRING_TRACE_FILE": trace_file,
+        "MINDSPRING_AUDIO_CACHE_DIR": os.path.join(work_dir, "tts"),
+        "MINDSPRING_IMAGE_STORE_DIR": os.path.join(work_dir, "images"),
+        "MINDSPRING_THUMBNAIL_DIR": os.path.join(work_dir, "thumbnails"),
+        "MINDSPRING_BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "MINDSPRING_LOG_LEVEL": "WARNING",
+    })
+    config = vars(args)
+
+    # spawn: each student gets a fresh interpreter, as AppTest needs
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.students, mp_context=context) as pool:
+        results = list(pool.map(run_student, range(args.students), [config] * args.students))
+    server.shutdown()
+
+    report = summarize(results, trace_file, config)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline to compare with; run with --save-baseline to record one")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["config"] != report["config"]:
+        print(f"\nBaseline was recorded with different settings ({baseline['config']}); not compared")
+        return 0
+    regressions = compare(report, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if not regressions:
+        print(f"\nNo regressions against {os.path.relpath(args.baseline, ROOT)} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Login throughput of the bcrypt worker pool.
+
+Simulates a burst of logins (a classroom signing in at once) from many script threads
+and reports verified logins per second, in total and per core, for each pool size and
+cost factor. Also times a login refused by the rate limiter, which skips bcrypt.
+
+    python benchmarks/login_throughput.py [--logins 64] [--rounds 10 12] [--workers 1 2 4]
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mindspring import passwords  # noqa: E402
+
+
+def measure(rounds, workers, logins, sessions):
+    hasher = passwords.PasswordHasher(rounds=rounds, workers=workers)
+    hashed = hasher.hash("correct horse battery staple")
+    # Many sessions submit at once, as Streamlit script threads would
+    with concurrent.futures.ThreadPoolExecutor(max_workers=sessions) as clients:
+        started = time.perf_counter()
+        results = list(clients.map(lambda _: hasher.verify("correct horse battery staple", hashed), range(logins)))
+        elapsed = time.perf_counter() - started
+    assert all(results)
+    return logins / elapsed
+
+
+def measure_rejection(attempts=10000):
+    limiter = passwords.LoginRateLimiter(max_user_failures=1)
+    limiter.record_failure("mallory", "203.0.113.7")
+    started = time.perf_counter()
+    for _ in range(attempts):
+        try:
+            limiter.check("mallory", "203.0.113.7")
+        except passwords.LoginRateLimited:
+            pass
+    return (time.perf_counter() - started) / attempts
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--sessions", type=int, default=32, help="concurrent login threads")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, passwords.BCRYPT_ROUNDS])
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, cores}))
+    args = parser.parse_args()
+
+    print(f"{cores} cores, {args.logins} logins from {args.sessions} concurrent sessions")
+    print(f"{'rounds':>6} {'workers':>7} {'logins/s':>9} {'per core':>9}")
+    for rounds in args.rounds:
+        for workers in args.workers:
+            rate = measure(rounds, workers, args.logins, args.sessions)
+            print(f"{rounds:>6} {workers:>7} {rate:>9.1f} {rate / min(workers, cores):>9.1f}")
+    print(f"rate-limited attempt: {measure_rejection() * 1e6:.1f} µs (no bcrypt)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Memory held per concurrent session: resident memory and session state per 100 sessions.
+
+Opens --sessions simulated students in one process, as one server would hold them,
+with Streamlit's AppTest and the load test's scripted student (benchmarks/load_test.py):
+each registers, logs in, starts a --subject session and asks --turns questions, and is
+then kept open. Firestore is mindspring.fakes.FakeFirestore, OpenAI is
+mindspring.mock_server and gTTS is load_test.FakeTTS, all without latency.
+
+Reports, scaled to 100 sessions:
+
+- resident memory (RSS) growth from before the first session to after the last. It
+  includes AppTest's own per-session objects, such as the last element tree and the
+  run's mocked runtime. The sessions share one compiled app.py, as on a server (AppTest
+  would compile it again for every run, and a session's fragments keep it alive).
+- the size of everything reachable from the sessions' st.session_state, per key.
+  An object shared by several sessions, or held by a process-wide cache (the syllabus
+  texts and system prompts), is not memory of any one session and is counted once or
+  not at all.
+
+    python benchmarks/session_memory.py [--sessions 100] [--turns 4]
+"""
+import argparse
+import collections
+import gc
+import os
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import load_test  # noqa: E402
+from mindspring import chat_store  # noqa: E402
+from mindspring import mock_server  # noqa: E402
+from mindspring import syllabus_cache  # noqa: E402
+
+# Objects of other libraries (futures, locks, ...) are counted without what they reference
+_OWN_MODULE_PREFIX = "mindspring."
+
+
+def resident_bytes():
+    """Returns this process's resident memory (Linux)."""
+    with open("/proc/self/statm", encoding="ascii") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def deep_size(root, seen):
+    """Returns the bytes of root and everything it references that isn't in seen (ids), adding them to seen."""
+    total = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(obj)
+        elif type(obj).__module__.startswith(_OWN_MODULE_PREFIX):
+            if hasattr(obj, "__dict__"):
+                stack.append(vars(obj))
+            for cls in type(obj).__mro__:
+                stack.extend(getattr(obj, slot) for slot in getattr(cls, "__slots__", ()) if hasattr(obj, slot))
+    return total
+
+
+def process_wide_ids(db):
+    """Returns the ids of the database and the texts of process-wide caches, which no session owns."""
+    texts = [entry._text for entry in syllabus_cache._memory.values() if entry._text is not None]
+    texts.extend(chat_store._prompt_cache.values())
+    return {id(db)} | {id(text) for text in texts}
+
+
+def session_state_sizes(sessions, db):
+    """Returns {session state key: bytes over all sessions}, counting shared objects once."""
+    seen = process_wide_ids(db)
+    sizes = collections.Counter()
+    for student in sessions:
+        for key, value in student.at.session_state.items():
+            sizes[key] += deep_size(value, seen)
+    return sizes
+
+
+def open_session(student, turns):
+    """Runs a student up to the end of their questions, leaving the session open."""
+    student._step("open", lambda: None)
+    student._step("register_page", lambda: student._button("Register", sidebar=True).click())
+    student._step("register", student._fill_registration)
+    student._step("login", student._fill_login)
+    student._step("start_session", student._start_session)
+    for turn in range(turns):
+        question = load_test.QUESTIONS[turn % len(load_test.QUESTIONS)] + f" ({student.username}, turn {turn})"
+        student._step("turn", lambda: student._ask(question))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100, help="sessions held open at once")
+    parser.add_argument("--turns", type=int, default=4, help="questions asked in each session")
+    parser.add_argument("--subject", default="Biology")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    syllabus_cache.warm_all("subject_context", progress=None)
+    server = mock_server.start_in_background(latency=0)
+    work_dir = tempfile.mkdtemp(prefix="mindspring-memory-")
+    os.environ.update({
+        "OPENAI_BASE_URL": server.base_url + "/v1",
+        "IMAGEN_API_URL": server.base_url + "/v1beta/models/imagen:predict",
+        "MINDSPRING_AUDIO_CACHE_DIR": os.path.join(work_dir, "tts"),
+        "MINDSPRING_IMAGE_STORE_DIR": os.path.join(work_dir, "images"),
+        "MINDSPRING_THUMBNAIL_DIR": os.path.join(work_dir, "thumbnails"),
+        "MINDSPRING_BCRYPT_ROUNDS": "4", # Logins aren't measured
+        "MINDSPRING_LOG_LEVEL": "ERROR",
+    })
+
+    from unittest import mock
+
+    import firebase_admin
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+
+    from mindspring import fakes
+
+    db = fakes.FakeFirestore()
+    script_cache = ScriptCache()
+    mock.patch("streamlit.testing.v1.app_test.ScriptCache", lambda: script_cache).start()
+    mock.patch("streamlit.testing.v1.local_script_runner.ScriptCache", lambda: script_cache).start()
+    mock.patch.object(firebase_admin, "_apps", {"[DEFAULT]": None}).start()
+    mock.patch("firebase_admin.firestore.client", lambda *args, **kwargs: db).start()
+    mock.patch("gtts.gTTS", load_test.FakeTTS).start()
+    config = {"subject": args.subject}
+
+    # The first session loads the modules, the syllabus and its index, which every later one shares
+    warm_up = load_test._Student("warmup", config, db, AppTest)
+    open_session(warm_up, args.turns)
+    gc.collect()
+    before = resident_bytes()
+
+    sessions = []
+    for index in range(args.sessions):
+        student = load_test._Student(index, config, db, AppTest)
+        open_session(student, args.turns)
+        sessions.append(student)
+    gc.collect()
+    after = resident_bytes()
+    server.shutdown()
+
+    errors = [error for student in sessions for error in student.errors]
+    scale = 100 / args.sessions
+    sizes = session_state_sizes(sessions, db)
+    print(f"{args.sessions} sessions of {args.turns} turns ({args.subject})")
+    print(f"resident memory per 100 sessions: {(after - before) * scale / 2 ** 20:.1f} MiB")
+    print(f"session state per 100 sessions:   {sum(sizes.values()) * scale / 2 ** 10:.0f} KiB")
+    print(f"\n{'session state key':<32} {'KiB per 100':>11}")
+    for key, size in sizes.most_common(12):
+        print(f"{key[:32]:<32} {size * scale / 2 ** 10:>11.1f}")
+    if errors:
+        print(f"\n{len(errors)} errors, first: {errors[0]}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
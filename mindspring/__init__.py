@@ -0,0 +1 @@
+"""Supporting modules for the mindspring3 AI tutor app (app.py)."""
@@ -0,0 +1,133 @@
+"""Credentials and profiles of student accounts.
+
+Layout:
+
+    credentials/{username}    password_hash, created_at
+    users/{username}          username, first_name, last_name, email,
+                              learning_preferences, subjects, active_chat_session
+
+Logging in only reads the small credential document, and pages only read the profile
+fields they display (a projection of the user document), so neither gets slower as a
+student's history grows. Profiles are kept in a per-process cache for
+PROFILE_TTL_SECONDS and dropped from it whenever this process writes them. New accounts
+get their token balance document (see token_ledger) in the same batch. Accounts
+created before the split keep their password_hash in the user document; it is moved
+to a credential document on their first login.
+"""
+import copy
+import logging
+import os
+import threading
+import time
+
+from firebase_admin import firestore
+from google.api_core import exceptions
+
+from mindspring import token_ledger
+
+logger = logging.getLogger(__name__)
+
+# Fields of users/{username} loaded into a session (never the legacy chat_history)
+PROFILE_FIELDS = (
+    'username', 'first_name', 'last_name', 'email',
+    'learning_preferences', 'subjects', 'active_chat_session',
+)
+# How long a profile read is reused by this process
+PROFILE_TTL_SECONDS = float(os.environ.get("MINDSPRING_PROFILE_TTL_SECONDS", "60"))
+
+
+class AccountStore:
+    """Reads and writes credentials and profiles, with a TTL cache of profiles."""
+
+    def __init__(self, db, ttl=PROFILE_TTL_SECONDS):
+        self.db = db
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._profiles = {} # username -> (expires at, profile)
+
+    def _credential_ref(self, username):
+        return self.db.collection('credentials').document(username)
+
+    def _user_ref(self, username):
+        return self.db.collection('users').document(username)
+
+    # --- Credentials ---
+
+    def password_hash(self, username):
+        """Returns the user's bcrypt hash, or None if there is no such user."""
+        snapshot = self._credential_ref(username).get()
+        if snapshot.exists:
+            return snapshot.get('password_hash')
+        # Accounts from before the split: read just the hash, then move it out of the user document
+        legacy = self._user_ref(username).get(field_paths=['password_hash'])
+        password_hash = legacy.to_dict().get('password_hash') if legacy.exists else None
+        if password_hash:
+            self._migrate_credential(username, password_hash)
+        return password_hash
+
+    def set_password_hash(self, username, password_hash):
+        """Replaces the user's stored hash, e.g. after rehashing with a new cost."""
+        self._credential_ref(username).set({'password_hash': password_hash}, merge=True)
+
+    def _migrate_credential(self, username, password_hash):
+        try:
+            batch = self.db.batch()
+            batch.set(self._credential_ref(username), {
+                'password_hash': password_hash,
+                'created_at': firestore.SERVER_TIMESTAMP,
+            })
+            batch.set(self._user_ref(username), {'password_hash': firestore.DELETE_FIELD}, merge=True)
+            batch.commit()
+        except Exception:
+            # Not fatal: the legacy field still works and the move is retried on the next login
+            logger.exception("Moving the credential of %s failed", username)
+
+    # --- Accounts ---
+
+    def exists(self, username):
+        """True if the username is taken (including accounts from before the split)."""
+        if self._credential_ref(username).get().exists:
+            return True
+        return self._user_ref(username).get(field_paths=['username']).exists
+
+    def create(self, username, password_hash, profile, tokens=0):
+        """Creates the credential, user and token balance documents. Returns False if the username is taken."""
+        if self.exists(username):
+            return False
+        batch = self.db.batch()
+        # create() fails the whole batch if another registration took the name meanwhile
+        batch.create(self._credential_ref(username), {
+            'password_hash': password_hash,
+            'created_at': firestore.SERVER_TIMESTAMP,
+        })
+        batch.set(self._user_ref(username), profile)
+        token_ledger.TokenLedger(self.db).open_account(batch, username, tokens)
+        try:
+            batch.commit()
+        except exceptions.AlreadyExists:
+            return False
+        self.invalidate(username)
+        return True
+
+    # --- Profiles ---
+
+    def profile(self, username):
+        """Returns the user's profile fields (a fresh dict), or None if there is no such user."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._profiles.get(username)
+        if cached is not None and cached[0] > now:
+            return copy.deepcopy(cached[1])
+
+        snapshot = self._user_ref(username).get(field_paths=list(PROFILE_FIELDS))
+        if not snapshot.exists:
+            return None
+        profile = snapshot.to_dict()
+        with self._lock:
+            self._profiles[username] = (now + self.ttl, profile)
+        return copy.deepcopy(profile)
+
+    def invalidate(self, username):
+        """Drops the cached profile; call after writing to the user document."""
+        with self._lock:
+            self._profiles.pop(username, None)
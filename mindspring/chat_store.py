@@ -0,0 +1,171 @@
+"""Append-only chat message storage in Firestore.
+
+Layout:
+
+    users/{username}                                  active_chat_session: <session id>
+    users/{username}/chat_sessions/{session}          subject, preferences_hash, system_prompt_id
+    users/{username}/chat_sessions/{session}/messages/{message id}   seq, role, content
+    system_prompts/{prompt id}                        subject, preferences_hash, content
+
+Each chat message is written once as its own small document, so a turn costs one
+write of that message instead of re-uploading the whole history, and the user
+document no longer grows with usage. System prompts are stored once, keyed by a
+hash of their content. Students with the same subject and preferences share one
+prompt document, which sessions reference by subject and preference hash.
+
+In session state a chat history is a list of ChatMessage records (slotted, 64 bytes
+against a dict's 184). Its first record holds the system prompt, which is the
+process-wide copy from the prompt cache: every session with the same prompt shares
+one string instead of building its own.
+"""
+import hashlib
+import json
+import sys
+import threading
+import uuid
+
+from firebase_admin import firestore
+
+# Number of messages loaded on login and per "load older" page
+PAGE_SIZE = 30
+
+# Prompts are immutable (keyed by content hash), so they can be cached for the process lifetime
+_prompt_cache = {}
+_prompt_cache_lock = threading.Lock()
+
+
+def preferences_hash(grade_level, learning_preferences):
+    """Returns a short stable hash of the per-student prompt parameters."""
+    payload = json.dumps({"grade": grade_level, "preferences": learning_preferences or {}}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def prompt_id(system_prompt):
+    """Returns the id a system prompt is stored under: a hash of its content."""
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:32]
+
+
+class ChatMessage:
+    """One message of a chat history. The system prompt has neither id nor seq; images hold an image reference."""
+
+    __slots__ = ("id", "seq", "role", "content")
+
+    def __init__(self, id, seq, role, content):
+        self.id = id
+        self.seq = seq
+        self.role = role
+        self.content = content
+
+
+def new_message(role, content, seq):
+    """Returns a ChatMessage with the id and sequence number used for storage."""
+    # The id is fixed when the message is created so retried writes are idempotent
+    return ChatMessage(f"{seq:08d}-{uuid.uuid4().hex[:8]}", seq, role, content)
+
+
+def system_message(system_prompt):
+    """Returns the record of a system prompt, sharing the prompt cache's copy of the text once it's stored."""
+    return ChatMessage(None, None, "system", _prompt_cache.get(prompt_id(system_prompt), system_prompt))
+
+
+class ChatStore:
+    """Reads and writes chat sessions for users in a Firestore database."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _session_ref(self, username, session_id):
+        return self.db.collection('users').document(username).collection('chat_sessions').document(session_id)
+
+    def _messages(self, username, session_id):
+        return self._session_ref(username, session_id).collection('messages')
+
+    def start_session(self, username, subject, prefs_hash, system_prompt):
+        """Creates a chat session and makes it the user's active one. Returns the session id."""
+        key = prompt_id(system_prompt)
+        session_id = uuid.uuid4().hex
+        batch = self.db.batch()
+        if key not in _prompt_cache:
+            # set() is idempotent: every session with this prompt shares the same document
+            batch.set(self.db.collection('system_prompts').document(key), {
+                'subject': subject,
+                'preferences_hash': prefs_hash,
+                'content': system_prompt,
+            })
+        batch.set(self._session_ref(username, session_id), {
+            'subject': subject,
+            'preferences_hash': prefs_hash,
+            'system_prompt_id': key,
+            'created_at': firestore.SERVER_TIMESTAMP,
+        })
+        # Point the user at the new session and drop the legacy inline history array
+        batch.set(self.db.collection('users').document(username), {
+            'active_chat_session': session_id,
+            'chat_history': firestore.DELETE_FIELD,
+        }, merge=True)
+        batch.commit()
+        with _prompt_cache_lock:
+            _prompt_cache.setdefault(key, system_prompt)
+        return session_id
+
+    def message_ref(self, username, session_id, message_id):
+        return self._messages(username, session_id).document(message_id)
+
+    def append(self, username, session_id, message):
+        """Writes one ChatMessage (as returned by new_message) to a session."""
+        self.message_ref(username, session_id, message.id).set(self.message_document(message))
+
+    @staticmethod
+    def message_document(message):
+        """Returns the Firestore fields stored for a message."""
+        return {
+            'seq': message.seq,
+            'role': message.role,
+            'content': message.content,
+            'created_at': firestore.SERVER_TIMESTAMP,
+        }
+
+    def load_session(self, username, session_id, limit=PAGE_SIZE):
+        """Loads a session's metadata, system prompt and newest messages.
+
+        Returns (session_data, system_prompt, messages, has_older), or None if the session
+        doesn't exist. Messages are ChatMessages, oldest-first.
+        """
+        session_doc = self._session_ref(username, session_id).get()
+        if not session_doc.exists:
+            return None
+        session_data = session_doc.to_dict()
+        system_prompt = self.get_system_prompt(session_data.get('system_prompt_id'))
+        messages, has_older = self._page(self._messages(username, session_id), limit)
+        return session_data, system_prompt, messages, has_older
+
+    def load_older(self, username, session_id, before_seq, limit=PAGE_SIZE):
+        """Loads the page of messages preceding before_seq. Returns (messages, has_older)."""
+        query = self._messages(username, session_id).where(
+            filter=firestore.FieldFilter('seq', '<', before_seq)
+        )
+        return self._page(query, limit)
+
+    def get_system_prompt(self, prompt_id):
+        """Returns the text of a stored system prompt ('' if it is missing)."""
+        if not prompt_id:
+            return ""
+        prompt = _prompt_cache.get(prompt_id)
+        if prompt is None:
+            prompt_doc = self.db.collection('system_prompts').document(prompt_id).get()
+            prompt = prompt_doc.to_dict().get('content', "") if prompt_doc.exists else ""
+            with _prompt_cache_lock:
+                prompt = _prompt_cache.setdefault(prompt_id, prompt)
+        return prompt
+
+    @staticmethod
+    def _page(query, limit):
+        # Fetch one extra message to learn whether an older page exists
+        docs = list(query.order_by('seq', direction=firestore.Query.DESCENDING).limit(limit + 1).stream())
+        has_older = len(docs) > limit
+        messages = []
+        for doc in reversed(docs[:limit]):
+            data = doc.to_dict()
+            # Interned, so the handful of role names aren't copied into every loaded message
+            messages.append(ChatMessage(doc.id, data['seq'], sys.intern(data['role']), data['content']))
+        return messages, has_older
@@ -0,0 +1,72 @@
+"""Pre-formatted, paginated blocks for the chat history display.
+
+Rendering every message as its own element on every rerun makes reruns slower as a
+session grows. Instead, only the newest page of messages is shown (older pages on
+request), and consecutive text messages are grouped into markdown blocks of
+BLOCK_SIZE sequence numbers. Blocks for earlier messages never change once they are
+full, so appending a message only alters the newest block, and the formatted text of
+each message is memoized by its id.
+"""
+import functools
+
+# Messages shown at first, and added by each "Show earlier messages"
+VISIBLE_PAGE_SIZE = 20
+# Messages per markdown block (by sequence number), so old blocks stay identical across reruns
+BLOCK_SIZE = 10
+
+_SPEAKERS = {"user": "You", "assistant": "Tutor"}
+
+
+class ChatBlock:
+    """One element of the chat display: a markdown run of text messages or a single image."""
+
+    __slots__ = ("kind", "text", "message")
+
+    def __init__(self, kind, text=None, message=None):
+        self.kind = kind
+        self.text = text
+        self.message = message
+
+
+@functools.lru_cache(maxsize=4096)
+def format_message(message_id, role, content):
+    """Returns the markdown for one text message (memoized by id)."""
+    if content.count("```") % 2:
+        content += "\n```" # A reply cut off inside a code block would swallow the rest of its block
+    return f"**{_SPEAKERS[role]}:** {content}"
+
+
+def visible_messages(chat_history, count):
+    """Returns (the newest count displayable messages, True if earlier loaded ones are hidden).
+
+    Walks back from the end, so the cost depends on the page size, not the session length.
+    """
+    visible = []
+    for index in range(len(chat_history) - 1, -1, -1):
+        msg = chat_history[index]
+        if msg.role not in ("user", "assistant", "image"): # The system prompt isn't shown
+            continue
+        if len(visible) == count:
+            return visible[::-1], True
+        visible.append(msg)
+    return visible[::-1], False
+
+
+def build_blocks(messages):
+    """Groups messages into ChatBlocks in display order."""
+    blocks = []
+    lines = []
+    current_block = None
+    for msg in messages:
+        block_id = msg.seq // BLOCK_SIZE if msg.seq is not None else None
+        if lines and (msg.role == "image" or block_id != current_block or block_id is None):
+            blocks.append(ChatBlock("text", "\n\n".join(lines)))
+            lines = []
+        if msg.role == "image":
+            blocks.append(ChatBlock("image", message=msg))
+            continue
+        current_block = block_id
+        lines.append(format_message(msg.id, msg.role, msg.content))
+    if lines:
+        blocks.append(ChatBlock("text", "\n\n".join(lines)))
+    return blocks
@@ -0,0 +1,165 @@
+"""Process-wide HTTP clients for OpenAI and the Imagen endpoint.
+
+Both clients keep a pool of keep-alive connections, so chat turns and image requests
+reuse TLS connections instead of paying a new handshake each time. Both retry
+429/5xx responses with exponential backoff, and both feed per-endpoint latency and
+error counters (see endpoint_stats()).
+
+app.py creates one of each per process with st.cache_resource, on first use. The
+openai and requests libraries are only imported then, since openai alone takes about
+half a second to import and the login page needs neither. For local testing, point
+OPENAI_BASE_URL and IMAGEN_API_URL at mindspring.mock_server.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Request timeouts in seconds (connect, total)
+CONNECT_TIMEOUT = float(os.environ.get("MINDSPRING_CONNECT_TIMEOUT", "5"))
+OPENAI_TIMEOUT = float(os.environ.get("MINDSPRING_OPENAI_TIMEOUT", "60"))
+HTTP_TIMEOUT = float(os.environ.get("MINDSPRING_HTTP_TIMEOUT", "90"))
+# Retries on 429 and 5xx, with exponential backoff (Retry-After is honoured)
+MAX_RETRIES = int(os.environ.get("MINDSPRING_MAX_RETRIES", "3"))
+RETRY_BACKOFF_SECONDS = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Keep-alive connections kept open per host
+POOL_SIZE = int(os.environ.get("MINDSPRING_HTTP_POOL_SIZE", "20"))
+
+IMAGEN_API_URL = os.environ.get(
+    "IMAGEN_API_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/imagen-3.0-generate-002:predict",
+)
+
+
+class EndpointStats:
+    """Thread-safe request counters and latency totals per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            stats = self._stats.setdefault(
+                endpoint, {"requests": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+            )
+            stats["requests"] += 1
+            stats["errors"] += int(bool(error))
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def snapshot(self):
+        """Returns {endpoint: {requests, errors, avg_seconds, max_seconds}}."""
+        with self._lock:
+            return {
+                endpoint: {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "avg_seconds": stats["total_seconds"] / stats["requests"],
+                    "max_seconds": stats["max_seconds"],
+                }
+                for endpoint, stats in self._stats.items()
+            }
+
+
+_endpoint_stats = EndpointStats()
+
+
+def endpoint_stats():
+    """Returns a snapshot of the per-endpoint counters for this process."""
+    return _endpoint_stats.snapshot()
+
+
+def _endpoint_name(url):
+    parts = urlsplit(str(url))
+    return f"{parts.hostname}{parts.path}"
+
+
+def openai_errors():
+    """Returns openai.APIError, for except clauses (evaluated only once an exception is raised)."""
+    import openai
+    return openai.APIError
+
+
+def request_errors():
+    """Returns the base class of requests' exceptions, for except clauses."""
+    import requests
+    return requests.exceptions.RequestException
+
+
+def build_openai_client(api_key, base_url=None):
+    """Returns an OpenAI client with a pooled keep-alive HTTP client, timeouts and retries.
+
+    Latency is recorded per HTTP attempt; for streamed responses it is the time until
+    the response headers arrive.
+    """
+    import openai
+
+    def on_request(request):
+        request.extensions["mindspring_started"] = time.perf_counter()
+
+    def on_response(response):
+        started = response.request.extensions.get("mindspring_started")
+        if started is not None:
+            _endpoint_stats.record(
+                _endpoint_name(response.request.url),
+                time.perf_counter() - started,
+                error=response.status_code >= 400,
+            )
+
+    # DefaultHttpxClient keeps the SDK's keep-alive connection pool limits
+    http_client = openai.DefaultHttpxClient(
+        timeout=openai.Timeout(OPENAI_TIMEOUT, connect=CONNECT_TIMEOUT),
+        event_hooks={"request": [on_request], "response": [on_response]},
+    )
+    return openai.OpenAI(
+        api_key=api_key,
+        base_url=base_url or os.environ.get("OPENAI_BASE_URL") or None,
+        max_retries=MAX_RETRIES, # The SDK backs off exponentially on 408/409/429/5xx
+        http_client=http_client,
+    )
+
+
+def _instrumented_session_class():
+    import requests
+
+    class InstrumentedSession(requests.Session):
+        """requests.Session that records latency and errors per endpoint."""
+
+        def request(self, method, url, *args, **kwargs):
+            kwargs.setdefault("timeout", (CONNECT_TIMEOUT, HTTP_TIMEOUT))
+            started = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.exceptions.RequestException:
+                _endpoint_stats.record(_endpoint_name(url), time.perf_counter() - started, error=True)
+                raise
+            _endpoint_stats.record(_endpoint_name(url), time.perf_counter() - started, error=not response.ok)
+            return response
+
+    return InstrumentedSession
+
+
+def build_http_session():
+    """Returns a pooled keep-alive requests session that retries 429/5xx with backoff.
+
+    Connection errors are retried too, but a request that timed out waiting for the
+    response is not resent: the server may still be generating (and billing) it.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=MAX_RETRIES,
+        read=False, # Raise read timeouts as they are instead of resending the POST
+        backoff_factor=RETRY_BACKOFF_SECONDS,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None, # Also retry POST after connection errors and 429/5xx responses
+        raise_on_status=False, # Return the final error response so callers can report it
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = _instrumented_session_class()()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,168 @@
+"""Prompt-size budgeting for chat completions.
+
+Keeps each OpenAI request bounded as a study session grows: the system prompt is always
+pinned, the most recent turns are sent verbatim, and once the request would exceed the
+token budget, older turns are folded into a running summary that is extended
+incrementally instead of being recomputed on every request. Folding shrinks the
+window well below the budget (FOLD_TARGET), so the summary and the window start stay
+the same for the next few turns and the request keeps a prefix OpenAI can cache.
+"""
+import functools
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Maximum prompt tokens per request (system prompt + summary + recent turns)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("MINDSPRING_PROMPT_TOKEN_BUDGET", "4000"))
+# The newest messages that are always sent verbatim, even when over budget
+MIN_RECENT_MESSAGES = 4
+# Cap on the folded summary; its oldest lines are dropped beyond this
+SUMMARY_TOKEN_BUDGET = 600
+# Share of the budget a request is cut down to when older turns are folded
+FOLD_TARGET = 0.6
+
+# Per-message overhead of the chat format (role markers, separators)
+_MESSAGE_OVERHEAD_TOKENS = 4
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Returns the tiktoken encoding for the chat models, or None if it is unavailable."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e: # Not installed, or the BPE file can't be downloaded
+            logger.info("tiktoken unavailable, estimating token counts: %s", e)
+            _encoding = None
+    return _encoding
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text):
+    """Returns the token count of a string; results are cached per distinct string."""
+    return count_text_tokens(text)
+
+
+def count_text_tokens(text):
+    """Uncached count_tokens, for large one-off texts such as whole syllabus pages."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Fallback: roughly four characters per token for English text
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(message):
+    """Returns the token count of one chat message including format overhead."""
+    return count_tokens(message["content"]) + _MESSAGE_OVERHEAD_TOKENS
+
+
+def count_messages_tokens(messages):
+    return sum(count_message_tokens(msg) for msg in messages)
+
+
+def summarize_message(message):
+    """Default local summarizer: condenses a message to its first sentence."""
+    first_sentence = _SENTENCE_END_RE.split(message["content"].strip(), maxsplit=1)[0]
+    if len(first_sentence) > 200:
+        first_sentence = first_sentence[:197] + "..."
+    speaker = "Student" if message["role"] == "user" else "Tutor"
+    return f"{speaker}: {first_sentence}"
+
+
+class ContextWindow:
+    """Sliding window over a conversation with an incrementally maintained summary.
+
+    One instance lives in each Streamlit session. Call reset() whenever the chat
+    history is cleared.
+    """
+
+    def __init__(self, budget=None, min_recent=MIN_RECENT_MESSAGES, summarize=summarize_message):
+        self.budget = budget or PROMPT_TOKEN_BUDGET
+        self.min_recent = min_recent
+        self.summarize = summarize
+        self.reset()
+
+    def reset(self):
+        self.summary_lines = []
+        self.folded_count = 0 # Number of conversation messages already folded into the summary
+        self.first_message = None # (role, content) of the conversation's first message when it was folded
+        self.last_report = None
+
+    def build(self, messages):
+        """Returns (messages_to_send, report) for a full message list whose first entry is the system prompt.
+
+        The report records the tokens actually sent next to what the unbounded history would cost.
+        """
+        system, conversation = messages[0], messages[1:]
+        first_message = (conversation[0]["role"], conversation[0]["content"]) if conversation else None
+        if len(conversation) < self.folded_count or (self.folded_count and first_message != self.first_message):
+            # History was replaced (a new session) or older messages were loaded in front of it, so
+            # folded_count no longer points past the summarized messages; summarize again from the start
+            self.reset()
+        self.first_message = first_message
+
+        system_tokens = count_message_tokens(system)
+        used = system_tokens + self._summary_tokens()
+        start = self._window_start(conversation, used, self.budget)
+        if start > self.folded_count:
+            # Over budget: fold down to FOLD_TARGET rather than just below the budget, so
+            # the next turns fit without folding again (and changing the prompt's prefix)
+            start = self._window_start(conversation, used, self.budget * FOLD_TARGET)
+
+        # Everything older than the window that isn't summarized yet gets folded in now
+        if start > self.folded_count:
+            for message in conversation[self.folded_count:start]:
+                if message["role"] in ("user", "assistant"):
+                    self.summary_lines.append(self.summarize(message))
+            self.folded_count = start
+            self._trim_summary()
+
+        to_send = [system]
+        if self.summary_lines:
+            to_send.append({"role": "system", "content": self._summary_text()})
+        to_send.extend(conversation[start:])
+
+        self.last_report = {
+            "sent_tokens": count_messages_tokens(to_send),
+            "full_tokens": system_tokens + count_messages_tokens(conversation),
+            "system_tokens": system_tokens,
+            "summary_tokens": self._summary_tokens(),
+            "window_messages": len(conversation) - start,
+            "folded_messages": self.folded_count,
+        }
+        logger.debug("Prompt budget report: %s", self.last_report)
+        return to_send, self.last_report
+
+    def _window_start(self, conversation, used, budget):
+        """Returns the index of the oldest unfolded message that fits in budget after used tokens."""
+        # Walk back from the newest message until the budget is used up
+        start = len(conversation)
+        while start > self.folded_count:
+            cost = count_message_tokens(conversation[start - 1])
+            keep_anyway = len(conversation) - start < self.min_recent
+            if used + cost > budget and not keep_anyway:
+                break
+            used += cost
+            start -= 1
+        return start
+
+    def _summary_text(self):
+        return "Summary of the earlier conversation:\n" + "\n".join(self.summary_lines)
+
+    def _summary_tokens(self):
+        if not self.summary_lines:
+            return 0
+        return count_tokens(self._summary_text()) + _MESSAGE_OVERHEAD_TOKENS
+
+    def _trim_summary(self):
+        while len(self.summary_lines) > 1 and self._summary_tokens() > SUMMARY_TOKEN_BUDGET:
+            self.summary_lines.pop(0)
@@ -0,0 +1,338 @@
+"""In-memory stand-in for the parts of the Firestore client the app uses.
+
+Supports documents and subcollections, set/update/create/delete with merge and the
+Increment / SERVER_TIMESTAMP / DELETE_FIELD transforms, simple queries, batches,
+and transactions that work with the real @firestore.transactional decorator. The
+transactions use optimistic concurrency: a commit aborts and is retried if a
+document it read has changed since. Every call can be delayed by a configurable
+latency, and the client counts reads, writes and commits, so the fake suits both
+contention checks and load tests without the Firestore emulator. Setting
+fail_next_commits makes that many commits raise ServiceUnavailable, for testing
+how callers handle a failed write.
+"""
+import copy
+import datetime
+import itertools
+import operator
+import threading
+import time
+import uuid
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+_OPERATORS = {
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+    ">": operator.gt, ">=": operator.ge,
+    "in": lambda value, options: value in options,
+    "array_contains": lambda value, item: isinstance(value, list) and item in value,
+}
+
+
+class FakeFirestore:
+    """Thread-safe in-memory Firestore client."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency # Seconds added to every read and commit
+        self._lock = threading.RLock()
+        self._docs = {} # path -> data
+        self._versions = {} # path -> int, bumped on every write
+        self._version_counter = itertools.count(1)
+        self.reads = 0
+        self.writes = 0
+        self.commits = 0
+        self.fail_next_commits = 0 # Commits that raise ServiceUnavailable before the next one succeeds
+
+    # --- Client API ---
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def document(self, path):
+        return FakeDocument(self, path)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return FakeTransaction(self, max_attempts, read_only)
+
+    def reset_counters(self):
+        with self._lock:
+            self.reads = self.writes = self.commits = 0
+
+    # --- Internals ---
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _read(self, path):
+        with self._lock:
+            self.reads += 1
+            return copy.deepcopy(self._docs.get(path)), self._versions.get(path, 0)
+
+    def _apply(self, writes):
+        """Applies [(op, path, data, merge)] atomically as one commit."""
+        with self._lock:
+            if self.fail_next_commits:
+                self.fail_next_commits -= 1
+                raise exceptions.ServiceUnavailable("Injected commit failure")
+            for op, path, _, _ in writes:
+                if op == "create" and path in self._docs:
+                    raise exceptions.AlreadyExists(f"Document already exists: {path}")
+                if op == "update" and path not in self._docs:
+                    raise exceptions.NotFound(f"No document to update: {path}")
+            for op, path, data, merge in writes:
+                if op == "delete":
+                    self._docs.pop(path, None)
+                elif op == "update":
+                    self._docs[path] = _apply_fields(self._docs[path], data, dotted=True)
+                else:
+                    base = self._docs.get(path, {}) if merge else {}
+                    self._docs[path] = _apply_fields(base, data, dotted=False)
+                self._versions[path] = next(self._version_counter)
+            self.writes += len(writes)
+            self.commits += 1
+
+    def _commit(self, writes):
+        self._delay()
+        self._apply(writes)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, version=0):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = version
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = self._data
+        for part in field_path.split("."):
+            if not isinstance(value, dict) or part not in value:
+                raise KeyError(field_path)
+            value = value[part]
+        return copy.deepcopy(value)
+
+
+class FakeDocument:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollection(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        if transaction is not None:
+            return transaction._get(self, field_paths)
+        self._client._delay()
+        data, version = self._client._read(self.path)
+        return FakeSnapshot(self, _project(data, field_paths), version)
+
+    def set(self, document_data, merge=False):
+        self._client._commit([("set", self.path, document_data, merge)])
+
+    def create(self, document_data):
+        self._client._commit([("create", self.path, document_data, False)])
+
+    def update(self, field_updates):
+        self._client._commit([("update", self.path, field_updates, False)])
+
+    def delete(self):
+        self._client._commit([("delete", self.path, None, False)])
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocument) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), orders=(), limit=None, fields=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit, fields=self._fields)
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + [(field_path, direction == "DESCENDING")])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def stream(self, transaction=None):
+        client = self._collection._client
+        client._delay()
+        prefix = self._collection.path + "/"
+        with client._lock:
+            rows = [
+                (path, copy.deepcopy(data)) for path, data in client._docs.items()
+                if path.startswith(prefix) and "/" not in path[len(prefix):]
+            ]
+            client.reads += max(1, len(rows))
+        for field_path, op_string, value in self._filters:
+            if field_path == "__name__":
+                rows = [row for row in rows if _OPERATORS[op_string](row[0].rsplit("/", 1)[-1], getattr(value, "id", value))]
+            else:
+                rows = [row for row in rows if field_path in row[1] and _OPERATORS[op_string](row[1][field_path], value)]
+        for field_path, descending in reversed(self._orders):
+            rows = [row for row in rows if field_path in row[1]]
+            rows.sort(key=lambda row: row[1][field_path], reverse=descending)
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        for path, data in rows:
+            if self._fields is not None:
+                data = {key: value for key, value in data.items() if key in self._fields}
+            yield FakeSnapshot(FakeDocument(client, path), data)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+        super().__init__(self)
+
+    def document(self, document_id=None):
+        return FakeDocument(self._client, f"{self.path}/{document_id or uuid.uuid4().hex}")
+
+    def add(self, document_data):
+        doc = self.document()
+        doc.set(document_data)
+        return None, doc
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference.path, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference.path, document_data, False))
+
+    def update(self, reference, field_updates):
+        self._writes.append(("update", reference.path, field_updates, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference.path, None, False))
+
+    def commit(self):
+        if self._writes:
+            self._client._commit(self._writes)
+        self._writes = []
+
+
+class FakeTransaction(FakeBatch):
+    """Transaction usable with @firestore.transactional (optimistic concurrency)."""
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+
+    def _get(self, reference, field_paths=None):
+        self._client._delay()
+        data, version = self._client._read(reference.path)
+        self._read_versions.setdefault(reference.path, version)
+        return FakeSnapshot(reference, _project(data, field_paths), version)
+
+    def _clean_up(self):
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        self._client._delay()
+        with self._client._lock:
+            for path, version in self._read_versions.items():
+                if self._client._versions.get(path, 0) != version:
+                    self._clean_up()
+                    raise exceptions.Aborted(f"Contention on {path}")
+            if self._writes:
+                self._client._apply(self._writes)
+        self._clean_up()
+        return []
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+
+def _project(data, field_paths):
+    if data is None or field_paths is None:
+        return data
+    return {key: value for key, value in data.items() if key in field_paths}
+
+
+def _apply_fields(base, updates, dotted):
+    """Returns base with updates applied, resolving Firestore transforms and sentinels."""
+    result = copy.deepcopy(base)
+    for key, value in updates.items():
+        parts = key.split(".") if dotted else [key]
+        target = result
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        _set_field(target, parts[-1], value, merge_maps=not dotted)
+    return result
+
+
+def _set_field(target, key, value, merge_maps):
+    if value is transforms.DELETE_FIELD:
+        target.pop(key, None)
+    elif value is transforms.SERVER_TIMESTAMP:
+        target[key] = datetime.datetime.now(datetime.timezone.utc)
+    elif isinstance(value, transforms.Increment):
+        target[key] = (target.get(key) or 0) + value.value
+    elif isinstance(value, transforms.ArrayUnion):
+        current = list(target.get(key) or [])
+        target[key] = current + [item for item in value.values if item not in current]
+    elif isinstance(value, transforms.ArrayRemove):
+        target[key] = [item for item in (target.get(key) or []) if item not in value.values]
+    elif isinstance(value, dict) and merge_maps and isinstance(target.get(key), dict):
+        for sub_key, sub_value in value.items():
+            _set_field(target[key], sub_key, sub_value, merge_maps)
+    elif isinstance(value, dict):
+        target[key] = {}
+        for sub_key, sub_value in value.items():
+            _set_field(target[key], sub_key, sub_value, merge_maps)
+    else:
+        target[key] = copy.deepcopy(value)
@@ -0,0 +1,270 @@
+"""Background queue for visual explanations.
+
+Generating a visual (an OpenAI call to write the image prompt, then an Imagen call) takes
+several seconds, so it runs on a small process-wide worker pool instead of the Streamlit
+script thread. Each request becomes a job:
+
+    users/{username}/image_jobs/{job id}    status, request_key, source_hash, prompt,
+                                            image_ref, error, delivered, created_at, finished_at
+
+The session keeps the ids of its jobs and polls their status. A job that fails refunds
+its token charge from the worker itself, so the refund happens even if the student has
+closed the tab. Jobs for the same source text share a single generation, and each
+student may only have a few jobs running at once.
+"""
+import concurrent.futures
+import contextvars
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+from firebase_admin import firestore
+
+from mindspring import token_ledger
+
+logger = logging.getLogger(__name__)
+
+# Image generations running at once across all sessions
+IMAGE_WORKERS = int(os.environ.get("MINDSPRING_IMAGE_WORKERS", "2"))
+# Jobs one student may have queued or running at the same time
+MAX_JOBS_PER_USER = int(os.environ.get("MINDSPRING_IMAGE_JOBS_PER_USER", "1"))
+# Jobs waiting or running across all sessions before new requests are turned away
+MAX_ACTIVE_JOBS = int(os.environ.get("MINDSPRING_IMAGE_QUEUE_SIZE", "20"))
+# Finished jobs nobody collected are dropped from memory after this long
+JOB_RETENTION_SECONDS = 3600
+# A job still queued or running this long after it was created is taken to have been lost
+# with its process, so a later session may fail and refund it
+JOB_LEASE_SECONDS = int(os.environ.get("MINDSPRING_IMAGE_JOB_LEASE_SECONDS", "900"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class ImageJobRejected(Exception):
+    """Raised when a job can't be queued (per-user limit reached or queue full)."""
+
+
+class ImageJob:
+    """In-memory state of one visual request."""
+
+    def __init__(self, job_id, username, request_key, source_hash):
+        self.id = job_id
+        self.username = username
+        self.request_key = request_key
+        self.source_hash = source_hash
+        self.status = QUEUED
+        self.prompt = None
+        self.image_ref = None # Reference in the image store
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+
+class ImageJobQueue:
+    """Bounded pool running visual generations, with dedup, per-user limits and refunds.
+
+    create_visual(source_text) does the actual work and returns (prompt, image_ref); it
+    runs on a worker thread and must not use Streamlit calls.
+    """
+
+    def __init__(self, db, create_visual, max_workers=IMAGE_WORKERS,
+                 max_per_user=MAX_JOBS_PER_USER, max_active=MAX_ACTIVE_JOBS):
+        self.db = db
+        self.create_visual = create_visual
+        self.max_per_user = max_per_user
+        self.max_active = max_active
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="imagen")
+        self._lock = threading.RLock() # Done callbacks may run inline while it is held
+        self._jobs = {} # job id -> ImageJob
+        self._in_flight = {} # source hash -> future shared by identical requests
+        self._started = set() # source hashes whose generation has begun
+
+    def _job_ref(self, username, job_id):
+        return self.db.collection('users').document(username).collection('image_jobs').document(job_id)
+
+    def submit(self, username, source_text, request_key):
+        """Queues a visual for source_text, already charged under request_key. Returns the job id.
+
+        Raises ImageJobRejected if the student already has the maximum number of jobs
+        running or the queue is full, and re-raises if the job document can't be written
+        (the job is then forgotten); either way the caller should refund the charge.
+        """
+        source_hash = hashlib.sha256(source_text.encode("utf-8")).hexdigest()
+        with self._lock:
+            self._prune()
+            active = [job for job in self._jobs.values() if not job.finished]
+            if sum(job.username == username for job in active) >= self.max_per_user:
+                raise ImageJobRejected("You already have a visual being generated. Please wait for it to finish.")
+            if len(active) >= self.max_active:
+                raise ImageJobRejected("Too many visuals are being generated right now. Please try again shortly.")
+
+            job = ImageJob(uuid.uuid4().hex, username, request_key, source_hash)
+            self._jobs[job.id] = job
+            future = self._in_flight.get(source_hash)
+            if future is None:
+                # In a copy of the caller's context, so spans in create_visual keep the user and subject tags
+                context = contextvars.copy_context()
+                future = self._executor.submit(context.run, self._run, source_hash, source_text)
+                self._in_flight[source_hash] = future
+            elif source_hash in self._started:
+                job.status = RUNNING
+
+        try:
+            self._job_ref(username, job.id).set({
+                'status': job.status,
+                'request_key': request_key,
+                'source_hash': source_hash,
+                'delivered': False,
+                'created_at': firestore.SERVER_TIMESTAMP,
+            })
+        except Exception:
+            self._discard(job, future)
+            raise
+        # Registered after the job document exists so the final status always overwrites it
+        future.add_done_callback(lambda done, job=job: self._finish(job, done))
+        return job.id
+
+    def get(self, job_id):
+        """Returns the ImageJob for an id, or None if this process doesn't know it."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def mark_delivered(self, job_id):
+        """Records that the job's outcome has been shown to the student and forgets it."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._job_ref(job.username, job_id).set({'delivered': True}, merge=True)
+
+    def recover(self, username):
+        """Returns ids of the user's undelivered jobs, so a new session can collect them.
+
+        Finished jobs recorded by another (or a restarted) process are reloaded from their
+        documents. Jobs still queued or running elsewhere are left to that process until
+        they are older than JOB_LEASE_SECONDS; then they are taken to be lost, and are
+        marked failed and refunded in one transaction that only applies while the job is
+        still unfinished, so it happens once and never to a job that completed meanwhile.
+        """
+        recovered = []
+        undelivered = self.db.collection('users').document(username).collection('image_jobs').where(
+            filter=firestore.FieldFilter('delivered', '==', False)
+        ).stream()
+        for doc in undelivered:
+            if self.get(doc.id) is not None:
+                recovered.append(doc.id)
+                continue
+            data = doc.to_dict()
+            job = ImageJob(doc.id, username, data.get('request_key'), data.get('source_hash'))
+            job.finished_at = time.monotonic()
+            if data.get('status') == SUCCEEDED and data.get('image_ref'):
+                job.status, job.prompt, job.image_ref = SUCCEEDED, data.get('prompt'), data['image_ref']
+            elif data.get('status') == FAILED:
+                job.status, job.error = FAILED, data.get('error') or "failed" # The worker refunded it
+            elif _age_seconds(data.get('created_at')) > JOB_LEASE_SECONDS and self._abandon(job):
+                job.status, job.error = FAILED, "interrupted"
+            else:
+                continue # Still being generated by another process, or recovered by another session
+            with self._lock:
+                self._jobs.setdefault(job.id, job)
+            recovered.append(job.id)
+        return recovered
+
+    def _abandon(self, job):
+        """Marks a lost job failed and refunds it, if it is still unfinished. Returns whether it was."""
+        job_ref = self._job_ref(job.username, job.id)
+        ledger = token_ledger.TokenLedger(self.db)
+
+        @firestore.transactional
+        def abandon_in_transaction(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists or snapshot.get('status') not in (QUEUED, RUNNING):
+                return False
+            if job.request_key:
+                ledger.refund_in_transaction(transaction, job.username, job.request_key, reason="visual interrupted")
+            transaction.set(job_ref, {
+                'status': FAILED,
+                'error': "interrupted",
+                'finished_at': firestore.SERVER_TIMESTAMP,
+            }, merge=True)
+            return True
+
+        try:
+            return abandon_in_transaction(self.db.transaction(max_attempts=token_ledger.TRANSACTION_ATTEMPTS))
+        except Exception:
+            logger.exception("Could not fail and refund lost image job %s; retried on the next recovery", job.id)
+            return False
+
+    # --- Worker side ---
+
+    def _run(self, source_hash, source_text):
+        with self._lock:
+            self._started.add(source_hash)
+            for job in self._jobs.values():
+                if job.source_hash == source_hash and job.status == QUEUED:
+                    job.status = RUNNING
+        return self.create_visual(source_text)
+
+    def _discard(self, job, future):
+        """Forgets a job whose document couldn't be written, so it doesn't count against the limits."""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            if any(other.source_hash == job.source_hash for other in self._jobs.values()):
+                return # Another job is waiting for the same generation
+            if future.cancel():
+                self._forget_in_flight(job.source_hash, future)
+            else:
+                future.add_done_callback(lambda done: self._forget_in_flight(job.source_hash, done))
+
+    def _forget_in_flight(self, source_hash, future):
+        with self._lock:
+            if self._in_flight.get(source_hash) is future:
+                del self._in_flight[source_hash]
+                self._started.discard(source_hash)
+
+    def _finish(self, job, future):
+        self._forget_in_flight(job.source_hash, future)
+        error = future.exception()
+        if error is None:
+            job.prompt, job.image_ref = future.result()
+        else:
+            logger.warning("Visual generation for %s failed: %s", job.username, error)
+            job.error = str(error) or error.__class__.__name__
+            self._refund(job.username, job.request_key)
+        job.finished_at = time.monotonic()
+        job.status = SUCCEEDED if error is None else FAILED
+        try:
+            self._job_ref(job.username, job.id).set({
+                'status': job.status,
+                'prompt': job.prompt,
+                'image_ref': job.image_ref,
+                'error': job.error,
+                'finished_at': firestore.SERVER_TIMESTAMP,
+            }, merge=True)
+        except Exception:
+            logger.exception("Could not record the outcome of image job %s", job.id)
+
+    def _refund(self, username, request_key):
+        if not request_key:
+            return
+        try:
+            token_ledger.TokenLedger(self.db).refund(username, request_key, reason="visual failed")
+        except Exception:
+            logger.exception("Refund of %s for %s failed", request_key, username)
+
+    def _prune(self):
+        cutoff = time.monotonic() - JOB_RETENTION_SECONDS
+        for job_id in [job.id for job in self._jobs.values() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+def _age_seconds(created_at):
+    """Returns the seconds since a stored timestamp (infinite if it is missing)."""
+    if created_at is None:
+        return float("inf")
+    return (datetime.datetime.now(datetime.timezone.utc) - created_at).total_seconds()
@@ -0,0 +1,149 @@
+"""Content-addressed storage for generated images.
+
+Chat history keeps a short reference (the SHA-256 of the PNG bytes) instead of a
+base64 data URL, so each image message is a few dozen bytes in Firestore and in
+session state. The bytes live in a store backend: a local directory by default, or
+a Cloud Storage bucket when MINDSPRING_IMAGE_BUCKET is set. Thumbnails for the chat
+display are generated on first use and cached on local disk.
+"""
+import abc
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+
+from mindspring.syllabus_cache import write_atomic
+
+IMAGE_STORE_DIR = os.environ.get("MINDSPRING_IMAGE_STORE_DIR", os.path.join("data", "images"))
+# Thumbnails are derived data and can be rebuilt, so they live with the other caches
+THUMBNAIL_DIR = os.environ.get("MINDSPRING_THUMBNAIL_DIR", os.path.join(".cache", "thumbnails"))
+# Longest side of the thumbnails shown in the chat history
+THUMBNAIL_SIZE = 256
+
+_REF_RE = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URL_RE = re.compile(r"^data:(image/[\w.+-]+);base64,(.*)$", re.DOTALL)
+
+
+def is_image_ref(value):
+    """True if value is a reference returned by ImageStore.put (not a legacy data URL)."""
+    return isinstance(value, str) and bool(_REF_RE.match(value))
+
+
+def decode_data_url(url):
+    """Returns the bytes of a base64 image data URL. Raises ValueError if it isn't one."""
+    match = _DATA_URL_RE.match(url)
+    if not match:
+        raise ValueError("Not a base64 image data URL")
+    try:
+        return base64.b64decode(match.group(2), validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"Invalid base64 image data: {e}") from e
+
+
+class ImageStore(abc.ABC):
+    """Base class for image backends: subclasses implement _write, _read and exists."""
+
+    def __init__(self, thumbnail_dir=THUMBNAIL_DIR):
+        self.thumbnail_dir = thumbnail_dir
+
+    def put(self, data):
+        """Stores PNG bytes (once per distinct content) and returns their reference."""
+        ref = hashlib.sha256(data).hexdigest()
+        if not self.exists(ref):
+            self._write(ref, data)
+        return ref
+
+    def get(self, ref):
+        """Returns the image bytes for a reference. Raises FileNotFoundError if missing."""
+        if not is_image_ref(ref):
+            raise ValueError(f"Invalid image reference: {ref!r}")
+        return self._read(ref)
+
+    def thumbnail(self, ref, size=THUMBNAIL_SIZE):
+        """Returns PNG bytes of the image scaled to fit within size x size, cached on disk."""
+        path = os.path.join(self.thumbnail_dir, f"{ref}-{size}.png")
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        from PIL import Image # Imported for the first thumbnail, not with the app
+        with Image.open(io.BytesIO(self.get(ref))) as image:
+            image.thumbnail((size, size))
+            out = io.BytesIO()
+            image.save(out, format="PNG", optimize=True)
+        data = out.getvalue()
+        write_atomic(path, data)
+        return data
+
+    @abc.abstractmethod
+    def exists(self, ref):
+        """True if the image is stored."""
+
+    @abc.abstractmethod
+    def _write(self, ref, data):
+        """Stores the bytes of a new image under its reference."""
+
+    @abc.abstractmethod
+    def _read(self, ref):
+        """Returns the bytes of a stored image. Raises FileNotFoundError if missing."""
+
+
+class LocalImageStore(ImageStore):
+    """Images as files under a local directory, fanned out by the first two hex digits."""
+
+    def __init__(self, directory=IMAGE_STORE_DIR, thumbnail_dir=THUMBNAIL_DIR):
+        super().__init__(thumbnail_dir)
+        self.directory = directory
+
+    def path(self, ref):
+        return os.path.join(self.directory, ref[:2], f"{ref}.png")
+
+    def exists(self, ref):
+        return os.path.exists(self.path(ref))
+
+    def _write(self, ref, data):
+        write_atomic(self.path(ref), data)
+
+    def _read(self, ref):
+        with open(self.path(ref), "rb") as f:
+            return f.read()
+
+
+class BucketImageStore(ImageStore):
+    """Images as objects in a Google Cloud Storage bucket (e.g. the Firebase Storage bucket)."""
+
+    def __init__(self, bucket, prefix="images/", thumbnail_dir=THUMBNAIL_DIR):
+        super().__init__(thumbnail_dir)
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _blob(self, ref):
+        return self.bucket.blob(f"{self.prefix}{ref}.png")
+
+    def exists(self, ref):
+        return self._blob(ref).exists()
+
+    def _write(self, ref, data):
+        blob = self._blob(ref)
+        # Content-addressed objects never change, so they can be cached indefinitely
+        blob.cache_control = "public, max-age=31536000, immutable"
+        blob.upload_from_string(data, content_type="image/png")
+
+    def _read(self, ref):
+        from google.api_core import exceptions
+        try:
+            return self._blob(ref).download_as_bytes()
+        except exceptions.NotFound as e:
+            raise FileNotFoundError(ref) from e
+
+
+def default_store():
+    """Returns the store configured by the environment (bucket if MINDSPRING_IMAGE_BUCKET is set)."""
+    bucket_name = os.environ.get("MINDSPRING_IMAGE_BUCKET")
+    if bucket_name:
+        from firebase_admin import storage
+        return BucketImageStore(storage.bucket(bucket_name))
+    return LocalImageStore()
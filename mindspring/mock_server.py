@@ -0,0 +1,149 @@
+"""Local stand-in for the OpenAI chat completions and Imagen predict endpoints.
+
+Run it and point the app at it to exercise the app (and its retry/backoff handling)
+without real API keys:
+
+    python -m mindspring.mock_server --port 8089 --fail-first 1
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 \\
+    IMAGEN_API_URL=http://127.0.0.1:8089/v1beta/models/imagen:predict \\
+    streamlit run app.py
+
+--fail-first N answers the first N requests to each endpoint with a 503 so the
+client retries can be observed. --latency adds a fixed delay to every response.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A 1x1 PNG, enough for st.image to render
+_PIXEL_PNG_B64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+
+MOCK_REPLY = "This is a mock tutor reply. Osmosis is the movement of water across a membrane."
+
+
+class MockAPIServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the mock configuration and request counts."""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, fail_first=0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.fail_first = fail_first
+        self.request_counts = {}
+        self._counts_lock = threading.Lock()
+
+    def count(self, endpoint):
+        with self._counts_lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+            return self.request_counts[endpoint]
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "Invalid JSON"}})
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            endpoint = "chat"
+        elif ":predict" in self.path:
+            endpoint = "imagen"
+        else:
+            return self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.count(endpoint) <= self.server.fail_first:
+            return self._send_json(503, {"error": {"message": "Mock overload, retry"}})
+
+        if endpoint == "imagen":
+            return self._send_json(200, {"predictions": [{"bytesBase64Encoded": _PIXEL_PNG_B64}]})
+        if body.get("stream"):
+            return self._send_chat_stream(body)
+        return self._send_json(200, _completion(body))
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chat_stream(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = MOCK_REPLY.split(" ")
+        for i, word in enumerate(words):
+            delta = {"content": word + (" " if i < len(words) - 1 else "")}
+            self._send_chunk({**_chunk_base(body), "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        self._send_chunk({**_chunk_base(body), "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_chunk({**_chunk_base(body), "choices": [], "usage": _usage(body)})
+        self._write_chunked(b"data: [DONE]\n\n")
+        self._write_chunked(b"")
+
+    def _send_chunk(self, payload):
+        self._write_chunked(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _write_chunked(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def _chunk_base(body):
+    return {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", "mock")}
+
+
+def _usage(body):
+    prompt_chars = sum(len(str(msg.get("content", ""))) for msg in body.get("messages", []))
+    completion_tokens = len(MOCK_REPLY) // 4
+    return {"prompt_tokens": prompt_chars // 4, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_chars // 4 + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0}}
+
+
+def _completion(body):
+    return {
+        "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": MOCK_REPLY}}],
+        "usage": _usage(body),
+    }
+
+
+def start_in_background(port=0, latency=0.0, fail_first=0):
+    """Starts a mock server on a daemon thread and returns it (use .base_url, .shutdown())."""
+    server = MockAPIServer(("127.0.0.1", port), latency=latency, fail_first=fail_first)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay every response")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N requests per endpoint with 503")
+    args = parser.parse_args()
+    server = MockAPIServer(("127.0.0.1", args.port), latency=args.latency, fail_first=args.fail_first)
+    print(f"Mock OpenAI/Imagen server on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,193 @@
+"""Clean-up of extracted syllabus text before it is chunked and put in prompts.
+
+pypdf output carries a lot that is useless to the model: running page headers and
+footers ("CXC 23/G/SYLL 23 5 www.cxc.org"), page numbers, words broken across lines,
+runs of spaces, table rules, contents pages with dot leaders, and the copyright and
+contact front matter. PageNormalizer removes these page by page:
+
+- header/footer lines are found by their repetition: the first and last lines of each
+  page are compared with digits removed, and a line seen on enough pages is dropped
+  wherever it appears at the top or bottom of a page
+- page numbers at the top or bottom of a page are dropped
+- a word hyphenated at a line end is joined with the next line; the hyphen is kept
+  unless the joined word already occurs without it in the document
+- whitespace is collapsed and blank lines dropped
+- contents lines, lines with no letters or digits, contact lines and the exact
+  copyright boilerplate ("Copyright © 2017 Caribbean Examinations Council", "All rights
+  reserved") are dropped
+- a short page is dropped as front matter only if it carries the council's copyright
+  or contact signature and is one of the first FRONT_MATTER_PAGES pages or a specimen
+  paper's cover. Content pages mentioning copyright (intellectual property objectives,
+  copyright infringement) are kept
+
+Line structure is kept, since retrieval chunking relies on headings and numbered
+objectives starting a line. Headers and footers are learned from the first LEARN_PAGES
+pages, which are held back until then; after that the set is fixed, so a long section's
+"(cont'd)" heading is never mistaken for a running header.
+"""
+import re
+from collections import Counter
+
+from mindspring import context_budget
+
+# Pages buffered to learn the running headers/footers before emitting anything
+LEARN_PAGES = 12
+# A top/bottom line seen on this share of the learning pages (and at least MIN_REPEATS) is a running header/footer
+REPEAT_SHARE = 0.5
+MIN_REPEATS = 3
+# Lines at each end of a page checked for headers, footers and page numbers
+EDGE_LINES = 3
+# Pages with the council's signature and at most this many lines may be front matter
+FRONT_MATTER_MAX_LINES = 40
+# Leading pages that may be front matter (cover, correspondence address, copyright)
+FRONT_MATTER_PAGES = 4
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACES_RE = re.compile(r"[ \t\u00a0\u2000-\u200b]+")
+_PAGE_NUMBER_RE = re.compile(r"^(?:page\s+)?[-–(]?\s*\d{1,4}\s*[-–)]?(?:\s+of\s+\d{1,4})?$", re.IGNORECASE)
+# "RATIONALE ......... 1" or "AIMS ....... ....... 12"
+_CONTENTS_RE = re.compile(r"(?:\.\s?){8,}\s*\d{0,4}$")
+# Only the boilerplate lines themselves: syllabus content also mentions copyright
+_COPYRIGHT_RE = re.compile(
+    r"^(?:copyright\s*(?:©|\(c\))?\s*\d{4}(?:\s*-\s*\d{4})?\s+(?:by\s+)?(?:the\s+)?caribbean examinations council"
+    r"(?:\W*\s+all rights reserved)?|all rights reserved)\W*$",
+    re.IGNORECASE,
+)
+_CONTACT_RE = re.compile(r"^(?:telephone|facsimile|fax|e-?mail address|website)\b.*:", re.IGNORECASE)
+_CORRESPONDENCE_RE = re.compile(r"^correspondence related to the (?:syllabus|examination)", re.IGNORECASE)
+# Specimen papers are marked "SPECIMEN PAPER", "SPEC 2017/01229010" or "FORM SPEC 2015"
+_SPECIMEN_RE = re.compile(r"\bspec(?:imen)?\b", re.IGNORECASE)
+_ALNUM_RE = re.compile(r"[^\W_]")
+_ALPHA_RE = re.compile(r"[^\W\d_]")
+_HYPHEN_END_RE = re.compile(r"([^\W\d_]+)-$")
+_WORD_START_RE = re.compile(r"^([^\W\d_]+)")
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+class NormalizationStats:
+    """Before/after sizes of a normalized text and what was removed."""
+
+    def __init__(self):
+        self.raw_chars = 0
+        self.chars = 0
+        self.raw_tokens = 0
+        self.tokens = 0
+        self.removed = Counter() # kind -> lines (or pages) removed
+
+    def to_dict(self):
+        return {
+            "raw_chars": self.raw_chars,
+            "chars": self.chars,
+            "raw_tokens": self.raw_tokens,
+            "tokens": self.tokens,
+            "removed": dict(self.removed),
+        }
+
+
+class PageNormalizer:
+    """Normalizes page texts fed in order. feed() and finish() return the pages ready so far."""
+
+    def __init__(self):
+        self.stats = NormalizationStats()
+        self._edge_counts = Counter() # top/bottom line key -> learning pages it was seen on
+        self._pages_seen = 0
+        self._running = None # Header/footer keys, fixed once learning ends
+        self._pending = [] # Pages held back while learning
+        self._vocabulary = set() # Lowercased words seen, for de-hyphenation
+
+    def feed(self, text):
+        """Adds the next page's raw text. Returns a list of normalized page texts now ready."""
+        self.stats.raw_chars += len(text)
+        self.stats.raw_tokens += context_budget.count_text_tokens(text)
+        lines = [_SPACES_RE.sub(" ", line).strip() for line in text.split("\n")]
+        lines = [line for line in lines if line]
+        self._pages_seen += 1
+        if self._running is None:
+            for key in {_edge_key(line) for line in lines[:EDGE_LINES] + lines[-EDGE_LINES:]}:
+                if _ALPHA_RE.search(key):
+                    self._edge_counts[key] += 1
+        self._vocabulary.update(word.lower() for word in _WORD_RE.findall(text))
+
+        self._pending.append((self._pages_seen, lines))
+        if self._pages_seen < LEARN_PAGES:
+            return []
+        return self._drain()
+
+    def finish(self):
+        """Returns the pages still held back. Call once after the last page."""
+        return self._drain()
+
+    def _drain(self):
+        if self._running is None:
+            threshold = max(MIN_REPEATS, REPEAT_SHARE * self._pages_seen)
+            self._running = {key for key, count in self._edge_counts.items() if count >= threshold}
+        ready = [self._clean(number, lines) for number, lines in self._pending]
+        self._pending = []
+        for page in ready:
+            self.stats.chars += len(page)
+            self.stats.tokens += context_budget.count_text_tokens(page)
+        return ready
+
+    def _clean(self, number, lines):
+        removed = self.stats.removed
+        if _is_front_matter(number, lines):
+            removed["front_matter_pages"] += 1
+            return ""
+
+        kept = []
+        last = len(lines) - 1
+        for index, line in enumerate(lines):
+            at_edge = index < EDGE_LINES or index > last - EDGE_LINES
+            if at_edge and _edge_key(line) in self._running:
+                removed["header_footer"] += 1
+            elif at_edge and _PAGE_NUMBER_RE.match(line):
+                removed["page_number"] += 1
+            elif _CONTENTS_RE.search(line):
+                removed["contents"] += 1
+            elif _COPYRIGHT_RE.match(line) or _CONTACT_RE.match(line):
+                removed["boilerplate"] += 1
+            elif not _ALNUM_RE.search(line):
+                removed["debris"] += 1
+            else:
+                kept.append(line)
+        return "\n".join(self._dehyphenate(kept))
+
+    def _dehyphenate(self, lines):
+        joined = []
+        for line in lines:
+            if joined:
+                broken = _HYPHEN_END_RE.search(joined[-1])
+                continuation = _WORD_START_RE.match(line)
+                if broken and continuation and line[0].islower():
+                    word = (broken.group(1) + continuation.group(1)).lower()
+                    separator = "" if word in self._vocabulary else "-"
+                    joined[-1] = joined[-1][:-1] + separator + line
+                    self.stats.removed["hyphen_breaks"] += 1
+                    continue
+            joined.append(line)
+        return joined
+
+
+def normalize_text(pages):
+    """Normalizes a list of page texts at once. Returns (normalized text, NormalizationStats)."""
+    normalizer = PageNormalizer()
+    ready = []
+    for page in pages:
+        ready.extend(normalizer.feed(page))
+    ready.extend(normalizer.finish())
+    return "".join(page + "\n" for page in ready), normalizer.stats
+
+
+def _is_front_matter(number, lines):
+    """True for a short leading page or specimen cover that carries the council's copyright or contact signature."""
+    if len(lines) > FRONT_MATTER_MAX_LINES:
+        return False
+    if number > FRONT_MATTER_PAGES and not any(_SPECIMEN_RE.search(line) for line in lines):
+        return False
+    return any(_COPYRIGHT_RE.match(line) or _CONTACT_RE.match(line) or _CORRESPONDENCE_RE.match(line)
+               for line in lines)
+
+
+def _edge_key(line):
+    """Drops digits and case so "Page 4 of 90", "Page 5 of 90" and "Page of" compare equal."""
+    return " ".join(_DIGITS_RE.sub("", line.lower()).split())
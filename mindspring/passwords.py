@@ -0,0 +1,157 @@
+"""Password hashing off the script thread, and login rate limiting.
+
+bcrypt is deliberately slow (about 0.25s at the default cost of 12) and releases the
+GIL while it works, so PasswordHasher runs it on a small process-wide thread pool:
+a burst of logins then uses every core instead of queueing behind each other on the
+Streamlit script threads. The cost factor is configurable; a hash made with a
+different cost is reported by needs_rehash() so it can be replaced at the next
+successful login.
+
+LoginRateLimiter rejects attempts before any bcrypt work is spent once a username has
+failed too often. Failures per client address are also limited, but only when the
+address identifies one client (MINDSPRING_LOGIN_ADDRESS_SOURCE): behind Streamlit Cloud,
+another proxy or a school's NAT every student shares the TCP peer address, and a limit
+on it would let one person lock out the whole class. Successful logins are never counted.
+"""
+import collections
+import concurrent.futures
+import os
+import re
+import threading
+import time
+
+import bcrypt
+
+# bcrypt work factor for new hashes (each +1 doubles the time per hash)
+BCRYPT_ROUNDS = int(os.environ.get("MINDSPRING_BCRYPT_ROUNDS", "12"))
+# Threads running bcrypt at once across all sessions
+HASH_WORKERS = int(os.environ.get("MINDSPRING_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Seconds a login waits for a free worker and its hash before giving up
+HASH_TIMEOUT_SECONDS = 30
+
+# Failed logins allowed per username / per client address within the window
+MAX_FAILURES_PER_USER = int(os.environ.get("MINDSPRING_LOGIN_FAILURES_PER_USER", "5"))
+MAX_FAILURES_PER_ADDRESS = int(os.environ.get("MINDSPRING_LOGIN_FAILURES_PER_ADDRESS", "100"))
+# Where the client address for the per-address limit comes from: "" (no per-address limit),
+# "peer" (the TCP peer, when the app is served directly) or N (the address N entries from the
+# end of X-Forwarded-For, for N trusted proxies in front of the app)
+LOGIN_ADDRESS_SOURCE = os.environ.get("MINDSPRING_LOGIN_ADDRESS_SOURCE", "").strip().lower()
+RATE_LIMIT_WINDOW_SECONDS = float(os.environ.get("MINDSPRING_LOGIN_WINDOW_SECONDS", "300"))
+# Above this many tracked usernames/addresses, expired ones are swept on the next check
+_SWEEP_THRESHOLD = 10000
+
+_COST_RE = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+
+class LoginRateLimited(Exception):
+    """Raised when a login is refused before checking the password. retry_after is in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def hash_cost(hashed_password):
+    """Returns the work factor a bcrypt hash was made with, or None if it isn't a bcrypt hash."""
+    match = _COST_RE.match(hashed_password or "")
+    return int(match.group(1)) if match else None
+
+
+def client_address(peer, forwarded_for, source=LOGIN_ADDRESS_SOURCE):
+    """Returns the address to rate-limit logins by, or None if it can't be trusted to identify one client."""
+    if source == "peer":
+        return peer or None
+    if source.isdigit() and int(source) > 0:
+        # Each trusted proxy appends the address it received the request from
+        hops = [entry.strip() for entry in (forwarded_for or "").split(",") if entry.strip()]
+        return hops[-int(source)] if len(hops) >= int(source) else None
+    return None
+
+
+class PasswordHasher:
+    """bcrypt on a bounded thread pool, with a configurable cost."""
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=HASH_WORKERS):
+        self.rounds = rounds
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    def hash(self, password):
+        """Returns a new bcrypt hash of the password (as str)."""
+        return self._run(_hash, password.encode("utf-8"), self.rounds)
+
+    def verify(self, password, hashed_password):
+        """True if the password matches the hash. Malformed hashes never match."""
+        return self._run(_verify, password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+    def needs_rehash(self, hashed_password):
+        """True if the hash was made with a different cost than the configured one."""
+        return hash_cost(hashed_password) != self.rounds
+
+    def _run(self, function, *args):
+        return self._executor.submit(function, *args).result(timeout=HASH_TIMEOUT_SECONDS)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _verify(password, hashed_password):
+    try:
+        return bcrypt.checkpw(password, hashed_password)
+    except ValueError: # Not a bcrypt hash
+        return False
+
+
+class LoginRateLimiter:
+    """Sliding-window counts of failed logins per username and client address."""
+
+    def __init__(self, window=RATE_LIMIT_WINDOW_SECONDS, max_user_failures=MAX_FAILURES_PER_USER,
+                 max_address_failures=MAX_FAILURES_PER_ADDRESS):
+        self.window = window
+        self.max_user_failures = max_user_failures
+        self.max_address_failures = max_address_failures
+        self._lock = threading.Lock()
+        self._events = collections.defaultdict(collections.deque) # (kind, key) -> event times, oldest first
+
+    def check(self, username, address=None):
+        """Raises LoginRateLimited if the attempt must be refused. Call before bcrypt.
+
+        address is the result of client_address(); None skips the per-address limit.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if len(self._events) > _SWEEP_THRESHOLD:
+                for key in list(self._events):
+                    self._recent(key, now)
+            limits = [(("user_failure", username.lower()), self.max_user_failures)]
+            if address:
+                limits.append((("address_failure", address), self.max_address_failures))
+            for key, limit in limits:
+                events = self._recent(key, now)
+                if len(events) >= limit:
+                    raise LoginRateLimited(
+                        "Too many login attempts. Please wait a few minutes and try again.",
+                        retry_after=max(1, int(events[0] + self.window - now)),
+                    )
+
+    def record_failure(self, username, address=None):
+        now = time.monotonic()
+        with self._lock:
+            self._events[("user_failure", username.lower())].append(now)
+            if address:
+                self._events[("address_failure", address)].append(now)
+
+    def record_success(self, username):
+        """Clears the username's failures (the address keeps its counts)."""
+        with self._lock:
+            self._events.pop(("user_failure", username.lower()), None)
+
+    def _recent(self, key, now):
+        events = self._events.get(key)
+        if events is None:
+            return ()
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+        return events
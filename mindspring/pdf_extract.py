@@ -0,0 +1,101 @@
+"""Page-parallel PDF text extraction.
+
+pypdf is pure Python, so extracting a long syllabus is bound to one core. Pages are
+independent, though: iter_pages() fans them out over a pool of worker processes (each
+opens the PDF once) and yields the page texts in order as they complete, so a caller
+can write or chunk the first pages while later ones are still being extracted. A page
+that fails to extract is yielded empty with its error instead of aborting the file,
+and every page records how long it took.
+
+Worker processes are only used when it is safe to spawn them: a spawned worker
+re-imports the parent's __main__, which under Streamlit is the app script itself. In
+that case (and for short PDFs) pages are extracted in the calling process.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Worker processes per PDF (1 extracts in the calling process)
+PDF_WORKERS = int(os.environ.get("MINDSPRING_PDF_WORKERS", str(os.cpu_count() or 1)))
+# PDFs shorter than this aren't worth starting workers for
+MIN_PAGES_FOR_WORKERS = 16
+
+# The PdfReader opened by each worker process
+_worker_reader = None
+
+
+class PageText:
+    """The text of one page, how long it took and the error if extraction failed."""
+
+    __slots__ = ("index", "text", "seconds", "error")
+
+    def __init__(self, index, text, seconds, error=None):
+        self.index = index
+        self.text = text
+        self.seconds = seconds
+        self.error = error
+
+
+def can_use_processes():
+    """True if worker processes can be spawned without re-running the main script.
+
+    Spawn re-imports __main__ by module name when it was started with -m, and by path
+    otherwise; a script without a module spec (Streamlit's app, plain scripts) is
+    not safe to re-run.
+    """
+    main = sys.modules.get("__main__")
+    return getattr(main, "__spec__", None) is not None or getattr(main, "__file__", None) is None
+
+
+def iter_pages(file_path, workers=PDF_WORKERS):
+    """Yields a PageText for every page of a PDF, in page order."""
+    reader = _open(file_path)
+    page_count = len(reader.pages)
+    if workers <= 1 or page_count < MIN_PAGES_FOR_WORKERS or not can_use_processes():
+        for index in range(page_count):
+            yield _extract(reader, index)
+        return
+
+    next_index = 0
+    context = multiprocessing.get_context("spawn")
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, page_count), mp_context=context,
+                                                    initializer=_open_in_worker, initargs=(file_path,)) as pool:
+            # Several pages per task keep the pickling overhead down; map() still yields in order
+            chunksize = max(1, page_count // (workers * 8))
+            for page in pool.map(_extract_in_worker, range(page_count), chunksize=chunksize):
+                next_index += 1
+                yield page
+    except concurrent.futures.process.BrokenProcessPool:
+        logger.warning("PDF workers for %s died at page %d; extracting the rest here", file_path, next_index + 1)
+        for index in range(next_index, page_count):
+            yield _extract(reader, index)
+
+
+def _open(file_path):
+    from pypdf import PdfReader # Imported when a PDF is first read, not with the app
+    return PdfReader(file_path)
+
+
+def _extract(reader, index):
+    started = time.perf_counter()
+    try:
+        text, error = reader.pages[index].extract_text() or "", None
+    except Exception as e:
+        text, error = "", f"{e.__class__.__name__}: {e}"
+        logger.warning("Page %d could not be extracted: %s", index + 1, error)
+    return PageText(index, text, round(time.perf_counter() - started, 4), error)
+
+
+def _open_in_worker(file_path):
+    global _worker_reader
+    _worker_reader = _open(file_path)
+
+
+def _extract_in_worker(index):
+    return _extract(_worker_reader, index)
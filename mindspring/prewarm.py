@@ -0,0 +1,219 @@
+"""Background pre-warming of subject files at process startup.
+
+Extracting a syllabus PDF takes seconds of CPU, so instead of the first student to
+pick a subject paying for it, every syllabus is extracted and indexed as soon as the
+process starts, in parallel worker processes (pypdf is pure Python and bound by the
+GIL). Each worker is a `python -m mindspring.prewarm --file <pdf>` subprocess rather
+than a multiprocessing pool: under Streamlit, __main__ is the app script, which a
+spawned pool worker would re-execute. Workers write the usual cache artifacts; the
+app process then loads the finished text and index from disk, which takes
+milliseconds. Subject prompt prefixes are built at the same time.
+
+Syllabi whose text is already in the disk cache are only loaded, in this process,
+without starting a worker. Each subject moves from "pending" through "preparing" to
+"ready" (or "failed", in which case the app falls back to extracting on demand).
+Per-file timings are kept and shown on the admin page.
+
+Warm everything from the command line with:
+
+    python -m mindspring.prewarm
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from mindspring import prompts, retrieval, syllabus_cache
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for extraction (0 warms in a background thread of this process instead)
+PREWARM_WORKERS = int(os.environ.get("MINDSPRING_PREWARM_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+PENDING, PREPARING, READY, FAILED = "pending", "preparing", "ready", "failed"
+
+# Directory containing the mindspring package, so workers can import it from any cwd
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def warm_syllabus(path):
+    """Extracts and indexes one syllabus into the on-disk caches. Returns its timings.
+
+    Runs in a worker process, so it only touches module-level caches and files.
+    """
+    started = time.perf_counter()
+    syllabus = syllabus_cache.get_syllabus(path)
+    extracted = time.perf_counter()
+    retrieval.get_index(path)
+    return {
+        "pid": os.getpid(),
+        "chars": syllabus.meta.get("chars"),
+        "pages": syllabus.meta.get("pages"),
+        "failed_pages": len(syllabus.meta.get("failed_pages") or ()),
+        "raw_tokens": (syllabus.meta.get("normalization") or {}).get("raw_tokens"),
+        "tokens": (syllabus.meta.get("normalization") or {}).get("tokens"),
+        "extract_seconds": round(extracted - started, 3),
+        "index_seconds": round(time.perf_counter() - extracted, 3),
+    }
+
+
+def _warm_in_subprocess(path, page_workers):
+    """Runs warm_syllabus for one PDF in a fresh Python process. Returns its timings."""
+    env = dict(os.environ)
+    env["MINDSPRING_PDF_WORKERS"] = str(page_workers)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [_PACKAGE_ROOT, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-m", "mindspring.prewarm", "--file", path],
+        capture_output=True, text=True, env=env, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Worker for {path} exited with {result.returncode}: {result.stderr.strip()[-500:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+class Prewarmer:
+    """Warms every subject of a SubjectRegistry in the background and tracks their state."""
+
+    def __init__(self, registry, workers=PREWARM_WORKERS):
+        self.registry = registry
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._status = {}
+        self._events = {}
+        self._timings = {}
+        self._thread = None
+        self.total_seconds = None
+
+    def start(self):
+        """Starts warming on a daemon thread (once)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            for subject in self.registry.all():
+                if subject.available:
+                    self._status[subject.name] = PENDING
+                    self._events[subject.name] = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="subject-prewarm", daemon=True)
+        self._thread.start()
+
+    def status(self, name):
+        """Returns the subject's state. Subjects added after startup count as ready (loaded on demand)."""
+        with self._lock:
+            return self._status.get(name, READY)
+
+    def is_ready(self, name):
+        return self.status(name) in (READY, FAILED)
+
+    def wait(self, name, timeout=None):
+        """Blocks until the subject is warmed (or failed). Returns False on timeout."""
+        event = self._events.get(name)
+        return event is None or event.wait(timeout)
+
+    def timings(self):
+        """Returns {path: timings} for the syllabi warmed so far."""
+        with self._lock:
+            return {path: dict(timing) for path, timing in self._timings.items()}
+
+    # --- Background work ---
+
+    def _run(self):
+        started = time.perf_counter()
+        pdf_subjects = []
+        for subject in self.registry.all():
+            if not subject.available:
+                continue
+            prompts.subject_prefix(subject.name, subject.context_text)
+            if subject.syllabus_path:
+                pdf_subjects.append(subject)
+            else:
+                self._finish(subject.name, READY)
+
+        for subject in pdf_subjects:
+            self._set_status(subject.name, PREPARING)
+        # Loading a cached syllabus takes milliseconds, far less than starting a worker for it
+        cached = [subject for subject in pdf_subjects if syllabus_cache.cached_syllabus(subject.syllabus_path)]
+        to_extract = [subject for subject in pdf_subjects if subject not in cached]
+        try:
+            for subject in cached:
+                self._warm_here(subject, source="cache")
+            if self.workers > 0 and len(to_extract) > 1:
+                self._warm_in_processes(to_extract)
+            else:
+                for subject in to_extract:
+                    self._warm_here(subject)
+        except Exception:
+            logger.exception("Pre-warming stopped early; remaining subjects load on demand")
+        finally:
+            for subject in pdf_subjects:
+                if not self.is_ready(subject.name):
+                    self._finish(subject.name, FAILED)
+        self.total_seconds = round(time.perf_counter() - started, 3)
+        logger.info("Pre-warmed %d syllabi in %.1fs", len(pdf_subjects), self.total_seconds)
+
+    def _warm_in_processes(self, pdf_subjects):
+        # Each thread just waits on its worker process, so the threads don't compete for the GIL
+        file_workers = min(self.workers, len(pdf_subjects))
+        # The cores left over are shared out for page-parallel extraction inside each worker
+        page_workers = max(1, (os.cpu_count() or 1) // file_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=file_workers, thread_name_prefix="prewarm") as pool:
+            futures = {pool.submit(_warm_in_subprocess, subject.syllabus_path, page_workers): subject
+                       for subject in pdf_subjects}
+            for future in concurrent.futures.as_completed(futures):
+                subject = futures[future]
+                try:
+                    timing = future.result()
+                    self._load(subject, timing, source="worker process")
+                except Exception:
+                    logger.exception("Pre-warming %s failed", subject.syllabus_path)
+                    self._finish(subject.name, FAILED)
+
+    def _warm_here(self, subject, source="this process"):
+        try:
+            self._load(subject, warm_syllabus(subject.syllabus_path), source)
+        except Exception:
+            logger.exception("Pre-warming %s failed", subject.syllabus_path)
+            self._finish(subject.name, FAILED)
+
+    def _load(self, subject, timing, source):
+        """Loads a warmed syllabus and its index from disk into this process's memory."""
+        timing["source"] = source
+        started = time.perf_counter()
+        syllabus_cache.get_syllabus(subject.syllabus_path)
+        retrieval.get_index(subject.syllabus_path)
+        timing["load_seconds"] = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self._timings[subject.syllabus_path] = timing
+        logger.info("Warmed %s: %s", subject.syllabus_path, timing)
+        self._finish(subject.name, READY)
+
+    def _set_status(self, name, status):
+        with self._lock:
+            self._status[name] = status
+
+    def _finish(self, name, status):
+        self._set_status(name, status)
+        event = self._events.get(name)
+        if event is not None:
+            event.set()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--file":
+        # Worker mode: warm one PDF and report its timings as the last line of output
+        print(json.dumps(warm_syllabus(sys.argv[2])))
+        sys.exit(0)
+
+    from mindspring import subjects
+
+    registry = subjects.SubjectRegistry()
+    registry.scan()
+    prewarmer = Prewarmer(registry)
+    prewarmer.start()
+    prewarmer._thread.join()
+    for path, timing in sorted(prewarmer.timings().items()):
+        print(f"{path}: {timing}")
+    print(f"Total: {prewarmer.total_seconds}s with {prewarmer.workers} workers")
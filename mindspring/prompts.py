@@ -0,0 +1,171 @@
+"""Tutor system prompts laid out for provider-side prompt caching.
+
+OpenAI caches the longest previously seen prompt prefix (from 1024 tokens, in
+128-token steps), so the parts of a request that are shared should come first and be
+byte-identical every time. Tutor prompts are therefore built as:
+
+    1. the subject prefix: fixed tutoring guidelines plus the subject's con_*.txt
+       context, identical for every student of that subject (memoized per subject).
+       The guidelines alone are long enough that the prefix passes the 1024-token
+       minimum, so it is cacheable across students.
+    2. the student's parameters: grade level and learning preferences, stably ordered
+    3. the conversation. It only grows between turns until the context window folds
+       older turns into its summary, which changes everything after the system prompt;
+       context_budget folds in coarse steps so that happens every few turns, not on
+       every turn once the budget is reached.
+
+The syllabus excerpts retrieved for a question change on every turn, so they are sent
+in a separate message just before the question (see app.build_tutor_messages) rather
+than inside the system prompt. record_usage() collects the cached_tokens reported in
+responses, so the cache hit rate and its latency effect can be measured.
+"""
+import functools
+import logging
+import threading
+
+from mindspring import context_budget
+
+logger = logging.getLogger(__name__)
+
+# OpenAI only caches prompts of at least this many tokens
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+
+# Fixed for every subject and student, so it always starts the cached prefix
+_TUTORING_GUIDELINES = """Tutoring guidelines:
+
+Scope
+- Teach to the CSEC syllabus of the Caribbean Examinations Council for the selected subject. Syllabus excerpts relevant to each question are sent with it; treat them as the authority on what the student is expected to know, and on the depth and terminology examiners use.
+- If a question is outside the syllabus, say so briefly, give a short general answer if it is harmless, and steer back to a related syllabus topic.
+- Never invent syllabus objectives, past-paper questions, mark schemes or statistics. If you are unsure whether something is examined, say so.
+
+Explaining
+- Start from what the student already said they know. Explain one idea at a time, in short paragraphs, and define each technical term the first time you use it.
+- Prefer concrete Caribbean examples (local crops, industries, ecosystems, businesses and everyday situations) when they illustrate the point as well as any other.
+- For processes and cycles, list the stages in order. For comparisons, use a short table or paired bullet points. For calculations, show every step with units, then state the answer clearly.
+- Keep replies focused: usually under 250 words unless the student asks for more detail or a worked example needs the space.
+
+Checking understanding
+- End most explanations with one short question that lets the student check their understanding, or an invitation to try a similar example.
+- When the student answers, say what is correct first, then correct any mistake specifically and explain why it is a mistake. Do not simply give the answer to an exercise the student is working on; give a hint or the next step, and give the full solution only when they ask for it or have tried.
+- If the student seems confused, try a different explanation or analogy rather than repeating the same one.
+
+Exam skills
+- When useful, point out the command word of a question (define, describe, explain, discuss, evaluate, calculate) and what an answer to it needs in order to earn full marks.
+- Mention common mistakes examiners report, such as missing units, confusing similar terms, or describing when asked to explain.
+- For School-Based Assessment (SBA) work, guide the student's planning and method, but never write the SBA for them.
+
+Practice and revision
+- When the student asks to practise, set one question at a time in the style of a CSEC paper, with the marks it would carry, and wait for their answer before marking it.
+- Mark answers against what a mark scheme would reward: name each point that earns a mark and each that is missing.
+- For revision, summarise a topic as a short list of the key facts, definitions and diagrams the student should be able to reproduce, then offer a quick question on it.
+- Suggest a labelled diagram when one is the clearest way to answer, and describe what it should show, since the student can ask for a visual explanation.
+- Connect topics when it helps: point out where an idea was met earlier in the syllabus or will be needed later.
+
+Earlier conversation
+- Older turns of a long session may be replaced by a short summary of the earlier conversation. Use it to stay consistent with what was already explained, but do not repeat it back to the student.
+- If the student refers to something that is no longer in the conversation or its summary, ask them briefly to remind you rather than guessing.
+
+Tone and safety
+- Be warm, encouraging and patient. Praise effort and progress specifically, never sarcastically.
+- Write in clear standard English suited to a secondary school student. Avoid slang and unexplained jargon.
+- Do not ask for or repeat personal information. If the student mentions being unsafe, unwell or distressed, respond kindly and encourage them to speak to a trusted adult, teacher or school counsellor.
+- Do not help with cheating on tests or examinations, and do not complete graded assignments on the student's behalf.
+
+Formatting
+- Use Markdown: short headings only for long answers, bullet points for lists, and bold for key terms. Write formulas in plain text (for example, speed = distance / time) so they read well when spoken aloud.
+- The reply may be read aloud to the student, so avoid long tables of numbers and spell out symbols when their meaning is not obvious."""
+
+_SUBJECT_PREFIX_TEMPLATE = """You are an AI tutor specializing in {subject}.
+Your responses should be tailored to the student's preferences and selected subject.
+Be helpful, patient, and provide clear explanations. Ensure your answers are strictly within the scope of the provided syllabus excerpts and context.
+
+{guidelines}
+
+---
+Additional Context for {subject}:
+{context}
+---"""
+
+_STUDENT_TEMPLATE = """Student's Grade Level: {grade}"""
+
+
+@functools.lru_cache(maxsize=64)
+def subject_prefix(subject, context):
+    """Returns the byte-stable, student-independent start of the system prompt for a subject."""
+    # Normalized line endings and trailing whitespace so edits to the file's formatting don't matter
+    context = "\n".join(line.rstrip() for line in context.strip().splitlines())
+    prefix = _SUBJECT_PREFIX_TEMPLATE.format(subject=subject, guidelines=_TUTORING_GUIDELINES, context=context)
+    if context_budget.count_text_tokens(prefix) < MIN_CACHEABLE_PREFIX_TOKENS:
+        logger.warning("System prompt prefix for %s is shorter than OpenAI's minimum for prompt caching", subject)
+    return prefix
+
+
+def student_parameters(grade_level, learning_preferences):
+    """Returns the per-student part of the system prompt, with preferences in a stable order."""
+    text = _STUDENT_TEMPLATE.format(grade=grade_level)
+    preferences = learning_preferences or {}
+    if preferences:
+        text += "\nStudent's Learning Preferences: " + ", ".join(
+            f"{key}: {preferences[key]}" for key in sorted(preferences)
+        )
+    return text
+
+
+def build_system_prompt(subject, context, grade_level, learning_preferences):
+    """Returns the full tutor system prompt: subject prefix first, then the student's parameters."""
+    return subject_prefix(subject, context) + "\n\n" + student_parameters(grade_level, learning_preferences)
+
+
+class PromptCacheStats:
+    """Thread-safe totals of prompt and cached tokens, with latency split by cache hits."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._latency = {True: [0, 0.0], False: [0, 0.0]} # hit? -> [requests, total seconds]
+
+    def record(self, prompt_tokens, cached_tokens, seconds):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            bucket = self._latency[cached_tokens > 0]
+            bucket[0] += 1
+            bucket[1] += seconds
+
+    def snapshot(self):
+        """Returns request and token totals, the cached share and average latency with/without a hit."""
+        with self._lock:
+            def average(hit):
+                count, total = self._latency[hit]
+                return total / count if count else None
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "avg_seconds_cached": average(True),
+                "avg_seconds_uncached": average(False),
+            }
+
+
+_stats = PromptCacheStats()
+
+
+def record_usage(usage, seconds):
+    """Records the usage block of a chat completion; seconds is time to the first token."""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    _stats.record(prompt_tokens, cached, seconds)
+    logger.info("Chat completion: %d prompt tokens, %d cached, %.2fs to first token", prompt_tokens, cached, seconds)
+    return cached
+
+
+def prompt_cache_stats():
+    """Returns a snapshot of the prompt caching counters for this process."""
+    return _stats.snapshot()
@@ -0,0 +1,173 @@
+"""Process-wide cache of tutor replies to repeated questions.
+
+Replies are keyed on a scope (subject, grade level and a hash of the learning
+preferences) plus the normalized question. Lookups try an exact match first and then
+a MinHash similarity match over the question's stemmed terms within the same scope,
+so "What is osmosis?" and "what's osmosis??" or "Explain photosynthesis in plants" and
+"Explain photosynthesis in green plants" share an answer. Entries expire after a TTL,
+and the least recently used ones are evicted beyond a size cap.
+
+Only standalone questions are cached: follow-ups such as "explain that again" depend
+on the conversation and always go to the model.
+"""
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from mindspring import retrieval
+
+# Entries older than this are treated as misses and dropped
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("MINDSPRING_RESPONSE_CACHE_TTL", str(24 * 3600)))
+# Maximum number of cached replies across all subjects (least recently used are evicted)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("MINDSPRING_RESPONSE_CACHE_SIZE", "2000"))
+# Estimated Jaccard similarity of question terms needed for a near-duplicate hit
+SIMILARITY_THRESHOLD = 0.75
+# Questions with fewer index terms than this only get exact matches
+MIN_SIMILAR_TERMS = 2
+
+_NUM_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601) # Fixed seed: signatures must be stable across processes
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(_NUM_PERMUTATIONS)]
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+# Words that make a question refer back to earlier turns
+_FOLLOW_UP_WORDS = frozenset("""
+it its that this those these them they he she his her again above previous earlier last
+more further continue elaborate simpler example another same
+""".split())
+
+
+def normalize_question(question):
+    """Lowercases a question and strips punctuation and extra whitespace."""
+    return " ".join(_PUNCTUATION_RE.sub(" ", question.lower().replace("'s", " is")).split())
+
+
+def is_standalone(question):
+    """Returns True if the question can be answered without the earlier conversation."""
+    words = normalize_question(question).split()
+    return bool(retrieval.tokenize(question)) and not _FOLLOW_UP_WORDS.intersection(words)
+
+
+def minhash_signature(terms):
+    """Returns the MinHash signature of a set of terms."""
+    hashes = [int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "big") for term in terms]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def estimated_similarity(signature, other):
+    """Estimates the Jaccard similarity of the term sets behind two signatures."""
+    return sum(x == y for x, y in zip(signature, other)) / _NUM_PERMUTATIONS
+
+
+class _Entry:
+    __slots__ = ("scope", "question", "response", "signature", "created_at")
+
+    def __init__(self, scope, question, response, signature, created_at):
+        self.scope = scope
+        self.question = question
+        self.response = response
+        self.signature = signature
+        self.created_at = created_at
+
+
+class ResponseCache:
+    """Thread-safe TTL + LRU cache of tutor replies with exact and near-duplicate lookup."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL_SECONDS,
+                 threshold=SIMILARITY_THRESHOLD, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # (scope, normalized question) -> _Entry, least recently used first
+        self._by_scope = {} # scope -> set of keys, for the similarity tier
+        self.metrics = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    def lookup(self, scope, question):
+        """Returns the cached reply for a question in scope, or None."""
+        if not is_standalone(question):
+            return None
+        key = (scope, normalize_question(question))
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is not None:
+                self.metrics["exact_hits"] += 1
+                return entry.response
+            entry = self._similar_entry(scope, question)
+            if entry is not None:
+                self.metrics["similar_hits"] += 1
+                return entry.response
+            self.metrics["misses"] += 1
+            return None
+
+    def store(self, scope, question, response):
+        """Caches a reply to a standalone question."""
+        if not response or not is_standalone(question):
+            return
+        key = (scope, normalize_question(question))
+        terms = set(retrieval.tokenize(question))
+        signature = minhash_signature(terms) if len(terms) >= MIN_SIMILAR_TERMS else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = _Entry(scope, key[1], response, signature, self._clock())
+            self._by_scope.setdefault(scope, set()).add(key)
+            self.metrics["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.metrics["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_scope.clear()
+
+    def stats(self):
+        """Returns the hit/miss counters plus the current size and hit rate."""
+        with self._lock:
+            stats = dict(self.metrics, size=len(self._entries))
+        lookups = stats["exact_hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    # --- Internals (called with the lock held) ---
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._clock() - entry.created_at > self.ttl:
+            self._remove(key)
+            self.metrics["expired"] += 1
+            return None
+        self._entries.move_to_end(key) # Most recently used
+        return entry
+
+    def _similar_entry(self, scope, question):
+        terms = set(retrieval.tokenize(question))
+        if len(terms) < MIN_SIMILAR_TERMS:
+            return None
+        signature = minhash_signature(terms)
+        best_key, best_score = None, self.threshold
+        # Scopes hold at most a few hundred entries, so a linear scan of signatures is cheap
+        for key in self._by_scope.get(scope, ()):
+            entry = self._entries[key]
+            if entry.signature is None:
+                continue
+            score = estimated_similarity(signature, entry.signature)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return self._live_entry(best_key) if best_key is not None else None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_scope.get(entry.scope)
+            keys.discard(key)
+            if not keys:
+                del self._by_scope[entry.scope]
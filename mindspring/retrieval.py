@@ -0,0 +1,235 @@
+"""Section-aware syllabus chunking and a local BM25 index for prompt retrieval.
+
+Instead of pasting a whole syllabus into the system prompt, each syl_*.pdf is split
+into chunks that follow its SECTION headings and numbered objectives. The chunks are
+indexed with BM25 and stored next to the extracted text in the syllabus cache, so for
+every question only the top-k matching chunks are sent to the model. Everything runs
+offline; nothing here talks to OpenAI.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from mindspring import syllabus_cache
+
+# Bump when chunking or tokenization changes so stored indexes are rebuilt
+INDEX_VERSION = 3
+
+# Target and hard-maximum chunk sizes in characters (roughly 300 / 500 tokens)
+CHUNK_TARGET_CHARS = 1200
+CHUNK_MAX_CHARS = 2000
+
+# Standard BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Headings that open a new syllabus section, e.g. "SECTION B - LIFE PROCESSES AND DISEASE (cont'd)"
+_SECTION_RE = re.compile(r"^\s*((?:SECTION|MODULE|UNIT|PROFILE|APPENDIX|PAPER)\b[^\n]{0,100}?)\s*(?:\(cont[’']?d\))?\s*$")
+# Numbered topics and objectives, e.g. "2.  Nutrition" or "1.6 explain the processes"
+_TOPIC_RE = re.compile(r"^\s*(\d{1,2}\.)\s+[A-Z]")
+_OBJECTIVE_RE = re.compile(r"^\s*\d{1,2}\.\d{1,2}\s+\S")
+# Running page headers such as "CXC 20/G/SYLL 13 21 www.cxc.org"
+_PAGE_HEADER_RE = re.compile(r"^\s*CXC\b.*www\.cxc\.org\s*$", re.IGNORECASE)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from
+further had has have having he her here hers him his how i if in into is it its itself
+just me more most my no nor not now of off on once only or other our out over own same
+she should so some such than that the their them then there these they this those
+through to too under until up very was we were what when where which while who whom
+why will with would you your
+""".split())
+
+# Loaded indexes keyed by PDF path, each tagged with the syllabus hash it was built from
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text):
+    """Lowercases and splits text into index terms, dropping stopwords and applying light stemming."""
+    return [_stem(tok) for tok in _TOKEN_RE.findall(text.lower()) if tok not in _STOPWORDS]
+
+
+def chunk_syllabus(text):
+    """Splits extracted syllabus text into section-aware chunks.
+
+    Returns a list of {"section": str, "text": str}. A chunk never spans two sections,
+    and within a section chunks break at numbered topics/objectives once they reach
+    CHUNK_TARGET_CHARS.
+    """
+    chunker = SyllabusChunker()
+    chunker.feed(text)
+    return chunker.finish()
+
+
+class SyllabusChunker:
+    """Incremental chunk_syllabus: feed page texts in order as they are extracted, then finish()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.pages = 0
+        self._section = "Introduction"
+        self._buffer = []
+        self._buffer_len = 0
+
+    def feed(self, text):
+        self.pages += 1
+        for line in text.split("\n"):
+            if not line.strip() or _PAGE_HEADER_RE.match(line):
+                continue
+            section_match = _SECTION_RE.match(line)
+            if section_match:
+                heading = " ".join(section_match.group(1).split())
+                # Repeated "(cont'd)" headings continue the current section
+                if heading != self._section:
+                    self._flush()
+                    self._section = heading
+                continue
+            starts_item = _TOPIC_RE.match(line) or _OBJECTIVE_RE.match(line)
+            if self._buffer_len >= CHUNK_MAX_CHARS or (starts_item and self._buffer_len >= CHUNK_TARGET_CHARS):
+                self._flush()
+            self._buffer.append(line)
+            self._buffer_len += len(line) + 1
+
+    def finish(self):
+        """Returns the chunks, including the one still being filled."""
+        self._flush()
+        return self.chunks
+
+    def _flush(self):
+        body = " ".join(" ".join(self._buffer).split())
+        if body:
+            self.chunks.append({"section": self._section, "text": body})
+        self._buffer = []
+        self._buffer_len = 0
+
+
+class BM25Index:
+    """BM25 index over syllabus chunks that can be saved to and loaded from JSON."""
+
+    def __init__(self, chunks, doc_lengths, postings, source_sha256=None):
+        self.chunks = chunks
+        self.doc_lengths = doc_lengths
+        self.postings = postings # term -> [[chunk_index, term_frequency], ...]
+        self.source_sha256 = source_sha256
+        self.avg_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+    @classmethod
+    def build(cls, chunks, source_sha256=None):
+        """Builds an index for a list of chunks as returned by chunk_syllabus."""
+        doc_lengths = []
+        postings = {}
+        for chunk_id, chunk in enumerate(chunks):
+            terms = tokenize(f"{chunk['section']} {chunk['text']}")
+            doc_lengths.append(len(terms))
+            for term, freq in Counter(terms).items():
+                postings.setdefault(term, []).append([chunk_id, freq])
+        return cls(chunks, doc_lengths, postings, source_sha256)
+
+    def search(self, query, k=4):
+        """Returns up to k (score, chunk) pairs for a query, best first."""
+        if not self.chunks:
+            return []
+        scores = {}
+        total_docs = len(self.chunks)
+        for term in set(tokenize(query)):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            doc_freq = len(term_postings)
+            idf = math.log(1 + (total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+            for chunk_id, freq in term_postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[chunk_id] / self.avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (BM25_K1 + 1) / (freq + norm)
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(score, self.chunks[chunk_id]) for chunk_id, score in best]
+
+    def to_json(self):
+        return json.dumps({
+            "version": INDEX_VERSION,
+            "source_sha256": self.source_sha256,
+            "chunks": self.chunks,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        })
+
+    @classmethod
+    def from_json(cls, data):
+        payload = json.loads(data)
+        if payload.get("version") != INDEX_VERSION:
+            raise ValueError("Stale index version")
+        return cls(payload["chunks"], payload["doc_lengths"], payload["postings"], payload.get("source_sha256"))
+
+
+def get_index(pdf_path):
+    """Returns the BM25 index for a syllabus PDF, building and storing it on disk if needed.
+
+    If the PDF hasn't been extracted yet, its pages are chunked while extraction runs.
+    """
+    chunker = SyllabusChunker()
+    syllabus = syllabus_cache.get_syllabus(pdf_path, on_page=chunker.feed)
+    source_sha256 = syllabus.meta["sha256"]
+    key = os.path.abspath(pdf_path)
+
+    index = _indexes.get(key)
+    if index is not None and index.source_sha256 == source_sha256:
+        return index
+
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None or index.source_sha256 != source_sha256:
+            index = _load_or_build(syllabus, chunker if chunker.pages else None)
+            _indexes[key] = index
+    return index
+
+
+def retrieve(pdf_path, query, k=4):
+    """Returns the text of the top-k syllabus chunks for a question."""
+    return [chunk for _, chunk in get_index(pdf_path).search(query, k)]
+
+
+def format_excerpts(chunks):
+    """Formats retrieved chunks for inclusion in a prompt."""
+    return "\n\n".join(f"[{chunk['section']}]\n{chunk['text']}" for chunk in chunks)
+
+
+def _index_path(source_path):
+    key = hashlib.sha1(source_path.encode("utf-8")).hexdigest()
+    return os.path.join(syllabus_cache.CACHE_DIR, f"{key}.bm25.json")
+
+
+def _load_or_build(syllabus, chunker=None):
+    """Loads the stored index for a syllabus if it matches the current text, else rebuilds it.
+
+    chunker, if given, has already been fed the syllabus pages during extraction.
+    """
+    index_path = _index_path(syllabus.source_path)
+    source_sha256 = syllabus.meta["sha256"]
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = BM25Index.from_json(f.read())
+        if index.source_sha256 == source_sha256:
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    chunks = chunker.finish() if chunker is not None else chunk_syllabus(syllabus.text)
+    index = BM25Index.build(chunks, source_sha256)
+    syllabus_cache.write_atomic(index_path, index.to_json().encode("utf-8"))
+    return index
+
+
+def _stem(token):
+    """Very light suffix stripping so 'cells'/'cell' and 'processes'/'process' match."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith("sses"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
@@ -0,0 +1,36 @@
+"""Creation of the Firestore client, once per process.
+
+app.py used to check for and initialize the Firebase app at the top of every script
+run; firestore_client() is called through st.cache_resource instead. The login page
+needs Firestore (and bcrypt) in any case, but nothing else: the other backends import
+their library on first use -- clients.build_openai_client() (openai, about half a
+second), clients.build_http_session() (requests), speech.synthesize() (gTTS),
+pdf_extract (pypdf) and image_store thumbnails (PIL) -- and app.py creates each of
+them in its own st.cache_resource getter.
+"""
+import base64
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def firestore_client():
+    """Initializes Firebase from FIREBASE_SERVICE_ACCOUNT_KEY_B64 if needed and returns the Firestore client.
+
+    Returns None if no service account key is configured; raises if the key is invalid.
+    """
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    # Another module (or a test) may already have initialized the default app
+    if not firebase_admin._apps:
+        # The Base64 encoded service account key, kept out of the repository
+        key_b64 = os.environ.get("FIREBASE_SERVICE_ACCOUNT_KEY_B64")
+        if not key_b64:
+            return None
+        cred = credentials.Certificate(json.loads(base64.b64decode(key_b64).decode("utf-8")))
+        firebase_admin.initialize_app(cred)
+        logger.info("Firebase initialized")
+    return firestore.client()
@@ -0,0 +1,217 @@
+"""Text-to-speech for tutor replies: disk cache, background synthesis and chunking.
+
+A reply is split into its first sentence plus groups of following sentences. Each chunk
+is synthesized with gTTS on a shared thread pool and stored on disk under a hash of its
+text, so the page can show the reply straight away, offer the first sentence's audio
+as soon as that chunk is ready, and attach the rest when it arrives. Repeated replies
+(for example ones served from the response cache) reuse the stored MP3s, and
+concurrent requests for the same chunk share one synthesis.
+"""
+import concurrent.futures
+import contextvars
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+
+from mindspring import tracing
+from mindspring.syllabus_cache import write_atomic
+
+logger = logging.getLogger(__name__)
+
+AUDIO_CACHE_DIR = os.environ.get("MINDSPRING_AUDIO_CACHE_DIR", os.path.join(".cache", "tts"))
+# Total size of cached MP3s; the least recently used files are deleted beyond this
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("MINDSPRING_AUDIO_CACHE_MAX_MB", "200")) * 1024 * 1024
+# Concurrent gTTS requests across all sessions
+SYNTHESIS_WORKERS = int(os.environ.get("MINDSPRING_TTS_WORKERS", "4"))
+# Target size of the chunks after the first sentence
+CHUNK_TARGET_CHARS = 300
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_into_chunks(text, target_chars=CHUNK_TARGET_CHARS):
+    """Splits text into the first sentence followed by groups of whole sentences."""
+    sentences = [s.strip() for s in _SENTENCE_END_RE.split(text.strip()) if s.strip()]
+    if not sentences:
+        return []
+    chunks = [sentences[0]] # Kept short so its audio is ready first
+    current = ""
+    for sentence in sentences[1:]:
+        if current and len(current) + len(sentence) + 1 > target_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def first_sentence(text):
+    """Returns the first sentence of a reply that is still arriving, once it is complete, else None.
+
+    It is complete when the next sentence has started, and it is then the same as the
+    first chunk split_into_chunks() makes of the full reply.
+    """
+    parts = _SENTENCE_END_RE.split(text.strip(), maxsplit=1)
+    return parts[0].strip() if len(parts) > 1 and parts[0].strip() else None
+
+
+def synthesize(text, lang="en"):
+    """Returns MP3 bytes for text from gTTS (a network call)."""
+    from gtts import gTTS # Imported on the first reply read aloud, not at startup
+    fp = io.BytesIO()
+    gTTS(text=text, lang=lang, slow=False).write_to_fp(fp)
+    return fp.getvalue()
+
+
+class AudioCache:
+    """Size-bounded directory of MP3 files keyed by a hash of their text."""
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None # Computed on first write
+
+    @staticmethod
+    def key(text, lang="en"):
+        return hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, key):
+        """Returns the cached MP3 bytes, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path) # Marks the file as recently used for eviction
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        write_atomic(self._path(key), data)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan()[1]
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".mp3"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries, sum(size for _, size, _ in entries)
+
+    def _evict(self):
+        # Rescan so files written by other processes are counted too
+        entries, self._total_bytes = self._scan()
+        for _, size, path in sorted(entries):
+            if self._total_bytes <= self.max_bytes * 0.9: # Leave headroom so eviction isn't run on every write
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass
+
+
+class SpeechJob:
+    """Audio for one reply, synthesized chunk by chunk in the background."""
+
+    def __init__(self, futures):
+        self._futures = futures
+
+    def done(self):
+        return all(future.done() for future in self._futures)
+
+    def failed(self):
+        return any(future.done() and future.exception() is not None for future in self._futures)
+
+    def first_chunk(self):
+        """Returns the first sentence's MP3 bytes once ready, else None."""
+        if self._futures and self._futures[0].done() and self._futures[0].exception() is None:
+            return self._futures[0].result()
+        return None
+
+    def remainder(self):
+        """Returns the MP3 bytes of everything after the first sentence once all of it is ready.
+
+        Returns b"" for one-sentence replies and None while chunks are pending or failed.
+        """
+        rest = self._futures[1:]
+        if not all(future.done() and future.exception() is None for future in rest):
+            return None
+        return b"".join(future.result() for future in rest) # MP3 frames can be concatenated
+
+
+class SpeechSynthesizer:
+    """Shared pool that turns reply text into cached, chunked audio."""
+
+    def __init__(self, cache=None, max_workers=SYNTHESIS_WORKERS, lang="en"):
+        self.cache = cache or AudioCache()
+        self.lang = lang
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self._lock = threading.RLock() # Done callbacks may run inline while it is held
+        self._in_flight = {} # cache key -> future, so identical chunks are synthesized once
+
+    def submit(self, text):
+        """Starts synthesizing text and returns a SpeechJob immediately."""
+        return SpeechJob([self._submit_chunk(chunk) for chunk in split_into_chunks(text)])
+
+    def prefetch(self, chunk):
+        """Starts synthesizing one chunk ahead of submit(), which then shares its result."""
+        self._submit_chunk(chunk)
+
+    def _submit_chunk(self, chunk):
+        key = self.cache.key(chunk, self.lang)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                # In a copy of the caller's context, so the synthesis span keeps the user and subject tags
+                context = contextvars.copy_context()
+                future = self._executor.submit(context.run, self._load_or_synthesize, key, chunk)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda _, key=key: self._forget(key))
+            return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _load_or_synthesize(self, key, chunk):
+        data = self.cache.get(key)
+        if data is None:
+            try:
+                with tracing.span("tts.synthesize", chars=len(chunk)):
+                    data = synthesize(chunk, self.lang)
+            except Exception:
+                logger.exception("Speech synthesis failed for a %d-character chunk", len(chunk))
+                raise
+            self.cache.put(key, data)
+        return data
+
+
+class StreamingSpeech:
+    """Starts the speech for a streamed reply's first sentence while the rest is still arriving."""
+
+    def __init__(self, synthesizer):
+        self.synthesizer = synthesizer
+        self.started = False
+
+    def feed(self, text):
+        """Called with the reply so far."""
+        if not self.started:
+            sentence = first_sentence(text)
+            if sentence is not None:
+                self.synthesizer.prefetch(sentence)
+                self.started = True
@@ -0,0 +1,186 @@
+"""Registry of the subjects available in subject_context/.
+
+Each subject is defined by its files in the directory:
+
+    con_<Subject>.txt    tutor context for the subject (required)
+    syl_<Subject>.pdf    syllabus (optional; without it the tutor works from the context alone)
+
+The directory is scanned once per process and validated (missing or empty files, PDFs
+that aren't PDFs, syllabi without context), recording each file's size, mtime and
+SHA-256. Pages read the subject list
+and paths from this in-memory snapshot, so a request never probes the filesystem or
+fails half-way because a file is missing. A background thread rescans when files are
+added, removed or changed, reusing the hashes of unchanged files.
+"""
+import logging
+import os
+import threading
+
+from mindspring import syllabus_cache
+
+logger = logging.getLogger(__name__)
+
+SUBJECT_DIR = os.environ.get("MINDSPRING_SUBJECT_DIR", "subject_context")
+# How often the watcher checks the directory for changes
+RESCAN_INTERVAL_SECONDS = float(os.environ.get("MINDSPRING_SUBJECT_RESCAN_SECONDS", "5"))
+
+_SYLLABUS_PREFIX, _SYLLABUS_SUFFIX = "syl_", ".pdf"
+_CONTEXT_PREFIX, _CONTEXT_SUFFIX = "con_", ".txt"
+
+
+class SubjectFile:
+    """A file in the subject directory, as seen by the last scan."""
+
+    __slots__ = ("path", "size", "mtime_ns", "sha256")
+
+    def __init__(self, path, size, mtime_ns, sha256):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+
+
+class Subject:
+    """One subject: its files, its context text and any problems found while validating it."""
+
+    def __init__(self, name, syllabus=None, context=None, context_text="", problems=()):
+        self.name = name
+        self.syllabus = syllabus # SubjectFile or None
+        self.context = context # SubjectFile or None
+        self.context_text = context_text
+        self.problems = list(problems)
+
+    @property
+    def available(self):
+        """True if students can study the subject (it has readable context)."""
+        return self.context is not None and bool(self.context_text.strip())
+
+    @property
+    def syllabus_path(self):
+        return self.syllabus.path if self.syllabus else None
+
+
+class SubjectRegistry:
+    """Snapshot of the subject directory, rebuilt when its files change."""
+
+    def __init__(self, directory=SUBJECT_DIR, rescan_interval=RESCAN_INTERVAL_SECONDS):
+        self.directory = directory
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._subjects = {}
+        self._fingerprint = None
+        self._watcher = None
+
+    # --- Queries (served from memory) ---
+
+    def get(self, name):
+        """Returns the available Subject with this name, or None."""
+        subject = self._subjects.get(name)
+        return subject if subject is not None and subject.available else None
+
+    def names(self):
+        """Returns the names of the subjects students can study, sorted."""
+        return sorted(name for name, subject in self._subjects.items() if subject.available)
+
+    def all(self):
+        """Returns every subject found, including unavailable ones."""
+        return [self._subjects[name] for name in sorted(self._subjects)]
+
+    def problems(self):
+        """Returns the validation problems of the last scan as readable strings."""
+        return [f"{subject.name}: {problem}" for subject in self.all() for problem in subject.problems]
+
+    # --- Scanning ---
+
+    def scan(self):
+        """Rescans the directory if anything changed. Returns True if the snapshot was rebuilt."""
+        with self._lock:
+            entries = self._list_files()
+            fingerprint = tuple(sorted((name, stat.st_size, stat.st_mtime_ns) for name, stat in entries.items()))
+            if fingerprint == self._fingerprint:
+                return False
+
+            previous = {}
+            for subject in self._subjects.values():
+                for subject_file in (subject.syllabus, subject.context):
+                    if subject_file is not None:
+                        previous[subject_file.path] = subject_file
+
+            grouped = {}
+            for name, stat in entries.items():
+                if name.startswith(_SYLLABUS_PREFIX) and name.lower().endswith(_SYLLABUS_SUFFIX):
+                    subject_name, kind = name[len(_SYLLABUS_PREFIX):-len(_SYLLABUS_SUFFIX)], "syllabus"
+                elif name.startswith(_CONTEXT_PREFIX) and name.lower().endswith(_CONTEXT_SUFFIX):
+                    subject_name, kind = name[len(_CONTEXT_PREFIX):-len(_CONTEXT_SUFFIX)], "context"
+                else:
+                    continue
+                grouped.setdefault(subject_name, {})[kind] = self._subject_file(name, stat, previous)
+
+            self._subjects = {name: self._validate(name, files) for name, files in grouped.items()}
+            self._fingerprint = fingerprint
+        for problem in self.problems():
+            logger.warning("Subject check: %s", problem)
+        logger.info("Indexed %d subjects in %s", len(self.names()), self.directory)
+        return True
+
+    def start_watching(self):
+        """Starts the daemon thread that rescans when the directory changes."""
+        if self._watcher is None and self.rescan_interval:
+            self._watcher = threading.Thread(target=self._watch, name="subject-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        stop = threading.Event()
+        while not stop.wait(self.rescan_interval):
+            try:
+                self.scan()
+            except Exception:
+                logger.exception("Rescanning %s failed", self.directory)
+
+    def _list_files(self):
+        entries = {}
+        try:
+            with os.scandir(self.directory) as scanned:
+                for entry in scanned:
+                    if entry.is_file():
+                        entries[entry.name] = entry.stat()
+        except FileNotFoundError:
+            logger.error("Subject directory %s does not exist", self.directory)
+        return entries
+
+    def _subject_file(self, name, stat, previous):
+        path = os.path.join(self.directory, name)
+        known = previous.get(path)
+        if known is not None and known.size == stat.st_size and known.mtime_ns == stat.st_mtime_ns:
+            return known # Unchanged: skip re-hashing
+        return SubjectFile(path, stat.st_size, stat.st_mtime_ns, syllabus_cache.content_hash(path))
+
+    def _validate(self, name, files):
+        syllabus, context = files.get("syllabus"), files.get("context")
+        problems = []
+        context_text = ""
+        if context is None:
+            problems.append("no context file (con_*.txt); the subject is not offered")
+        else:
+            try:
+                with open(context.path, "r", encoding="utf-8") as f:
+                    context_text = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                problems.append(f"context file can't be read: {e}")
+            if not context_text.strip():
+                problems.append("context file is empty; the subject is not offered")
+
+        if syllabus is None:
+            problems.append("no syllabus PDF; the tutor will use the subject context only")
+        elif not _looks_like_pdf(syllabus.path):
+            problems.append("syllabus file is not a PDF; it will be ignored")
+            syllabus = None
+        return Subject(name, syllabus, context, context_text, problems)
+
+
+def _looks_like_pdf(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(5) == b"%PDF-"
+    except OSError:
+        return False
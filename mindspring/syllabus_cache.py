@@ -0,0 +1,255 @@
+"""Persistent cache of extracted syllabus PDF text.
+
+Each PDF is extracted once into a plain UTF-8 artifact under CACHE_DIR. Entries are
+keyed by the file path, size, mtime and a SHA-256 of the content, so every Streamlit
+session and every process on the host shares one extraction, and it is only rebuilt
+when the source PDF actually changes. Extraction is page-parallel where worker
+processes can be used (see pdf_extract), and each page is cleaned up by
+normalize.PageNormalizer (running headers, page numbers, hyphenation, boilerplate) on
+its way into the artifact. Page timings,
+failed pages and the before/after character and token counts are kept in the entry's
+metadata.
+
+Warm every subject ahead of a deploy with:
+
+    python -m mindspring.syllabus_cache warm [subject_context]
+"""
+import hashlib
+import json
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from mindspring import normalize, pdf_extract
+
+# Where extracted artifacts live. Point this at shared storage to share across hosts.
+CACHE_DIR = os.environ.get("MINDSPRING_CACHE_DIR", os.path.join(".cache", "syllabus"))
+
+# Bump whenever the extraction output format changes so old artifacts are rebuilt
+ARTIFACT_VERSION = 3
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# In-process memo of CachedSyllabus objects keyed by absolute PDF path
+_memory = {}
+_memory_lock = threading.Lock()
+# One lock per PDF so concurrent sessions wait for a single extraction
+_build_locks = {}
+
+
+class CachedSyllabus:
+    """Handle to an extracted syllabus artifact; the text is loaded lazily on first access."""
+
+    def __init__(self, source_path, text_path, meta):
+        self.source_path = source_path
+        self.text_path = text_path
+        self.meta = meta
+        self._text = None
+
+    @property
+    def text(self):
+        """Returns the extracted text, memory-mapping the artifact on first access."""
+        if self._text is None:
+            self._text = _read_artifact(self.text_path)
+        return self._text
+
+    def matches(self, stat_result):
+        """True if this entry was built from a file with the given size and mtime."""
+        return (self.meta.get("size") == stat_result.st_size
+                and self.meta.get("mtime_ns") == stat_result.st_mtime_ns)
+
+
+def content_hash(file_path):
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_syllabus(file_path, on_page=None):
+    """Returns a CachedSyllabus for a PDF, extracting it only if the cache is missing or stale.
+
+    If the PDF has to be extracted, on_page(text) is called with each page's normalized
+    text in order as soon as it is available. Raises FileNotFoundError if the PDF does not
+    exist; errors opening the PDF propagate, while pages that fail are left empty.
+    """
+    source_path = os.path.abspath(file_path)
+    stat_result = os.stat(source_path)
+
+    # Fast path: this process already validated the entry and the file hasn't changed
+    cached = _memory.get(source_path)
+    if cached is not None and cached.matches(stat_result):
+        return cached
+
+    with _lock_for(source_path):
+        # Another session may have rebuilt it while we were waiting for the lock
+        cached = _memory.get(source_path)
+        if cached is not None and cached.matches(stat_result):
+            return cached
+
+        cached = _load_entry(source_path, stat_result)
+        if cached is None:
+            cached = _build_entry(source_path, stat_result, on_page)
+        _memory[source_path] = cached
+        return cached
+
+
+def cached_syllabus(file_path):
+    """Returns the CachedSyllabus for a PDF if a valid artifact exists, without extracting. Else None."""
+    source_path = os.path.abspath(file_path)
+    try:
+        stat_result = os.stat(source_path)
+    except FileNotFoundError:
+        return None
+    cached = _memory.get(source_path)
+    if cached is not None and cached.matches(stat_result):
+        return cached
+    return _load_entry(source_path, stat_result)
+
+
+def warm_all(directory="subject_context", progress=print):
+    """Extracts every syl_*.pdf in a directory into the cache. Returns {path: seconds}."""
+    timings = {}
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("syl_") and name.lower().endswith(".pdf")):
+            continue
+        path = os.path.join(directory, name)
+        started = time.perf_counter()
+        syllabus = get_syllabus(path)
+        timings[path] = time.perf_counter() - started
+        if progress:
+            failed = len(syllabus.meta.get("failed_pages") or ())
+            sizes = syllabus.meta.get("normalization") or {}
+            progress(f"{path}: {syllabus.meta.get('pages')} pages ({failed} failed) in {timings[path]:.2f}s,"
+                     f" {sizes.get('raw_chars')} -> {syllabus.meta['chars']} chars,"
+                     f" {sizes.get('raw_tokens')} -> {sizes.get('tokens')} tokens")
+    return timings
+
+
+def _lock_for(source_path):
+    with _memory_lock:
+        return _build_locks.setdefault(source_path, threading.Lock())
+
+
+def _entry_paths(source_path):
+    """Returns the (meta, text) artifact paths for a source PDF."""
+    key = hashlib.sha1(source_path.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.json"), os.path.join(CACHE_DIR, f"{key}.txt")
+
+
+def _load_entry(source_path, stat_result):
+    """Returns a valid on-disk entry for the file, or None if it must be rebuilt."""
+    meta_path, text_path = _entry_paths(source_path)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != ARTIFACT_VERSION or not os.path.exists(text_path):
+        return None
+
+    cached = CachedSyllabus(source_path, text_path, meta)
+    if cached.matches(stat_result):
+        return cached
+    if meta.get("size") != stat_result.st_size:
+        return None
+
+    # Same size but a different mtime (e.g. a fresh checkout): only rebuild if the bytes changed
+    if meta.get("sha256") != content_hash(source_path):
+        return None
+    meta["mtime_ns"] = stat_result.st_mtime_ns
+    write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+    return cached
+
+
+def _build_entry(source_path, stat_result, on_page=None):
+    """Extracts the PDF and writes its text and metadata artifacts."""
+    meta_path, text_path = _entry_paths(source_path)
+    started = time.perf_counter()
+    parts = []
+    page_seconds = []
+    failed_pages = []
+    normalizer = normalize.PageNormalizer()
+
+    def emit(pages):
+        for page_text in pages:
+            part = page_text + "\n"
+            out.write(part.encode("utf-8"))
+            parts.append(part)
+            if on_page is not None:
+                on_page(page_text)
+
+    with _AtomicWriter(text_path) as out:
+        for page in pdf_extract.iter_pages(source_path):
+            page_seconds.append(page.seconds)
+            if page.error:
+                failed_pages.append({"page": page.index + 1, "error": page.error})
+            emit(normalizer.feed(page.text))
+        emit(normalizer.finish())
+    text = "".join(parts)
+    meta = {
+        "version": ARTIFACT_VERSION,
+        "source": source_path,
+        "size": stat_result.st_size,
+        "mtime_ns": stat_result.st_mtime_ns,
+        "sha256": content_hash(source_path),
+        "chars": len(text),
+        "extract_seconds": round(time.perf_counter() - started, 3),
+        "pages": len(page_seconds),
+        "page_seconds": page_seconds,
+        "failed_pages": failed_pages,
+        "normalization": normalizer.stats.to_dict(),
+    }
+    # Text first, then metadata: a reader never sees metadata pointing at a missing artifact
+    write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+    cached = CachedSyllabus(source_path, text_path, meta)
+    cached._text = text
+    return cached
+
+
+def write_atomic(path, data):
+    """Writes bytes via a temp file and rename so other processes never read partial files."""
+    with _AtomicWriter(path) as f:
+        f.write(data)
+
+
+class _AtomicWriter:
+    """File opened for incremental writes that only appears at its path once closed without error."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+
+    def __enter__(self):
+        return self._file
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        return False
+
+
+def _read_artifact(text_path):
+    """Reads a text artifact through a memory map."""
+    with open(text_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[:].decode("utf-8")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "warm":
+        print("usage: python -m mindspring.syllabus_cache warm [directory]")
+        sys.exit(2)
+    warm_all(sys.argv[2] if len(sys.argv) > 2 else "subject_context")
@@ -0,0 +1,154 @@
+"""Server-side token accounting with Firestore transactions.
+
+Layout:
+
+    token_balances/{username}                       balance, updated_at
+    token_balances/{username}/ledger/{entry key}    delta, reason, balance_after, refund_of, created_at
+
+Every debit, refund and credit runs in a transaction that reads the balance and the
+ledger entry, then writes both. Concurrent turns from two browser tabs therefore
+can't lose updates or overdraw the balance. Entries are keyed by an idempotency key,
+so retrying a request after a timeout never charges twice, and each debit can be
+refunded at most once. Registration creates the balance document with an opening
+credit entry; for accounts from before the ledger, the first operation seeds it
+from the legacy users/{username}.tokens field.
+"""
+import random
+import time
+import uuid
+
+from firebase_admin import firestore
+from google.api_core import exceptions
+
+# Attempts per transaction run, and extra runs with jittered backoff when a hot balance
+# keeps aborting (e.g. many tabs or a load test hitting one user)
+TRANSACTION_ATTEMPTS = 5
+CONTENTION_RETRIES = 6
+CONTENTION_BACKOFF_SECONDS = 0.02
+
+
+class InsufficientTokens(Exception):
+    """Raised when a debit would take the balance below zero."""
+
+    def __init__(self, balance, amount):
+        super().__init__(f"Balance of {balance} tokens is less than the {amount} required")
+        self.balance = balance
+        self.amount = amount
+
+
+def new_request_key(kind="turn"):
+    """Returns a fresh idempotency key for one chargeable request."""
+    return f"{kind}-{uuid.uuid4().hex}"
+
+
+class TokenLedger:
+    """Token balances and audit ledger for users in a Firestore database."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _balance_ref(self, username):
+        return self.db.collection('token_balances').document(username)
+
+    def _entry_ref(self, username, key):
+        return self._balance_ref(username).collection('ledger').document(key)
+
+    def balance(self, username):
+        """Returns the user's current balance (seeded from the legacy field if needed)."""
+        snapshot = self._balance_ref(username).get()
+        if snapshot.exists:
+            return snapshot.get('balance')
+        return self._legacy_balance(username)
+
+    def open_account(self, batch, username, amount, reason="opening balance"):
+        """Adds the balance document and its opening credit entry to a batch creating a new account."""
+        batch.set(self._balance_ref(username), {'balance': amount, 'updated_at': firestore.SERVER_TIMESTAMP})
+        batch.create(self._entry_ref(username, 'opening'), {
+            'delta': amount,
+            'reason': reason,
+            'balance_after': amount,
+            'refund_of': None,
+            'created_at': firestore.SERVER_TIMESTAMP,
+        })
+
+    def debit(self, username, amount, key, reason, writes=()):
+        """Takes amount tokens from the user. Returns the new balance.
+
+        writes are (document reference, data) pairs set in the same transaction, so they
+        commit only with the charge (e.g. the student's message of a paid turn).
+        Replaying a key returns the balance recorded the first time without charging again.
+        Raises InsufficientTokens if the balance is too low.
+        """
+        return self._apply(username, -amount, key, reason, writes=writes)
+
+    def credit(self, username, amount, key, reason):
+        """Adds amount tokens to the user (e.g. a top-up). Returns the new balance."""
+        return self._apply(username, amount, key, reason)
+
+    def refund(self, username, debit_key, reason="refund"):
+        """Reverses the debit recorded under debit_key, at most once. Returns the new balance.
+
+        Returns None if no such debit exists (e.g. the debit itself never committed).
+        """
+        return self._apply(username, None, f"refund-{debit_key}", reason, refund_of=debit_key)
+
+    def refund_in_transaction(self, transaction, username, debit_key, reason="refund"):
+        """refund() as part of a transaction the caller runs, so it commits together with the caller's writes.
+
+        Call it after the caller's reads and before its writes.
+        """
+        return self._apply_in_transaction(transaction, username, None, f"refund-{debit_key}", reason,
+                                          refund_of=debit_key)
+
+    def _apply(self, username, delta, key, reason, refund_of=None, writes=()):
+        @firestore.transactional
+        def apply_in_transaction(transaction):
+            return self._apply_in_transaction(transaction, username, delta, key, reason, refund_of, writes)
+
+        for retry in range(CONTENTION_RETRIES + 1):
+            try:
+                return apply_in_transaction(self.db.transaction(max_attempts=TRANSACTION_ATTEMPTS))
+            except ValueError as e:
+                # The SDK raises ValueError (from Aborted) once its attempts are used up
+                if not isinstance(e.__cause__, exceptions.Aborted) or retry == CONTENTION_RETRIES:
+                    raise
+                time.sleep(random.uniform(0, CONTENTION_BACKOFF_SECONDS * 2 ** retry))
+
+    def _apply_in_transaction(self, transaction, username, delta, key, reason, refund_of=None, writes=()):
+        balance_ref = self._balance_ref(username)
+        entry_ref = self._entry_ref(username, key)
+        # All reads happen before any write, as transactions require
+        entry = entry_ref.get(transaction=transaction)
+        if entry.exists:
+            return entry.get('balance_after') # Already applied: idempotent replay
+        amount = delta
+        if refund_of is not None:
+            original = self._entry_ref(username, refund_of).get(transaction=transaction)
+            if not original.exists:
+                return None
+            amount = -original.get('delta')
+        snapshot = balance_ref.get(transaction=transaction)
+        balance = snapshot.get('balance') if snapshot.exists else self._legacy_balance(username, transaction)
+
+        if amount < 0 and balance + amount < 0:
+            raise InsufficientTokens(balance, -amount)
+        balance_after = balance + amount
+        transaction.set(balance_ref, {'balance': balance_after, 'updated_at': firestore.SERVER_TIMESTAMP})
+        transaction.create(entry_ref, {
+            'delta': amount,
+            'reason': reason,
+            'balance_after': balance_after,
+            'refund_of': refund_of,
+            'created_at': firestore.SERVER_TIMESTAMP,
+        })
+        for doc_ref, data in writes:
+            transaction.set(doc_ref, data)
+        return balance_after
+
+    def _legacy_balance(self, username, transaction=None):
+        user_ref = self.db.collection('users').document(username)
+        snapshot = user_ref.get(field_paths=['tokens'], transaction=transaction)
+        if snapshot.exists:
+            return (snapshot.to_dict() or {}).get('tokens', 0)
+        return 0
+
@@ -0,0 +1,200 @@
+"""Stage timings for every rerun, for finding where the time goes.
+
+Hot paths are wrapped in spans:
+
+    with tracing.span("openai.total", prompt_tokens=n):
+        ...
+    tracing.record("openai.ttft", seconds)
+
+Each span is tagged with the user and subject of the current rerun (set once per run
+with set_context()) plus any extra tags. The tags live in a context variable, which
+thread pools don't carry over by themselves: work for a session is submitted with
+contextvars.copy_context().run (see turns.TurnIO, speech and image_jobs), so spans
+on pool threads keep the tags of the run that started them. Finished spans go to:
+
+- an in-memory window of the latest SAMPLES_PER_STAGE durations per stage and
+  subject, from which summary() computes p50/p95 for the admin panel
+- MINDSPRING_TRACE_FILE, if set: one JSON object per line, with all tags
+- a Prometheus text endpoint on MINDSPRING_METRICS_PORT, if set (GET /metrics).
+  Its series are labelled by stage and subject only, since a per-user label would
+  make a new series for every student; the JSON lines keep the user.
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.environ.get("MINDSPRING_TRACE_FILE")
+METRICS_PORT = int(os.environ.get("MINDSPRING_METRICS_PORT", "0"))
+# Recent durations kept per (stage, subject) for percentiles
+SAMPLES_PER_STAGE = 2000
+
+QUANTILES = (0.5, 0.95)
+
+_context = contextvars.ContextVar("mindspring_trace_context", default={})
+
+
+def set_context(**tags):
+    """Sets the tags (user, subject) added to every span recorded in this context from now on."""
+    _context.set({key: value for key, value in tags.items() if value is not None})
+
+
+class Tracer:
+    """Collects stage durations and exports them."""
+
+    def __init__(self, trace_file=TRACE_FILE, samples=SAMPLES_PER_STAGE):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._windows = {} # (stage, subject) -> deque of recent seconds
+        self._totals = {} # (stage, subject) -> [count, total seconds] since start
+        self._file = open(trace_file, "a", encoding="utf-8", buffering=1) if trace_file else None
+
+    @contextlib.contextmanager
+    def span(self, stage, **tags):
+        """Times the block as stage. Yields the tag dict, so the block can add tags (e.g. token counts)."""
+        tags = dict(tags)
+        started = time.perf_counter()
+        try:
+            yield tags
+        except Exception as e: # Not st.rerun()/st.stop(), which end a run normally
+            tags["error"] = e.__class__.__name__
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started, **tags)
+
+    def record(self, stage, seconds, **tags):
+        """Records a duration measured by the caller."""
+        tags = {**_context.get(), **tags}
+        key = (stage, tags.get("subject"))
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = collections.deque(maxlen=self.samples)
+                self._totals[key] = [0, 0.0]
+            window.append(seconds)
+            totals = self._totals[key]
+            totals[0] += 1
+            totals[1] += seconds
+            if self._file is not None:
+                try:
+                    self._file.write(json.dumps({"ts": time.time(), "stage": stage, "seconds": round(seconds, 6),
+                                                 **tags}, default=str) + "\n")
+                except OSError:
+                    logger.exception("Writing the trace file failed; tracing to file stops")
+                    self._file = None
+
+    def subjects(self):
+        """Returns the subjects seen, for filtering the summary."""
+        with self._lock:
+            return sorted({subject for _, subject in self._windows if subject})
+
+    def summary(self, subject=None):
+        """Returns [{stage, count, p50, p95, mean}] over the recent window, all subjects or one."""
+        with self._lock:
+            merged = {}
+            for (stage, stage_subject), window in self._windows.items():
+                if subject is None or stage_subject == subject:
+                    merged.setdefault(stage, []).extend(window)
+        rows = []
+        for stage in sorted(merged):
+            values = sorted(merged[stage])
+            rows.append({
+                "stage": stage,
+                "count": len(values),
+                "p50": _quantile(values, 0.5),
+                "p95": _quantile(values, 0.95),
+                "mean": sum(values) / len(values),
+            })
+        return rows
+
+    def prometheus_text(self):
+        """Returns the stage durations in the Prometheus text exposition format (as summaries)."""
+        with self._lock:
+            snapshot = [(key, sorted(window), list(self._totals[key])) for key, window in self._windows.items()]
+        lines = [
+            "# HELP mindspring_stage_seconds Time spent in each stage of a rerun.",
+            "# TYPE mindspring_stage_seconds summary",
+        ]
+        for (stage, subject), values, (count, total) in sorted(snapshot, key=lambda item: (item[0][0], item[0][1] or "")):
+            labels = f'stage="{_escape(stage)}",subject="{_escape(subject or "")}"'
+            for quantile in QUANTILES:
+                lines.append(f'mindspring_stage_seconds{{{labels},quantile="{quantile}"}} {_quantile(values, quantile):.6f}')
+            lines.append(f"mindspring_stage_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"mindspring_stage_seconds_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, port, host="0.0.0.0"):
+        """Serves prometheus_text() at http://host:port/metrics on a daemon thread. Returns the server."""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Scrapes are not worth a log line each
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info("Serving metrics on port %d", server.server_address[1])
+        return server
+
+
+def _quantile(sorted_values, quantile):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(quantile * len(sorted_values)))]
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_tracer = Tracer()
+_server = None
+_server_lock = threading.Lock()
+
+
+def span(stage, **tags):
+    return _tracer.span(stage, **tags)
+
+
+def record(stage, seconds, **tags):
+    _tracer.record(stage, seconds, **tags)
+
+
+def summary(subject=None):
+    return _tracer.summary(subject)
+
+
+def subjects():
+    return _tracer.subjects()
+
+
+def prometheus_text():
+    return _tracer.prometheus_text()
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Starts the /metrics endpoint once per process, if a port is configured."""
+    global _server
+    with _server_lock:
+        if _server is None and port:
+            _server = _tracer.serve_metrics(port)
+    return _server
@@ -0,0 +1,59 @@
+"""Overlapped I/O for a tutor turn.
+
+A turn used to run strictly in order: debit the token (a Firestore transaction of
+several round trips), queue the student's message, build the prompt, stream the
+OpenAI reply, queue the reply, start its speech, and write both messages when the
+run ended. Only the OpenAI request depends on the prompt, and only the speech
+depends on the reply, so the turn now runs:
+
+    script thread:  build prompt -> stream OpenAI reply -> settle charge -> write reply
+    TurnIO pool:    debit token and store the student's message (one transaction)
+    speech pool:                     first sentence ... rest of the reply
+
+A turn therefore makes two commits: the debit transaction, which also writes the
+student's message, and the end-of-run UnitOfWork batch with the reply.
+
+The charge is settled (its future awaited) once the reply has arrived, so the turn
+takes about as long as its longest path instead of the sum of its steps; a failed
+debit still discards the reply. Streaming stays on the script thread, which draws the
+reply as it arrives. TurnIO is one bounded pool per process, shared by every session,
+and it runs each task with the caller's tracing context, so spans on its threads keep
+the student and subject tags.
+"""
+import concurrent.futures
+import contextvars
+import logging
+import os
+
+from mindspring import tracing
+
+logger = logging.getLogger(__name__)
+
+# Firestore calls of all sessions' turns running at once
+TURN_IO_WORKERS = int(os.environ.get("MINDSPRING_TURN_IO_WORKERS", "8"))
+# Longest the script waits for a turn's charge after the reply has arrived
+CHARGE_TIMEOUT_SECONDS = 30
+
+
+class TurnIO:
+    """Bounded thread pool for the Firestore work that runs beside a turn's OpenAI request."""
+
+    def __init__(self, workers=TURN_IO_WORKERS):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="turn-io")
+
+    def submit(self, function, *args, **kwargs):
+        """Runs function on the pool in a copy of the caller's context. Returns its future."""
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, function, *args, **kwargs)
+
+
+def charge_and_store(ledger, chat_store, username, session_id, message, amount, request_key, reason):
+    """Debits a turn and stores the student's message in the same transaction. Returns the new balance.
+
+    Raises token_ledger.InsufficientTokens (and stores nothing) if the balance is too low.
+    """
+    writes = []
+    if session_id: # Otherwise there is no stored session to add it to
+        writes.append((chat_store.message_ref(username, session_id, message.id), chat_store.message_document(message)))
+    with tracing.span("firestore.token_debit", reason=reason):
+        return ledger.debit(username, amount, request_key, reason, writes=writes)
@@ -0,0 +1,120 @@
+"""Write-behind persistence of user state for one Streamlit session.
+
+Changes made during a script run (appended chat messages, profile field edits) are
+collected here and committed to Firestore as a single batch at the
+end of the run, instead of one blocking round trip per change. A timer flushes
+anything left over, and failed commits keep their changes queued for the next flush,
+so every change is written at least once. Message documents have fixed ids, so
+re-sending them is harmless. Token balances are not handled here: they need
+contention-safe transactions, see token_ledger.
+
+A chat turn therefore makes two commits, not one. The debit transaction (two
+reads, then a commit) also writes the student's message, and this batch writes
+the tutor's reply and any profile changes at the end of the run. The debit
+can't join this batch: it has to succeed before the reply is kept.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds after the first queued change before the background timer flushes it
+FLUSH_INTERVAL_SECONDS = 5.0
+# Firestore allows at most 500 writes per batch
+_MAX_BATCH_WRITES = 500
+
+
+class UnitOfWork:
+    """Queued Firestore changes for one user, flushed as one batch."""
+
+    def __init__(self, db, username, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.db = db
+        self.username = username
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._fields = {} # users/{username} field -> value; later values win
+        self._documents = {} # document path -> (reference, data) for appended documents
+        self._timer = None
+        self.commits = 0
+
+    # --- Queueing changes ---
+
+    def set_fields(self, fields):
+        """Queues field-level updates to the user document."""
+        with self._lock:
+            self._fields.update(fields)
+            self._schedule()
+
+    def put_document(self, doc_ref, data):
+        """Queues a write of a whole document, such as an appended chat message."""
+        with self._lock:
+            self._documents[doc_ref.path] = (doc_ref, data)
+            self._schedule()
+
+    def has_field_changes(self):
+        """True if user document fields are queued (so cached profiles go stale on flush)."""
+        with self._lock:
+            return bool(self._fields)
+
+    def has_pending(self):
+        with self._lock:
+            return bool(self._fields or self._documents)
+
+    # --- Flushing ---
+
+    def flush(self):
+        """Commits all queued changes. Returns the number of writes sent.
+
+        Changes are only dropped from the queue once their batch commits; on error they
+        stay queued, the timer is re-armed to retry them and the exception propagates.
+        """
+        with self._lock:
+            self._cancel_timer()
+            if not self.has_pending():
+                return 0
+
+            writes = []
+            if self._fields:
+                writes.append((self.db.collection('users').document(self.username), dict(self._fields), True))
+            writes.extend((doc_ref, data, False) for doc_ref, data in self._documents.values())
+
+            try:
+                for start in range(0, len(writes), _MAX_BATCH_WRITES):
+                    batch = self.db.batch()
+                    for doc_ref, data, merge in writes[start:start + _MAX_BATCH_WRITES]:
+                        batch.set(doc_ref, data, merge=merge)
+                    batch.commit()
+                    self.commits += 1
+            except Exception:
+                self._schedule()
+                raise
+
+            # Only cleared once every batch has committed (the lock blocks new changes meanwhile)
+            self._fields.clear()
+            self._documents.clear()
+            return len(writes)
+
+    def close(self):
+        """Flushes outstanding changes and stops the timer (call on logout)."""
+        self.flush()
+        with self._lock:
+            self._cancel_timer()
+
+    def _schedule(self):
+        if self._timer is None and self.flush_interval:
+            self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Background flush for %s failed; retrying later", self.username)
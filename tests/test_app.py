@@ -0,0 +1,90 @@
+import os
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("firebase_admin")
+pytest.importorskip("openai")
+streamlit_testing = pytest.importorskip("streamlit.testing.v1")
+
+from mindspring import accounts, fakes, mock_server, token_ledger  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBJECT = "Biology"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = mock_server.start_in_background()
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url + "/v1")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app(server, tmp_path, monkeypatch):
+    """Runs app.py against a FakeFirestore with a logged-in student who has 10 tokens."""
+    if not os.path.exists(os.path.join(ROOT, "subject_context", f"syl_{SUBJECT}.pdf")):
+        pytest.skip(f"The {SUBJECT} syllabus is not available")
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr("mindspring.speech.AUDIO_CACHE_DIR", str(tmp_path / "tts"))
+    db = fakes.FakeFirestore()
+    profile = {"username": "student", "learning_preferences": {}, "subjects": []}
+    accounts.AccountStore(db).create("student", "unused-hash", profile, tokens=10)
+
+    import firebase_admin
+    import streamlit
+    streamlit.cache_resource.clear() # The response cache and clients are process-wide
+    with mock.patch.object(firebase_admin, "_apps", {"[DEFAULT]": None}), \
+            mock.patch("firebase_admin.firestore.client", lambda *args, **kwargs: db), \
+            mock.patch("gtts.gTTS"):
+        at = streamlit_testing.AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+        at.secrets["OPENAI_API_KEY"] = "sk-test"
+        at.run()
+        at.session_state["logged_in"] = True
+        at.session_state["username"] = "student"
+        at.session_state["user_data"] = {**profile, "tokens": 10}
+        at.session_state["current_page"] = "tutor"
+        at.run()
+        at.selectbox(key="study_subject_selector").select(SUBJECT)
+        next(button for button in at.main.button if button.label == "Start Study Session").click()
+        at.run()
+        at.db = db
+        yield at
+
+
+def ask(at, question):
+    at.text_area(key="user_input_area").input(question)
+    next(button for button in at.main.button if button.label == "Send to Tutor").click()
+    at.run()
+
+
+def tutor_messages(at):
+    """The tutor's replies, without the greeting that opens the session."""
+    return [msg.content for msg in at.session_state["chat_history"] if msg.role == "assistant"][1:]
+
+
+def test_streamed_reply_is_kept_once_and_charged_once(app, server):
+    ask(app, "What is osmosis?")
+    assert not app.exception and not app.error
+    assert tutor_messages(app) == [mock_server.MOCK_REPLY]
+    assert token_ledger.TokenLedger(app.db).balance("student") == 9
+    assert server.request_counts == {"chat": 1}
+
+
+def test_reply_cut_off_mid_stream_is_refunded_and_not_kept(app, monkeypatch):
+    def send_half_a_stream(handler, body):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        handler._send_chunk({**mock_server._chunk_base(body),
+                             "choices": [{"index": 0, "delta": {"content": "Osmosis is"}, "finish_reason": None}]})
+        handler.close_connection = True # Ends the response without the terminating chunk
+
+    monkeypatch.setattr(mock_server._Handler, "_send_chat_stream", send_half_a_stream)
+    ask(app, "What is osmosis?")
+    assert app.error # The student is told the reply failed
+    assert tutor_messages(app) == []
+    assert token_ledger.TokenLedger(app.db).balance("student") == 10
@@ -0,0 +1,65 @@
+import pytest
+
+from mindspring import chat_store, fakes
+
+
+@pytest.fixture(autouse=True)
+def empty_prompt_cache(monkeypatch):
+    monkeypatch.setattr(chat_store, "_prompt_cache", {})
+
+
+def start(db, username="student", prompt="You are a Biology tutor."):
+    store = chat_store.ChatStore(db)
+    session_id = store.start_session(username, "Biology", chat_store.preferences_hash("Form 4", {}), prompt)
+    return store, session_id
+
+
+def test_sessions_with_the_same_prompt_share_one_stored_copy():
+    db = fakes.FakeFirestore()
+    subject = "Biology"
+    # Equal but separate strings, as each session builds its own prompt
+    prompt, same_prompt = f"You are a {subject} tutor.", f"You are a {subject} tutor."
+    store, first = start(db, "ana", prompt)
+    _, second = start(db, "ben", same_prompt)
+    assert first != second
+    assert [doc.id for doc in db.collection("system_prompts").stream()] == [chat_store.prompt_id(prompt)]
+
+    # Every session's system message refers to the one cached string
+    assert chat_store.system_message(same_prompt).content is prompt
+    assert store.load_session("ben", second)[1] is prompt
+
+
+def test_stored_prompt_is_read_once_per_process(monkeypatch):
+    db = fakes.FakeFirestore()
+    store, session_id = start(db)
+    monkeypatch.setattr(chat_store, "_prompt_cache", {}) # A new process
+    reads = db.reads
+    store.load_session("student", session_id)
+    store.load_session("student", session_id)
+    assert db.reads - reads == 2 * 2 + 1 # Session and messages each time, the prompt once
+
+
+def test_messages_load_newest_page_first():
+    db = fakes.FakeFirestore()
+    store, session_id = start(db)
+    for seq in range(5):
+        store.append("student", session_id, chat_store.new_message("user" if seq % 2 else "assistant", f"m{seq}", seq))
+
+    _, prompt, messages, has_older = store.load_session("student", session_id, limit=3)
+    assert prompt == "You are a Biology tutor."
+    assert [msg.content for msg in messages] == ["m2", "m3", "m4"]
+    assert has_older
+    assert messages[0].id.startswith("00000002-")
+
+    older, has_older = store.load_older("student", session_id, before_seq=2, limit=3)
+    assert [(msg.seq, msg.role) for msg in older] == [(0, "assistant"), (1, "user")]
+    assert not has_older
+
+
+def test_messages_are_slotted_records():
+    message = chat_store.new_message("user", "What is osmosis?", 0)
+    assert not hasattr(message, "__dict__")
+    with pytest.raises(AttributeError):
+        message.extra = True
+    assert chat_store.prompt_id("a") == chat_store.prompt_id("a") != chat_store.prompt_id("b")
+    assert chat_store.preferences_hash("Form 4", {"pace": "slow"}) != chat_store.preferences_hash("Form 4", {})
@@ -0,0 +1,53 @@
+from mindspring import chat_store, chat_view
+
+
+def text(seq, role="user", content=None):
+    return chat_store.ChatMessage(f"m{seq}", seq, role, content or f"message {seq}")
+
+
+def image(seq):
+    return chat_store.ChatMessage(f"m{seq}", seq, "image", {"path": f"{seq}.png"})
+
+
+def test_text_messages_are_grouped_by_sequence_block():
+    messages = [text(seq, "user" if seq % 2 else "assistant") for seq in range(7, 23)]
+    blocks = chat_view.build_blocks(messages)
+    assert [block.kind for block in blocks] == ["text", "text", "text"]
+    assert blocks[0].text == "**You:** message 7\n\n**Tutor:** message 8\n\n**You:** message 9"
+    assert blocks[1].text.count("\n\n") == 9 # Messages 10-19
+    assert blocks[2].text.startswith("**Tutor:** message 20")
+
+
+def test_full_blocks_do_not_change_when_messages_are_appended():
+    messages = [text(seq) for seq in range(0, 15)]
+    before = chat_view.build_blocks(messages)
+    after = chat_view.build_blocks(messages + [text(15, "assistant")])
+    assert before[0].text == after[0].text
+    assert after[1].text == before[1].text + "\n\n**Tutor:** message 15"
+
+
+def test_images_split_text_blocks():
+    blocks = chat_view.build_blocks([text(0), text(1), image(2), text(3)])
+    assert [block.kind for block in blocks] == ["text", "image", "text"]
+    assert blocks[1].message.content == {"path": "2.png"}
+    assert blocks[2].text == "**You:** message 3"
+
+
+def test_unsaved_messages_get_their_own_block():
+    unsaved = chat_store.ChatMessage("pending", None, "assistant", "Still arriving")
+    blocks = chat_view.build_blocks([text(0), unsaved])
+    assert [block.text for block in blocks] == ["**You:** message 0", "**Tutor:** Still arriving"]
+
+
+def test_unclosed_code_fences_are_closed():
+    assert chat_view.format_message("m1", "assistant", "```python\nprint(1)").endswith("print(1)\n```")
+
+
+def test_visible_messages_skip_the_system_prompt_and_report_hidden_ones():
+    history = [chat_store.ChatMessage(None, None, "system", "You are a tutor.")] + [text(seq) for seq in range(5)]
+    visible, hidden = chat_view.visible_messages(history, 3)
+    assert [msg.seq for msg in visible] == [2, 3, 4]
+    assert hidden
+    visible, hidden = chat_view.visible_messages(history, 5)
+    assert [msg.seq for msg in visible] == [0, 1, 2, 3, 4]
+    assert not hidden
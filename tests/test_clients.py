@@ -0,0 +1,57 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from mindspring import clients  # noqa: E402
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Counts POSTs and answers each with the next of the server's scripted replies."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.posts += 1
+        reply = self.server.replies.pop(0) if self.server.replies else 200
+        if reply == "hang":
+            time.sleep(0.5)
+            reply = 200
+        self.send_response(reply)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.posts = 0
+    server.replies = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_timed_out_posts_are_not_resent(server):
+    server.replies = ["hang"]
+    session = clients.build_http_session()
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.post(f"http://127.0.0.1:{server.server_port}/predict", json={}, timeout=(1, 0.1))
+    time.sleep(0.5)
+    assert server.posts == 1
+
+
+def test_unavailable_responses_are_retried(server, monkeypatch):
+    monkeypatch.setattr(clients, "MAX_RETRIES", 1) # One retry, which urllib3 sends without backoff
+    server.replies = [503]
+    session = clients.build_http_session()
+    response = session.post(f"http://127.0.0.1:{server.server_port}/predict", json={}, timeout=(1, 5))
+    assert response.status_code == 200
+    assert server.posts == 2
@@ -0,0 +1,41 @@
+from mindspring import context_budget
+
+
+def conversation(first, last):
+    """System prompt plus numbered alternating student/tutor messages first..last-1."""
+    messages = [{"role": "system", "content": "You are a tutor."}]
+    for number in range(first, last):
+        role = "user" if number % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": f"Message {number} about osmosis. " + "More detail. " * 20})
+    return messages
+
+
+def test_loading_older_messages_then_folding_matches_the_full_history():
+    window = context_budget.ContextWindow(budget=600, min_recent=2)
+    recent = conversation(30, 50)
+    window.build(recent)
+    assert window.folded_count # Part of the loaded page was summarized
+
+    # "Show earlier messages" puts the previous page in front of the history
+    full = [recent[0]] + conversation(10, 30)[1:] + recent[1:]
+    sent, report = window.build(full)
+
+    expected = context_budget.ContextWindow(budget=600, min_recent=2)
+    expected_sent, _ = expected.build(full)
+    assert window.summary_lines == expected.summary_lines
+    assert sent == expected_sent
+    assert report["folded_messages"] == expected.folded_count
+
+
+def test_folding_keeps_the_prefix_for_the_next_turns():
+    window = context_budget.ContextWindow(budget=1200, min_recent=2)
+    sent, _ = window.build(conversation(0, 16))
+    folded = window.folded_count
+    assert folded
+
+    # The next turns fit without folding again, so each extends the previous request unchanged
+    for last in (18, 20):
+        next_sent, _ = window.build(conversation(0, last))
+        assert window.folded_count == folded
+        assert next_sent[:len(sent)] == sent
+        sent = next_sent
@@ -0,0 +1,71 @@
+import datetime
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions
+
+from mindspring import fakes, image_jobs, token_ledger
+
+
+def test_failed_job_write_does_not_hold_the_users_slot():
+    db = fakes.FakeFirestore()
+    release = threading.Event()
+
+    def create_visual(source_text):
+        release.wait(5)
+        return "prompt", "0" * 64
+
+    queue = image_jobs.ImageJobQueue(db, create_visual, max_workers=1, max_per_user=1)
+    db.fail_next_commits = 1 # The job document's write
+    with pytest.raises(exceptions.ServiceUnavailable):
+        queue.submit("alice", "Osmosis is the diffusion of water.", "image-1")
+
+    job_id = queue.submit("alice", "Osmosis is the diffusion of water.", "image-2")
+    release.set()
+    for _ in range(100):
+        if queue.get(job_id).finished:
+            break
+        time.sleep(0.05)
+    assert queue.get(job_id).status == image_jobs.SUCCEEDED
+    assert not queue._in_flight
+
+
+def _lost_job(db, age_seconds):
+    """Stores a charged job that another process left running age_seconds ago."""
+    db.collection("token_balances").document("alice").set({"balance": 100})
+    token_ledger.TokenLedger(db).debit("alice", 50, "image-1", "visual explanation")
+    job_ref = db.collection("users").document("alice").collection("image_jobs").document("job-1")
+    job_ref.set({
+        "status": image_jobs.RUNNING,
+        "request_key": "image-1",
+        "delivered": False,
+        "created_at": datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=age_seconds),
+    })
+    return job_ref
+
+
+def test_jobs_running_elsewhere_are_not_recovered():
+    db = fakes.FakeFirestore()
+    job_ref = _lost_job(db, age_seconds=10)
+    assert image_jobs.ImageJobQueue(db, None).recover("alice") == []
+    assert job_ref.get().get("status") == image_jobs.RUNNING
+    assert token_ledger.TokenLedger(db).balance("alice") == 50
+
+
+def test_lost_jobs_are_failed_and_refunded_once():
+    db = fakes.FakeFirestore()
+    job_ref = _lost_job(db, age_seconds=image_jobs.JOB_LEASE_SECONDS + 60)
+    queue = image_jobs.ImageJobQueue(db, None)
+    assert queue.recover("alice") == ["job-1"]
+    assert queue.get("job-1").status == image_jobs.FAILED
+    assert job_ref.get().get("status") == image_jobs.FAILED
+    assert token_ledger.TokenLedger(db).balance("alice") == 100
+
+    # Another process recovering the same job finds it already failed
+    other = image_jobs.ImageJobQueue(db, None)
+    assert other.recover("alice") == ["job-1"]
+    assert other.get("job-1").status == image_jobs.FAILED
+    assert db.collection("token_balances").document("alice").collection("ledger").document(
+        "refund-image-1").get().exists
+    assert token_ledger.TokenLedger(db).balance("alice") == 100
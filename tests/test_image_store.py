@@ -0,0 +1,51 @@
+import base64
+import io
+
+import pytest
+
+from mindspring import image_store
+
+
+def _png(width, height):
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), "teal").save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_images_are_stored_once_by_content(tmp_path):
+    store = image_store.LocalImageStore(directory=str(tmp_path / "images"), thumbnail_dir=str(tmp_path / "thumbs"))
+    data = _png(40, 20)
+    ref = store.put(data)
+    assert image_store.is_image_ref(ref)
+    assert store.put(data) == ref
+    assert store.get(ref) == data
+    with pytest.raises(ValueError):
+        store.get("../../etc/passwd")
+    with pytest.raises(FileNotFoundError):
+        store.get("0" * 64)
+
+
+def test_thumbnails_fit_the_size_and_are_cached(tmp_path):
+    from PIL import Image
+    store = image_store.LocalImageStore(directory=str(tmp_path / "images"), thumbnail_dir=str(tmp_path / "thumbs"))
+    ref = store.put(_png(1024, 512))
+    with Image.open(io.BytesIO(store.thumbnail(ref, size=128))) as thumbnail:
+        assert thumbnail.size == (128, 64)
+    assert (tmp_path / "thumbs" / f"{ref}-128.png").exists()
+
+
+def test_data_urls_decode_to_their_bytes():
+    data = _png(2, 2)
+    assert image_store.decode_data_url("data:image/png;base64," + base64.b64encode(data).decode()) == data
+    with pytest.raises(ValueError):
+        image_store.decode_data_url("https://example.com/image.png")
+
+
+def test_backends_must_implement_storage():
+    class Incomplete(image_store.ImageStore):
+        def exists(self, ref):
+            return False
+
+    with pytest.raises(TypeError):
+        Incomplete()
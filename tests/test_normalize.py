@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from mindspring import normalize
+
+SUBJECT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "subject_context")
+
+
+def normalized_pages(subject):
+    """Returns the normalized text of each page of a subject's syllabus PDF."""
+    pypdf = pytest.importorskip("pypdf")
+    path = os.path.join(SUBJECT_DIR, f"syl_{subject}.pdf")
+    if not os.path.exists(path):
+        pytest.skip(f"{path} is not available")
+    normalizer = normalize.PageNormalizer()
+    pages = []
+    for page in pypdf.PdfReader(path).pages:
+        pages.extend(normalizer.feed(page.extract_text()))
+    pages.extend(normalizer.finish())
+    return pages
+
+
+def test_content_pages_mentioning_copyright_are_kept():
+    it_page_19 = normalized_pages("Information Technology")[18]
+    assert "SECTION 3: SOCIAL AND ECONOMIC IMPACT" in it_page_19
+    assert "copyright" in it_page_19
+
+    pob_page_36 = normalized_pages("Principles of Business")[35]
+    assert "intellectual" in pob_page_36
+    assert "trademark, copyright, patent" in pob_page_36
+
+
+def test_front_matter_is_dropped():
+    pages = normalized_pages("Information Technology")
+    assert pages[1] == "" # Correspondence address and copyright notice
+    assert pages[65] == "" # Specimen paper 01 cover
+
+
+def _pages(*pages):
+    normalizer = normalize.PageNormalizer()
+    ready = []
+    for page in pages:
+        ready.extend(normalizer.feed(page))
+    return ready + normalizer.finish()
+
+
+def test_only_copyright_boilerplate_lines_are_dropped():
+    page = _pages("\n".join([
+        "Intellectual property",
+        "These include trademarks, copyrights, patents and",
+        "Copyright © 2017 Caribbean Examinations Council",
+        "All rights reserved.",
+    ] + [f"Objective {n} of the section" for n in range(50)]))[0]
+    assert "trademarks, copyrights, patents" in page
+    assert "Caribbean Examinations Council" not in page
+    assert "All rights reserved" not in page
+
+
+def test_later_pages_with_a_copyright_line_are_not_front_matter():
+    filler = "\n".join(f"Line {n} of an ordinary page" for n in range(45))
+    notice = "Unit 5 objectives\nCopyright © 2017 Caribbean Examinations Council"
+    pages = _pages(*[filler] * normalize.FRONT_MATTER_PAGES, notice)
+    assert pages[-1] == "Unit 5 objectives"
+    assert _pages(notice)[0] == ""
@@ -0,0 +1,43 @@
+import pytest
+
+from mindspring import passwords
+
+
+def test_successful_logins_are_not_counted():
+    limiter = passwords.LoginRateLimiter(max_user_failures=2, max_address_failures=2)
+    for index in range(50):
+        limiter.check(f"student{index}", "10.0.0.1")
+        limiter.record_success(f"student{index}")
+    limiter.check("student50", "10.0.0.1")
+
+
+def test_username_failures_are_limited():
+    limiter = passwords.LoginRateLimiter(max_user_failures=2)
+    for _ in range(2):
+        limiter.check("Alice")
+        limiter.record_failure("Alice")
+    with pytest.raises(passwords.LoginRateLimited):
+        limiter.check("alice")
+    limiter.check("bob")
+
+
+def test_address_failures_are_limited_only_with_an_address():
+    limiter = passwords.LoginRateLimiter(max_user_failures=100, max_address_failures=2)
+    for name in ("a", "b"):
+        limiter.record_failure(name, "10.0.0.1")
+    with pytest.raises(passwords.LoginRateLimited):
+        limiter.check("c", "10.0.0.1")
+    limiter.check("c", None)
+
+
+def test_client_address_is_off_unless_configured():
+    assert passwords.client_address("10.0.0.1", "1.2.3.4", source="") is None
+    assert passwords.client_address("10.0.0.1", "1.2.3.4", source="peer") == "10.0.0.1"
+
+
+def test_client_address_from_trusted_proxies():
+    forwarded = "6.6.6.6, 1.2.3.4, 10.0.0.2"
+    assert passwords.client_address("10.0.0.1", forwarded, source="1") == "10.0.0.2"
+    assert passwords.client_address("10.0.0.1", forwarded, source="2") == "1.2.3.4"
+    assert passwords.client_address("10.0.0.1", "1.2.3.4", source="2") is None
+    assert passwords.client_address("10.0.0.1", None, source="1") is None
@@ -0,0 +1,27 @@
+from mindspring import pdf_extract
+
+
+class _Page:
+    def __init__(self, text):
+        self.text = text
+
+    def extract_text(self):
+        if isinstance(self.text, Exception):
+            raise self.text
+        return self.text
+
+
+class _Reader:
+    def __init__(self, *texts):
+        self.pages = [_Page(text) for text in texts]
+
+
+def test_a_failed_page_is_yielded_empty_with_its_error(monkeypatch):
+    monkeypatch.setattr(pdf_extract, "_open", lambda path: _Reader("Page one", ValueError("bad xref"), None, "Four"))
+    pages = list(pdf_extract.iter_pages("syllabus.pdf", workers=1))
+
+    assert [page.index for page in pages] == [0, 1, 2, 3]
+    assert [page.text for page in pages] == ["Page one", "", "", "Four"]
+    assert pages[1].error == "ValueError: bad xref"
+    assert [page.error for page in pages if page.index != 1] == [None, None, None]
+    assert all(page.seconds >= 0 for page in pages)
@@ -0,0 +1,29 @@
+from mindspring import prewarm, retrieval, subjects, syllabus_cache
+
+
+def test_cached_syllabi_are_loaded_without_a_worker(tmp_path, monkeypatch):
+    for name in ("Biology", "Physics", "Geography"):
+        (tmp_path / f"con_{name}.txt").write_text(f"{name} context.")
+        (tmp_path / f"syl_{name}.pdf").write_bytes(b"%PDF-1.7 ...")
+    registry = subjects.SubjectRegistry(directory=str(tmp_path), rescan_interval=0)
+    registry.scan()
+
+    cached_path = registry.get("Biology").syllabus_path
+    started_workers = []
+    monkeypatch.setattr(syllabus_cache, "cached_syllabus", lambda path: path == cached_path or None)
+    # Loading the warmed files into memory is not under test
+    monkeypatch.setattr(syllabus_cache, "get_syllabus", lambda path: None)
+    monkeypatch.setattr(retrieval, "get_index", lambda path: None)
+    monkeypatch.setattr(prewarm, "warm_syllabus", lambda path: {"pages": 1})
+    monkeypatch.setattr(prewarm, "_warm_in_subprocess",
+                        lambda path, page_workers: started_workers.append(path) or {"pages": 1})
+
+    prewarmer = prewarm.Prewarmer(registry, workers=2)
+    prewarmer.start()
+    prewarmer._thread.join(10)
+
+    assert sorted(started_workers) == sorted(registry.get(name).syllabus_path for name in ("Geography", "Physics"))
+    timings = prewarmer.timings()
+    assert timings[cached_path]["source"] == "cache"
+    assert {timing["source"] for path, timing in timings.items() if path != cached_path} == {"worker process"}
+    assert all(prewarmer.status(name) == prewarm.READY for name in registry.names())
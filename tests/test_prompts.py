@@ -0,0 +1,29 @@
+import glob
+import os
+
+from mindspring import context_budget, prompts
+
+SUBJECT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "subject_context")
+
+
+def test_prefix_is_shared_by_every_student_of_a_subject():
+    first = prompts.build_system_prompt("Biology", "Cells.", "Form 4", {"style": "visual", "pace": "slow"})
+    second = prompts.build_system_prompt("Biology", "Cells.\r\n", "Form 5", {"pace": "fast", "style": "visual"})
+    prefix = prompts.subject_prefix("Biology", "Cells.")
+    assert first.startswith(prefix) and second.startswith(prefix)
+    assert first != second
+
+
+def test_preferences_are_stably_ordered():
+    assert prompts.student_parameters("Form 4", {"style": "visual", "pace": "slow"}) == \
+        prompts.student_parameters("Form 4", {"pace": "slow", "style": "visual"})
+
+
+def test_every_subject_prefix_is_long_enough_to_cache():
+    context_files = glob.glob(os.path.join(SUBJECT_DIR, "con_*.txt"))
+    assert context_files
+    for path in context_files:
+        subject = os.path.basename(path)[len("con_"):-len(".txt")]
+        with open(path, encoding="utf-8") as f:
+            prefix = prompts.subject_prefix(subject, f.read())
+        assert context_budget.count_text_tokens(prefix) >= prompts.MIN_CACHEABLE_PREFIX_TOKENS, subject
@@ -0,0 +1,72 @@
+from mindspring import response_cache
+
+SCOPE = ("Biology", "Form 4", "prefs")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rephrased_questions_share_a_reply():
+    cache = response_cache.ResponseCache()
+    cache.store(SCOPE, "What is osmosis?", "Osmosis is...")
+    assert cache.lookup(SCOPE, "what's osmosis??") == "Osmosis is..."
+
+    cache.store(SCOPE, "Explain photosynthesis in plants", "Plants use light...")
+    assert cache.lookup(SCOPE, "Explain photosynthesis in green plants") == "Plants use light..."
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["similar_hits"]) == (1, 1)
+
+
+def test_different_questions_and_scopes_miss():
+    cache = response_cache.ResponseCache()
+    cache.store(SCOPE, "Explain photosynthesis in plants", "Plants use light...")
+    assert cache.lookup(SCOPE, "Explain respiration in animals") is None
+    assert cache.lookup(("Biology", "Form 5", "prefs"), "Explain photosynthesis in plants") is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_follow_up_questions_are_never_cached():
+    cache = response_cache.ResponseCache()
+    cache.store(SCOPE, "Explain that again", "Sure...")
+    assert cache.stats()["size"] == 0
+    assert cache.lookup(SCOPE, "Explain that again") is None
+    assert not response_cache.is_standalone("Can you give another example?")
+    assert response_cache.is_standalone("What is diffusion?")
+
+
+def test_entries_expire_after_the_ttl():
+    clock = Clock()
+    cache = response_cache.ResponseCache(ttl=60, clock=clock)
+    cache.store(SCOPE, "What is osmosis?", "Osmosis is...")
+    clock.now = 60
+    assert cache.lookup(SCOPE, "What is osmosis?") == "Osmosis is..."
+    clock.now = 61
+    assert cache.lookup(SCOPE, "What is osmosis?") is None
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = response_cache.ResponseCache(max_entries=2)
+    cache.store(SCOPE, "What is osmosis?", "osmosis")
+    cache.store(SCOPE, "What is diffusion?", "diffusion")
+    assert cache.lookup(SCOPE, "What is osmosis?") == "osmosis" # Now the most recently used
+    cache.store(SCOPE, "What is an enzyme?", "enzyme")
+    assert cache.lookup(SCOPE, "What is diffusion?") is None
+    assert cache.lookup(SCOPE, "What is osmosis?") == "osmosis"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_minhash_estimates_jaccard_similarity():
+    terms = {f"term{i}" for i in range(20)}
+    signature = response_cache.minhash_signature(terms)
+    assert response_cache.estimated_similarity(signature, response_cache.minhash_signature(terms)) == 1.0
+    overlapping = {f"term{i}" for i in range(10, 30)} # Jaccard similarity 1/3
+    assert 0.15 < response_cache.estimated_similarity(signature, response_cache.minhash_signature(overlapping)) < 0.5
+    disjoint = {f"other{i}" for i in range(20)}
+    assert response_cache.estimated_similarity(signature, response_cache.minhash_signature(disjoint)) < 0.1
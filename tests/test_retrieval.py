@@ -0,0 +1,92 @@
+import pytest
+
+from mindspring import retrieval
+
+
+def chunk(section, text):
+    return {"section": section, "text": text}
+
+
+def test_tokenize_drops_stopwords_and_stems_plurals():
+    assert retrieval.tokenize("The cells and their processes") == ["cell", "process"]
+    assert retrieval.tokenize("Bodies of glass") == ["body", "glass"]
+
+
+def test_search_ranks_the_chunk_with_the_query_terms_first():
+    index = retrieval.BM25Index.build([
+        chunk("SECTION A - CELLS", "Cell structure and the cell membrane."),
+        chunk("SECTION B - NUTRITION", "Photosynthesis in green plants needs light and chlorophyll."),
+        chunk("SECTION C - TRANSPORT", "Osmosis moves water across a partially permeable membrane."),
+    ])
+    results = index.search("What is osmosis across a membrane?", k=2)
+    assert [found["section"] for _, found in results] == ["SECTION C - TRANSPORT", "SECTION A - CELLS"]
+    assert results[0][0] > results[1][0] > 0
+
+
+def test_search_prefers_shorter_chunks_for_the_same_term_frequency():
+    index = retrieval.BM25Index.build([
+        chunk("A", "enzyme " + "padding words here " * 20),
+        chunk("B", "enzyme activity"),
+    ])
+    assert [found["section"] for _, found in index.search("enzyme")] == ["B", "A"]
+
+
+def test_search_returns_nothing_for_unknown_terms_or_an_empty_index():
+    index = retrieval.BM25Index.build([chunk("A", "Cell structure")])
+    assert index.search("volcano") == []
+    assert retrieval.BM25Index.build([]).search("cell") == []
+
+
+def test_index_round_trips_through_json_and_rejects_stale_versions(monkeypatch):
+    index = retrieval.BM25Index.build([chunk("A", "Cell structure"), chunk("B", "Osmosis")], source_sha256="abc")
+    loaded = retrieval.BM25Index.from_json(index.to_json())
+    assert loaded.source_sha256 == "abc"
+    assert loaded.search("osmosis") == index.search("osmosis")
+
+    stored = index.to_json()
+    monkeypatch.setattr(retrieval, "INDEX_VERSION", retrieval.INDEX_VERSION + 1)
+    with pytest.raises(ValueError):
+        retrieval.BM25Index.from_json(stored)
+
+
+def test_chunks_follow_sections_and_skip_page_headers():
+    text = "\n".join([
+        "Rationale for the syllabus.",
+        "SECTION A - LIVING ORGANISMS",
+        "1. Cells",
+        "CXC 20/G/SYLL 13 21 www.cxc.org",
+        "SECTION A - LIVING ORGANISMS (cont'd)",
+        "1.1 describe a cell",
+        "SECTION B - LIFE PROCESSES",
+        "2. Nutrition",
+    ])
+    assert retrieval.chunk_syllabus(text) == [
+        chunk("Introduction", "Rationale for the syllabus."),
+        chunk("SECTION A - LIVING ORGANISMS", "1. Cells 1.1 describe a cell"),
+        chunk("SECTION B - LIFE PROCESSES", "2. Nutrition"),
+    ]
+
+
+def test_long_sections_break_at_numbered_items(monkeypatch):
+    monkeypatch.setattr(retrieval, "CHUNK_TARGET_CHARS", 40)
+    monkeypatch.setattr(retrieval, "CHUNK_MAX_CHARS", 1000)
+    chunks = retrieval.chunk_syllabus("\n".join([
+        "SECTION A - CELLS",
+        "1. Cells",
+        "an explanation that runs past the target size",
+        "continues without breaking here",
+        "1.1 describe a cell",
+    ]))
+    assert [found["text"] for found in chunks] == [
+        "1. Cells an explanation that runs past the target size continues without breaking here",
+        "1.1 describe a cell",
+    ]
+
+
+def test_feeding_pages_matches_chunking_the_whole_text():
+    pages = ["SECTION A - CELLS\n1. Cells\nText one", "1.1 describe a cell\nSECTION B - NUTRITION\n2. Food"]
+    chunker = retrieval.SyllabusChunker()
+    for page in pages:
+        chunker.feed(page)
+    assert chunker.pages == 2
+    assert chunker.finish() == retrieval.chunk_syllabus("\n".join(pages))
@@ -0,0 +1,69 @@
+import os
+import threading
+
+from mindspring import speech
+
+REPLY = ("Osmosis is the movement of water across a membrane. "
+         "It happens from a dilute solution to a concentrated one! "
+         "Does it need energy? No, it is passive.")
+
+
+def test_first_sentence_is_its_own_chunk():
+    chunks = speech.split_into_chunks(REPLY)
+    assert chunks == [
+        "Osmosis is the movement of water across a membrane.",
+        "It happens from a dilute solution to a concentrated one! Does it need energy? No, it is passive.",
+    ]
+    assert speech.split_into_chunks("   ") == []
+
+
+def test_later_sentences_are_grouped_up_to_the_target_size():
+    sentences = [f"Sentence number {i} is here." for i in range(10)] # 26 characters each
+    chunks = speech.split_into_chunks(" ".join(sentences), target_chars=60)
+    assert chunks[0] == sentences[0]
+    assert chunks[1:] == [" ".join(sentences[i:i + 2]) for i in range(1, 10, 2)]
+    assert " ".join(chunks) == " ".join(sentences)
+
+
+def test_first_sentence_waits_until_the_next_one_starts():
+    assert speech.first_sentence("Osmosis is the movement") is None
+    assert speech.first_sentence("Osmosis is the movement of water.") is None
+    assert speech.first_sentence("Osmosis is the movement of water. It") == "Osmosis is the movement of water."
+    assert speech.first_sentence(REPLY) == speech.split_into_chunks(REPLY)[0]
+
+
+def test_audio_cache_evicts_the_least_recently_used_files(tmp_path):
+    cache = speech.AudioCache(directory=str(tmp_path), max_bytes=250)
+    for index, name in enumerate(["old", "new"]):
+        cache.put(name, b"x" * 100)
+        os.utime(tmp_path / f"{name}.mp3", (index, index))
+    assert cache.get("old") == b"x" * 100 # Reading it makes it the most recently used
+    cache.put("newest", b"x" * 100)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["newest.mp3", "old.mp3"]
+
+
+def test_identical_chunks_are_synthesized_once(tmp_path, monkeypatch):
+    release = threading.Event()
+    synthesized = []
+
+    def synthesize(text, lang="en"):
+        release.wait(5)
+        synthesized.append(text)
+        return text.encode("utf-8")
+
+    monkeypatch.setattr(speech, "synthesize", synthesize)
+    synthesizer = speech.SpeechSynthesizer(cache=speech.AudioCache(directory=str(tmp_path)), max_workers=2)
+    synthesizer.prefetch("Osmosis is the movement of water across a membrane.")
+    job = synthesizer.submit(REPLY)
+    release.set()
+    for future in job._futures:
+        future.result(5)
+    assert job.first_chunk() == b"Osmosis is the movement of water across a membrane."
+    assert job.remainder() == speech.split_into_chunks(REPLY)[1].encode("utf-8")
+    assert sorted(synthesized) == sorted(speech.split_into_chunks(REPLY))
+
+    # Later requests are served from the disk cache
+    again = synthesizer.submit(REPLY)
+    for future in again._futures:
+        future.result(5)
+    assert len(synthesized) == 2
@@ -0,0 +1,41 @@
+from mindspring import subjects
+
+
+def _registry(tmp_path, files):
+    for name, content in files.items():
+        (tmp_path / name).write_bytes(content)
+    registry = subjects.SubjectRegistry(directory=str(tmp_path), rescan_interval=0)
+    registry.scan()
+    return registry
+
+
+def test_subjects_are_validated(tmp_path):
+    registry = _registry(tmp_path, {
+        "con_Biology.txt": b"Cells and organisms.",
+        "syl_Biology.pdf": b"%PDF-1.7 ...",
+        "con_Physics.txt": b"Forces.",
+        "con_Chemistry.txt": b"   \n",
+        "syl_Geography.pdf": b"%PDF-1.7 ...",
+        "con_History.txt": b"Emancipation.",
+        "syl_History.pdf": b"<html>not a pdf</html>",
+        "notes.txt": b"ignored",
+    })
+
+    assert registry.names() == ["Biology", "History", "Physics"]
+    assert registry.get("Biology").syllabus_path == str(tmp_path / "syl_Biology.pdf")
+    assert registry.get("History").syllabus_path is None # Not a PDF, so ignored
+    assert registry.get("Chemistry") is None and registry.get("Geography") is None
+    problems = registry.problems()
+    assert any(p.startswith("Chemistry: context file is empty") for p in problems)
+    assert any(p.startswith("Geography: no context file") for p in problems)
+    assert any(p.startswith("History: syllabus file is not a PDF") for p in problems)
+    assert any(p.startswith("Physics: no syllabus PDF") for p in problems)
+
+
+def test_rescan_only_rebuilds_on_changes(tmp_path):
+    registry = _registry(tmp_path, {"con_Biology.txt": b"Cells."})
+    assert not registry.scan()
+
+    (tmp_path / "con_Physics.txt").write_bytes(b"Forces.")
+    assert registry.scan()
+    assert registry.names() == ["Biology", "Physics"]
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from mindspring import pdf_extract, syllabus_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Points the cache at tmp_path and fakes extraction. Returns the list of extracted paths."""
+    monkeypatch.setattr(syllabus_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(syllabus_cache, "_memory", {})
+    extracted = []
+
+    def iter_pages(path):
+        extracted.append(path)
+        with open(path, "rb") as f:
+            content = f.read().decode("utf-8")
+        for index, text in enumerate(content.split("\f")):
+            yield pdf_extract.PageText(index, text, 0.01)
+
+    monkeypatch.setattr(pdf_extract, "iter_pages", iter_pages)
+    return extracted
+
+
+def write_pdf(path, *pages):
+    path.write_bytes("\f".join(pages).encode("utf-8"))
+    return str(path)
+
+
+def test_extracts_once_and_reloads_from_disk(tmp_path, cache, monkeypatch):
+    pdf = write_pdf(tmp_path / "syl_Biology.pdf", "Osmosis is diffusion of water.", "Cells divide.")
+    pages = []
+    first = syllabus_cache.get_syllabus(pdf, on_page=pages.append)
+    assert "Osmosis" in first.text and "Cells divide." in first.text
+    assert len(pages) == 2
+    assert first.meta["pages"] == 2 and first.meta["failed_pages"] == []
+
+    assert syllabus_cache.get_syllabus(pdf) is first
+    # A new process only has the artifacts on disk
+    monkeypatch.setattr(syllabus_cache, "_memory", {})
+    reloaded = syllabus_cache.get_syllabus(pdf)
+    assert reloaded.text == first.text
+    assert syllabus_cache.cached_syllabus(pdf).text == first.text
+    assert len(cache) == 1
+
+
+def test_rebuilds_when_the_pdf_changes(tmp_path, cache):
+    pdf = write_pdf(tmp_path / "syl_Biology.pdf", "Osmosis is diffusion of water.")
+    syllabus_cache.get_syllabus(pdf)
+    write_pdf(tmp_path / "syl_Biology.pdf", "Photosynthesis needs light and water.")
+    assert "Photosynthesis" in syllabus_cache.get_syllabus(pdf).text
+    assert len(cache) == 2
+
+
+def test_touched_but_unchanged_pdf_is_not_rebuilt(tmp_path, cache, monkeypatch):
+    pdf = write_pdf(tmp_path / "syl_Biology.pdf", "Osmosis is diffusion of water.")
+    syllabus_cache.get_syllabus(pdf)
+    stat_result = os.stat(pdf)
+    os.utime(pdf, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10**9))
+    monkeypatch.setattr(syllabus_cache, "_memory", {})
+    assert syllabus_cache.get_syllabus(pdf).meta["mtime_ns"] == stat_result.st_mtime_ns + 10**9
+    assert len(cache) == 1
+
+
+def test_stale_artifact_versions_are_ignored(tmp_path, cache, monkeypatch):
+    pdf = write_pdf(tmp_path / "syl_Biology.pdf", "Osmosis is diffusion of water.")
+    syllabus_cache.get_syllabus(pdf)
+    monkeypatch.setattr(syllabus_cache, "_memory", {})
+    monkeypatch.setattr(syllabus_cache, "ARTIFACT_VERSION", syllabus_cache.ARTIFACT_VERSION + 1)
+    assert syllabus_cache.cached_syllabus(pdf) is None
+    syllabus_cache.get_syllabus(pdf)
+    assert len(cache) == 2
+
+
+def test_failed_pages_are_recorded(tmp_path, cache, monkeypatch):
+    def iter_pages(path):
+        yield pdf_extract.PageText(0, "Osmosis is diffusion of water.", 0.01)
+        yield pdf_extract.PageText(1, "", 0.01, error="PdfReadError: bad page")
+
+    monkeypatch.setattr(pdf_extract, "iter_pages", iter_pages)
+    pdf = write_pdf(tmp_path / "syl_Biology.pdf", "unused")
+    syllabus = syllabus_cache.get_syllabus(pdf)
+    assert syllabus.meta["failed_pages"] == [{"page": 2, "error": "PdfReadError: bad page"}]
+    assert "Osmosis" in syllabus.text
@@ -0,0 +1,58 @@
+import threading
+
+from mindspring import accounts, fakes, token_ledger
+
+
+def test_registration_opens_the_token_balance():
+    db = fakes.FakeFirestore()
+    store = accounts.AccountStore(db)
+    assert store.create("alice", "hash", {"username": "alice"}, tokens=1000)
+
+    ledger = token_ledger.TokenLedger(db)
+    db.reset_counters()
+    assert ledger.balance("alice") == 1000
+    assert db.reads == 1 # The balance document only, never the legacy user field
+    opening = db.collection("token_balances").document("alice").collection("ledger").document("opening").get()
+    assert opening.to_dict()["delta"] == 1000
+    assert ledger.debit("alice", 10, "turn-1", "turn") == 990
+
+
+def test_legacy_accounts_are_seeded_from_the_tokens_field():
+    db = fakes.FakeFirestore()
+    db.collection("users").document("bob").set({"tokens": 50, "chat_history": ["..."] * 100})
+    ledger = token_ledger.TokenLedger(db)
+    assert ledger.balance("bob") == 50
+    assert ledger.debit("bob", 5, "turn-1", "turn") == 45
+
+
+def test_concurrent_debits_are_not_lost_or_overdrawn():
+    initial, workers, debits_per_worker = 150, 8, 25
+    db = fakes.FakeFirestore(latency=0.001)
+    db.collection("users").document("student").set({"tokens": initial})
+    ledger = token_ledger.TokenLedger(db)
+    charged = []
+    rejected = []
+
+    def worker():
+        for _ in range(debits_per_worker):
+            key = token_ledger.new_request_key()
+            try:
+                ledger.debit("student", 1, key, "turn")
+                ledger.debit("student", 1, key, "turn") # Replayed request: must not charge again
+                charged.append(key)
+            except token_ledger.InsufficientTokens:
+                rejected.append(key)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(charged) == initial
+    assert len(rejected) == workers * debits_per_worker - initial
+
+    refunded = charged[:10]
+    for key in refunded:
+        balance = ledger.refund("student", key)
+        assert ledger.refund("student", key) == balance # Second refund of the same debit is a no-op
+    assert ledger.balance("student") == len(refunded)
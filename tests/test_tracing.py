@@ -0,0 +1,49 @@
+import contextvars
+import json
+import time
+
+from mindspring import fakes, image_jobs, speech, tracing
+
+
+def test_summary_quantiles_cover_the_recent_window():
+    tracer = tracing.Tracer(trace_file=None, samples=100)
+    for seconds in range(200): # Only the latest 100 (100..199) are kept
+        tracer.record("openai.ttft", float(seconds), subject="Biology")
+    tracer.record("openai.ttft", 1000.0, subject="Physics")
+
+    [row] = tracer.summary("Biology")
+    assert (row["count"], row["p50"], row["p95"], row["mean"]) == (100, 150.0, 195.0, 149.5)
+    assert tracer.summary()[0]["count"] == 101
+    assert tracer.subjects() == ["Biology", "Physics"]
+    assert 'mindspring_stage_seconds_count{stage="openai.ttft",subject="Physics"} 1' in tracer.prometheus_text()
+
+
+def _spans(path):
+    with open(path, encoding="utf-8") as f:
+        return {span["stage"]: span for span in map(json.loads, f)}
+
+
+def test_spans_on_pool_threads_keep_the_runs_tags(tmp_path, monkeypatch):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setattr(tracing, "_tracer", tracing.Tracer(trace_file=str(trace_file)))
+    monkeypatch.setattr(speech, "synthesize", lambda text, lang="en": b"mp3")
+
+    def create_visual(source_text):
+        tracing.record("openai.image_prompt", 0.1)
+        return "prompt", "0" * 64
+
+    synthesizer = speech.SpeechSynthesizer(cache=speech.AudioCache(directory=str(tmp_path / "tts")))
+    jobs = image_jobs.ImageJobQueue(fakes.FakeFirestore(), create_visual)
+
+    def run():
+        tracing.set_context(user="alice", subject="Biology")
+        return synthesizer.submit("Osmosis is the diffusion of water."), jobs.submit("alice", "Osmosis.", "image-1")
+
+    speech_job, job_id = contextvars.copy_context().run(run)
+    for _ in range(100):
+        if speech_job.done() and jobs.get(job_id).finished:
+            break
+        time.sleep(0.05)
+    spans = _spans(trace_file)
+    for stage in ("tts.synthesize", "openai.image_prompt"):
+        assert (spans[stage]["user"], spans[stage]["subject"]) == ("alice", "Biology")
@@ -0,0 +1,31 @@
+import pytest
+
+from mindspring import chat_store, fakes, token_ledger, turns
+
+
+def _setup(tokens):
+    db = fakes.FakeFirestore()
+    db.collection("token_balances").document("alice").set({"balance": tokens})
+    store = chat_store.ChatStore(db)
+    message = chat_store.new_message("user", "What is osmosis?", 3)
+    db.reset_counters()
+    return db, store, message
+
+
+def test_the_students_message_commits_with_the_debit():
+    db, store, message = _setup(tokens=5)
+    balance = turns.charge_and_store(token_ledger.TokenLedger(db), store, "alice", "session-1", message, 1,
+                                     "turn-1", "chat turn")
+    assert balance == 4
+    assert db.commits == 1
+    stored = store.message_ref("alice", "session-1", message.id).get().to_dict()
+    assert (stored["seq"], stored["content"]) == (3, "What is osmosis?")
+
+
+def test_nothing_is_stored_when_the_turn_cant_be_paid_for():
+    db, store, message = _setup(tokens=0)
+    with pytest.raises(token_ledger.InsufficientTokens):
+        turns.charge_and_store(token_ledger.TokenLedger(db), store, "alice", "session-1", message, 1,
+                               "turn-1", "chat turn")
+    assert db.commits == 0
+    assert not store.message_ref("alice", "session-1", message.id).get().exists
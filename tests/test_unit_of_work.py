@@ -0,0 +1,24 @@
+import time
+
+import pytest
+from google.api_core import exceptions
+
+from mindspring import fakes, unit_of_work
+
+
+def test_failed_explicit_flush_is_retried_by_the_timer():
+    db = fakes.FakeFirestore()
+    work = unit_of_work.UnitOfWork(db, "alice", flush_interval=0.05)
+    work.set_fields({"subject": "Biology"})
+    db.fail_next_commits = 1
+    with pytest.raises(exceptions.ServiceUnavailable):
+        work.flush()
+    assert work.has_pending()
+
+    for _ in range(100):
+        if not work.has_pending():
+            break
+        time.sleep(0.02)
+    assert not work.has_pending()
+    assert db.collection("users").document("alice").get().to_dict() == {"subject": "Biology"}
+    work.close()